@@ -0,0 +1,299 @@
+"""
+Local collector mode: worker processes hand formatted records to a single aggregator process.
+
+Each worker uses a `LokiCollectorHandler`, which formats records and writes them as length-prefixed frames to a
+Unix domain socket. The aggregator process runs a `LokiAggregator` that reads the frames and feeds them into one
+`LokiLoggerHandler`, so a host with many worker processes pushes fewer, larger batches over a single connection.
+"""
+import json
+import logging
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from loki_logger_handler.formatters.logger_formatter import LoggerFormatter
+
+# Frame layout: line length, metadata length, then the JSON encoded line and metadata
+_FRAME_HEADER = struct.Struct("<II")
+_READ_SIZE = 256 * 1024
+
+
+def encode_frame(log_record, loki_metadata=None):
+    """
+    Encode a formatted record as a frame.
+
+    Args:
+        log_record (dict or str): The formatted log record.
+        loki_metadata (dict, optional): The record structured metadata.
+
+    Returns:
+        bytes: The frame.
+    """
+    line = json.dumps(log_record, ensure_ascii=False, default=str).encode("utf-8")
+    metadata = json.dumps(loki_metadata, ensure_ascii=False, default=str).encode("utf-8") if loki_metadata else b""
+    return _FRAME_HEADER.pack(len(line), len(metadata)) + line + metadata
+
+
+def decode_frames(data):
+    """
+    Decode the complete frames at the start of a buffer.
+
+    Args:
+        data (bytearray): Received bytes. Decoded frames are removed from it.
+
+    Returns:
+        list: The (log_record, loki_metadata) tuples.
+    """
+    records = []
+    offset = 0
+    while len(data) - offset >= _FRAME_HEADER.size:
+        line_length, metadata_length = _FRAME_HEADER.unpack_from(data, offset)
+        start = offset + _FRAME_HEADER.size
+        end = start + line_length + metadata_length
+        if end > len(data):
+            break
+        line = json.loads(bytes(data[start:start + line_length]).decode("utf-8"))
+        metadata = {}
+        if metadata_length:
+            metadata = json.loads(bytes(data[start + line_length:end]).decode("utf-8"))
+        records.append((line, metadata))
+        offset = end
+    del data[:offset]
+    return records
+
+
+class LokiCollectorHandler(logging.Handler):
+    """
+    A logging handler that forwards formatted records to a `LokiAggregator` over a Unix domain socket.
+
+    The socket is connected lazily in each process, so the handler can be created before forking.
+    Records that cannot be written (aggregator down or too slow) are dropped and counted rather than
+    blocking the caller; reconnection is attempted at most once per `reconnect_interval`.
+
+    Attributes:
+        socket_path (str): Path of the aggregator socket.
+        dropped_records (int): Number of records that could not be forwarded.
+    """
+
+    def __init__(self, socket_path, default_formatter=LoggerFormatter(), send_timeout=0.5,
+                 reconnect_interval=1.0, enable_self_errors=False):
+        """
+        Initialize the LokiCollectorHandler object.
+
+        Args:
+            socket_path (str): Path of the aggregator socket.
+            default_formatter (logging.Formatter, optional): Formatter for the log records. Defaults to `LoggerFormatter`.
+            send_timeout (float, optional): Seconds to wait for the aggregator to accept a record. Defaults to 0.5.
+            reconnect_interval (float, optional): Minimum seconds between connection attempts. Defaults to 1.
+            enable_self_errors (bool, optional): Set to True to show Handler errors on console. Default False
+        """
+        super(LokiCollectorHandler, self).__init__()
+        self.socket_path = socket_path
+        self.formatter = default_formatter
+        self.send_timeout = send_timeout
+        self.reconnect_interval = reconnect_interval
+        self.enable_self_errors = enable_self_errors
+        self.dropped_records = 0
+        self.error = False
+
+        if self.enable_self_errors:
+            self.debug_logger = logging.getLogger("LokiHandlerDebug")
+            self.debug_logger.setLevel(logging.ERROR)
+            self.debug_logger.addHandler(logging.StreamHandler())
+
+        self._socket = None
+        self._socket_pid = None
+        self._retry_at = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        """
+        Emit a log record.
+
+        Args:
+            record (logging.LogRecord): The log record to be emitted.
+        """
+        try:
+            formatted_record, log_loki_metadata = self.formatter.format(record)
+            self._send_frame(encode_frame(formatted_record, log_loki_metadata))
+        except Exception as e:
+            self.handle_unexpected_error(e)
+
+    def write(self, message):
+        """
+        Write a message to the log.
+
+        Args:
+            message (str): The message to be logged.
+        """
+        self.emit(message.record)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.send_timeout)
+        try:
+            sock.connect(self.socket_path)
+        except (IOError, OSError):
+            sock.close()
+            raise
+        return sock
+
+    def _send_frame(self, frame):
+        with self._lock:
+            if self._socket_pid != os.getpid():
+                # Never share the parent's connection after a fork
+                self._socket = None
+                self._socket_pid = os.getpid()
+
+            if self._socket is None:
+                if time.time() < self._retry_at:
+                    self.dropped_records += 1
+                    return
+                try:
+                    self._socket = self._connect()
+                except (IOError, OSError) as e:
+                    self._retry_at = time.time() + self.reconnect_interval
+                    self.dropped_records += 1
+                    self.handle_unexpected_error(e)
+                    return
+
+            try:
+                self._socket.sendall(frame)
+            except (IOError, OSError) as e:
+                # A partial write breaks the framing, start over on a new connection
+                self._socket.close()
+                self._socket = None
+                self._retry_at = time.time() + self.reconnect_interval
+                self.dropped_records += 1
+                self.handle_unexpected_error(e)
+
+    def close(self):
+        """
+        Close the connection to the aggregator.
+        """
+        with self._lock:
+            if self._socket is not None and self._socket_pid == os.getpid():
+                self._socket.close()
+            self._socket = None
+        super(LokiCollectorHandler, self).close()
+
+    def handle_unexpected_error(self, e):
+        """
+        Handles unexpected errors by logging them and setting the error flag.
+
+        Args:
+            e (Exception): The exception that was raised.
+        """
+        if self.enable_self_errors:
+            self.debug_logger.error("Unexpected error: %s", e, exc_info=True)
+        self.error = True
+
+
+class LokiAggregator(object):
+    """
+    Receives records from `LokiCollectorHandler` workers and feeds them into a single `LokiLoggerHandler`.
+
+    All connections are served by one thread using a selector; labels, structured metadata, batching and
+    pushing are done by the wrapped handler exactly as for records logged in this process.
+
+    Attributes:
+        socket_path (str): Path of the listening Unix domain socket.
+        handler (LokiLoggerHandler): The handler pushing the aggregated records.
+        received_records (int): Number of records received from the workers.
+    """
+
+    def __init__(self, socket_path, handler):
+        """
+        Create the listening socket.
+
+        Args:
+            socket_path (str): Path of the Unix domain socket to listen on. A stale socket file is replaced.
+            handler (LokiLoggerHandler): The handler pushing the aggregated records.
+        """
+        self.socket_path = socket_path
+        self.handler = handler
+        self.received_records = 0
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(socket_path)
+        self._server.listen(128)
+        self._server.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Serve the workers from a background daemon thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def serve_forever(self):
+        """
+        Serve the workers until `close` is called.
+        """
+        buffers = {}
+        while not self._stopped.is_set():
+            for key, _ in self._selector.select(timeout=0.5):
+                if key.fileobj is self._server:
+                    try:
+                        connection, _ = self._server.accept()
+                    except (IOError, OSError):
+                        continue
+                    connection.setblocking(False)
+                    buffers[connection] = bytearray()
+                    self._selector.register(connection, selectors.EVENT_READ)
+                    continue
+
+                connection = key.fileobj
+                try:
+                    data = connection.recv(_READ_SIZE)
+                except (IOError, OSError):
+                    data = b""
+                if not data:
+                    self._selector.unregister(connection)
+                    connection.close()
+                    del buffers[connection]
+                    continue
+
+                pending = buffers[connection]
+                pending += data
+                try:
+                    records = decode_frames(pending)
+                except ValueError as e:
+                    # A corrupt stream cannot be resynchronized, drop the connection
+                    self.handler.handle_unexpected_error(e)
+                    self._selector.unregister(connection)
+                    connection.close()
+                    del buffers[connection]
+                    continue
+                for log_record, loki_metadata in records:
+                    self.received_records += 1
+                    try:
+                        self.handler.put_formatted(log_record, loki_metadata)
+                    except Exception as e:
+                        self.handler.handle_unexpected_error(e)
+
+        for connection in buffers:
+            connection.close()
+
+    def close(self):
+        """
+        Stop serving and remove the socket file.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._selector.close()
+        self._server.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
@@ -0,0 +1,331 @@
+import asyncio
+import concurrent.futures
+import logging
+import time
+
+import requests
+
+from loki_logger_handler.async_loki_request import AsyncLokiRequest
+from loki_logger_handler.buffer import BLOCK_WITH_TIMEOUT
+from loki_logger_handler.circuit_breaker import CircuitOpenError
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler, _live_handlers
+
+
+class AsyncLokiLoggerHandler(LokiLoggerHandler):
+    """
+    A logging handler that sends logs to a Loki server from an asyncio event loop.
+
+    Records are formatted and buffered exactly like `LokiLoggerHandler`, but instead of a dedicated
+    thread the batches are flushed by a task running on the service's event loop, and pushed with
+    `AsyncLokiRequest` over a kept-alive connection. `emit` never blocks the loop.
+
+    The flush task is started by the first record emitted from the loop, or explicitly with `start`.
+    Bodies are serialized and compressed in the loop's default executor. Call `aclose` before the
+    loop stops to push the records still buffered; `close` pushes them as well, from any thread.
+    """
+
+    def __init__(self, url, labels, **kwargs):
+        """
+        Initialize the AsyncLokiLoggerHandler object.
+
+        Args:
+            url (str): The URL of the Loki server.
+            labels (dict): A dictionary of labels to attach to each log message.
+            **kwargs: The options of `LokiLoggerHandler`, except the disk spool, the sender workers and
+                the "block_with_timeout" buffer policy which would block the event loop.
+
+        Raises:
+            ValueError: If an unsupported option is used.
+        """
+        if kwargs.get("spool_directory") is not None:
+            raise ValueError("AsyncLokiLoggerHandler does not support spool_directory")
+        if kwargs.get("sender_workers"):
+            raise ValueError("AsyncLokiLoggerHandler does not support sender_workers")
+        if kwargs.get("buffer_overflow_policy") == BLOCK_WITH_TIMEOUT:
+            raise ValueError("AsyncLokiLoggerHandler does not support the block_with_timeout buffer policy")
+
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._send_lock_async = None
+        super(AsyncLokiLoggerHandler, self).__init__(url, labels, **kwargs)
+
+    def _create_request(self, url, **kwargs):
+        return AsyncLokiRequest(url, **kwargs)
+
+    def _start_flush_thread(self):
+        self.flush_thread = None
+        try:
+            self.start()
+        except RuntimeError:
+            # No running loop yet, the task is started by the first record emitted from the loop
+            pass
+
+    def _reset_after_fork(self):
+        super(AsyncLokiLoggerHandler, self)._reset_after_fork()
+        # The child gets its own event loop, the parent's task and connection are not usable there
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._send_lock_async = None
+        self.request._reader = self.request._writer = None
+
+    def start(self, loop=None):
+        """
+        Start the flush task.
+
+        Args:
+            loop (asyncio.AbstractEventLoop, optional): The loop to run the task on. Defaults to the running loop.
+
+        Raises:
+            RuntimeError: If no loop is given and none is running.
+        """
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = loop if loop is not None else asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._flush_async())
+
+    def emit(self, record):
+        """
+        Emit a log record.
+
+        Args:
+            record (logging.LogRecord): The log record to be emitted.
+        """
+        if self._task is None:
+            try:
+                self.start()
+            except RuntimeError:
+                pass
+        super(AsyncLokiLoggerHandler, self).emit(record)
+
+    def _request_flush(self):
+        self.flush_event.set()
+        if self._wakeup is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _flush_async(self):
+        """
+        Periodically send the buffered logs, until `aclose` is called. Runs as a task on the event loop.
+        """
+        self._wakeup = asyncio.Event()
+        next_tick = time.monotonic() + self.timeout
+        while not self._closing:
+            woken = self.flush_event.is_set()
+            if not woken:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._flush_wait(next_tick))
+                    woken = True
+                except asyncio.TimeoutError:
+                    pass
+            if self._closing:
+                break
+            self._wakeup.clear()
+            self.flush_event.clear()
+
+            if not woken and not self._flush_due(next_tick):
+                continue
+            next_tick = time.monotonic() + self.timeout
+
+            if not self.buffer.empty() and not self._circuit_open():
+                try:
+                    await self._send_async()
+                except Exception as e:
+                    self.handle_unexpected_error(e)
+
+    async def _send_async(self):
+        """
+        Send the buffered logs to the Loki server, the highest priority lane first.
+
+        The lines not pushed yet are put back in the buffer when the circuit breaker opens.
+        Concurrent calls run one after the other.
+        """
+        if self._send_lock_async is None:
+            self._send_lock_async = asyncio.Lock()
+        async with self._send_lock_async:
+            batches = self._drain_batches()
+            for index, (lane, logs) in enumerate(batches):
+                if not await self._deliver_logs_async(logs, lane):
+                    # The circuit breaker opened, keep the lower lanes buffered as well
+                    self._requeue_batches(batches[index + 1:])
+                    return
+
+    async def _deliver_logs_async(self, logs, lane=None):
+        """
+        Encode log lines and post the bodies one after the other.
+
+        Args:
+            logs (list): The LogLine objects to send.
+            lane (Lane, optional): The priority lane the lines were drained from.
+
+        Returns:
+            bool: False if the circuit breaker stopped the delivery.
+        """
+        chunks = self._chunk(logs)
+        for chunk in chunks:
+            delivered = 0
+            for body in await self._encode_off_loop(chunk):
+                try:
+                    if self._circuit_open():
+                        raise CircuitOpenError("Circuit breaker is open, push skipped")
+                    with self._recording_push(body):
+                        await self.request.post(body)
+                except requests.RequestException as e:
+                    if not self._push_failed(e, chunk, delivered, chunks, lane):
+                        return False
+                delivered += body.records
+        return True
+
+    async def _encode_off_loop(self, chunk):
+        """
+        Encode a chunk in the default executor, so that serializing and compressing a large batch
+        does not block the event loop.
+
+        Args:
+            chunk (list): A list of LogLine lists sharing the same labels.
+
+        Returns:
+            list: The encoded bodies.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, self._encode_bodies, chunk)
+        except RuntimeError:
+            # No executor thread can be started once the interpreter is exiting
+            return self._encode_bodies(chunk)
+
+    def _encode_bodies(self, chunk):
+        return list(self._encode_chunk(chunk))
+
+    async def aflush(self):
+        """
+        Send every buffered record now.
+        """
+        await self._send_async()
+
+    def flush(self, timeout=None):
+        """
+        Push the buffered records from another thread, waiting at most `timeout` seconds.
+
+        The push runs on the handler's loop. The loop thread itself cannot wait for it, use `aflush`
+        there; this method then only reports whether records are waiting.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to waiting until the push completes.
+
+        Returns:
+            bool: True if no record is waiting in the buffer.
+        """
+        loop = self._loop
+        if self._closed or loop is None or not loop.is_running():
+            return self.buffer.empty()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not None:
+            return self.buffer.empty()
+
+        future = asyncio.run_coroutine_threadsafe(self.aflush(), loop)
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # The push in progress completes in the background
+            return False
+        except Exception as e:
+            self.handle_unexpected_error(e)
+        return self.buffer.empty()
+
+    def close(self, timeout=None):
+        """
+        Push the buffered records and release the handler, waiting at most `timeout` seconds.
+
+        From another thread, the records are pushed by the handler's loop while it runs, or by a new
+        loop over a new connection once it stopped. The loop thread itself cannot wait: there, the
+        push is left to a task and this method returns at once. Prefer `aclose` from the loop.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to `shutdown_timeout`.
+
+        Returns:
+            bool: True if no record is waiting in the buffer.
+        """
+        if self._closed:
+            return self.buffer.empty()
+        if timeout is None:
+            timeout = self.shutdown_timeout
+        if self._task is not None or not self.buffer.empty():
+            try:
+                self._aclose_from_sync(timeout)
+            except (concurrent.futures.TimeoutError, asyncio.TimeoutError):
+                pass
+            except Exception as e:
+                self.handle_unexpected_error(e)
+        self._release()
+        return self.buffer.empty()
+
+    def _aclose_from_sync(self, timeout):
+        """
+        Run `aclose` from synchronous code, on the loop that can run it.
+
+        Args:
+            timeout (float): Seconds to wait for it.
+        """
+        loop = self._loop
+        loop_running = loop is not None and loop.is_running()
+        if not loop_running:
+            # The flush task and the connection belong to a loop that stopped
+            self._task = None
+            self._send_lock_async = None
+            self.request._reader = self.request._writer = None
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if loop_running and running is not loop:
+            future = asyncio.run_coroutine_threadsafe(self.aclose(), loop)
+            if running is None:
+                try:
+                    future.result(timeout)
+                except concurrent.futures.TimeoutError:
+                    future.cancel()
+                    raise
+        elif running is not None:
+            # The loop thread cannot wait for the push, a task runs it
+            running.create_task(self.aclose())
+        else:
+            asyncio.run(asyncio.wait_for(self.aclose(), timeout))
+
+    def _release(self):
+        if not self._closed:
+            self._closed = True
+            _live_handlers.discard(self)
+            logging.Handler.close(self)
+
+    async def aclose(self):
+        """
+        Stop the flush task, push the records still buffered and close the connection.
+        """
+        task, self._task = self._task, None
+        if task is not None:
+            # Let a push in progress complete: cancelling it would lose the records it drained
+            self._closing = True
+            if self._wakeup is not None:
+                self._wakeup.set()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._wakeup = None
+        await self._send_async()
+        await self.request.aclose()
+        self._release()
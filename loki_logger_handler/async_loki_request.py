@@ -0,0 +1,243 @@
+import asyncio
+import base64
+import ssl
+
+from urllib.parse import urlsplit, unquote
+
+import requests
+
+from loki_logger_handler.loki_request import LokiRequest
+
+
+async def _with_timeout(awaitable, timeout):
+    """
+    Await with a timeout, raising asyncio.TimeoutError when it elapses.
+
+    `asyncio.timeout` is preferred where available: `asyncio.wait_for` can swallow the cancellation
+    of the calling task when the awaitable completes at the same time.
+    """
+    if timeout is None:
+        return await awaitable
+    if not hasattr(asyncio, "timeout"):
+        return await asyncio.wait_for(awaitable, timeout)
+    async with asyncio.timeout(timeout):
+        return await awaitable
+
+
+class _ClosedBeforeResponse(ConnectionResetError):
+    """
+    Loki closed the connection before sending any byte of the response status line.
+    """
+
+
+class AsyncLokiRequest(LokiRequest):
+    """
+    Push logs to a Loki server from an asyncio event loop.
+
+    This is a minimal HTTP/1.1 client that keeps a single connection alive between pushes. Body encoding,
+    headers and the retry policy are shared with `LokiRequest`; only `post` is a coroutine here.
+    Failures are reported with the same `requests.RequestException` as the threaded request.
+    """
+
+    def __init__(self, url, *args, **kwargs):
+        """
+        Initialize the AsyncLokiRequest object.
+
+        Args:
+            url (str): The URL of the Loki server. Credentials in the URL are sent as basic authentication.
+            *args: Positional options of `LokiRequest`.
+            **kwargs: Keyword options of `LokiRequest`.
+        """
+        super(AsyncLokiRequest, self).__init__(url, *args, **kwargs)
+
+        parts = urlsplit(url)
+        self._secure = parts.scheme == "https"
+        self._host = parts.hostname
+        self._port = parts.port or (443 if self._secure else 80)
+        self._path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        self._host_header = parts.netloc.rpartition("@")[2]
+
+        auth = self.auth
+        if auth is None and parts.username:
+            auth = (unquote(parts.username), unquote(parts.password or ""))
+        self._authorization = None
+        if auth is not None:
+            credentials = "{}:{}".format(*auth).encode("utf-8")
+            self._authorization = "Basic " + base64.b64encode(credentials).decode("ascii")
+
+        self._ssl_context = None
+        if self._secure:
+            self._ssl_context = ssl.create_default_context()
+            if not self.insecure_ssl_verify:
+                self._ssl_context.check_hostname = False
+                self._ssl_context.verify_mode = ssl.CERT_NONE
+
+        self._head = self._render_head(self.headers)
+        self._reader = None
+        self._writer = None
+
+    def _create_session(self):
+        return None
+
+    def _render_head(self, headers):
+        """
+        Render the request line and headers, without Content-Length, as bytes.
+        """
+        lines = ["POST {} HTTP/1.1".format(self._path), "Host: {}".format(self._host_header)]
+        if self._authorization is not None:
+            lines.append("Authorization: {}".format(self._authorization))
+        for key, value in headers.items():
+            lines.append("{}: {}".format(key, value))
+        return ("\r\n".join(lines) + "\r\nContent-Length: ").encode("latin-1")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self._host, self._port, ssl=self._ssl_context
+        )
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _read_response(self):
+        """
+        Read a response from the connection.
+
+        Returns:
+            tuple: The status code, the lower-cased response headers and the body.
+        """
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise _ClosedBeforeResponse("Connection closed by Loki")
+        version, status, _ = (status_line.decode("latin-1").rstrip("\r\n") + " ").split(" ", 2)
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await self._reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip trailers up to the final empty line
+                    while (await self._reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await self._reader.readexactly(int(headers["content-length"]))
+        elif status in (204, 304) or status < 200:
+            body = b""
+        else:
+            body = await self._reader.read()
+            headers["connection"] = "close"
+
+        if headers.get("connection", "").lower() == "close" or version == "HTTP/1.0":
+            self._disconnect()
+        return status, headers, body
+
+    async def _round_trip(self, body, head, timeout=(None, None)):
+        """
+        Send a request and read its response, reconnecting once if a kept-alive connection went stale.
+
+        Loki may have received the request once it was written, so it is only sent again when Loki had
+        already closed the kept-alive connection, or closed it without answering any byte.
+
+        Args:
+            body (bytes): The request body.
+            head (bytes): The rendered request line and headers.
+            timeout (tuple): The connect and read timeouts in seconds, None meaning no timeout.
+        """
+        connect_timeout, read_timeout = timeout
+        while True:
+            reused = self._writer is not None
+            if reused and self._reader.at_eof():
+                # Closed by Loki while idle, nothing was sent on it
+                self._disconnect()
+                reused = False
+            if not reused:
+                await _with_timeout(self._connect(), connect_timeout)
+            try:
+                self._writer.write(head + str(len(body)).encode("ascii") + b"\r\n\r\n" + body)
+                await _with_timeout(self._writer.drain(), read_timeout)
+                return await _with_timeout(self._read_response(), read_timeout)
+            except _ClosedBeforeResponse:
+                self._disconnect()
+                if not reused:
+                    raise
+
+    async def post(self, body, headers=None):
+        """
+        Post an already encoded body to the Loki server, retrying transient failures.
+
+        Args:
+            body (bytes): The body returned by `encode`.
+            headers (dict, optional): Headers overriding the default ones for this body.
+                A None value removes the header.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open; nothing was sent.
+            requests.RequestException: If the request fails and cannot be retried.
+        """
+        request_headers = self.body_headers(body, headers)
+        head = self._head if request_headers is self.headers else self._render_head(request_headers)
+        self._check_circuit()
+
+        deadline = self._start_deadline()
+        succeeded = False
+        status_code = None
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                status_code = None
+                response_headers = {}
+                try:
+                    status_code, response_headers, response_body = await self._round_trip(
+                        body, head, self._timeout(deadline)
+                    )
+                    if 200 <= status_code < 300:
+                        succeeded = True
+                        return
+                    error = "{} response: {}".format(status_code, response_body.decode("utf-8", "replace"))
+                except asyncio.TimeoutError:
+                    self._disconnect()
+                    error = "Timed out"
+                except (OSError, asyncio.IncompleteReadError, ValueError) as e:
+                    self._disconnect()
+                    error = str(e) or type(e).__name__
+
+                if self.retry_policy.should_retry(attempt, status_code) and not self._interrupt.is_set():
+                    retry_after = self.retry_policy.parse_retry_after(response_headers.get("retry-after"))
+                    delay = self.retry_policy.compute_delay(attempt, retry_after)
+                    if self._before_deadline(deadline, delay):
+                        await asyncio.sleep(delay)
+                        self.retries += 1
+                        continue
+
+                raise requests.RequestException(
+                    "Error while sending logs: {}, post request URL: {}".format(error, self.url)
+                )
+        finally:
+            self._record_outcome(succeeded, status_code)
+
+    async def aclose(self):
+        """
+        Close the kept-alive connection.
+        """
+        writer = self._writer
+        self._disconnect()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except (OSError, AttributeError):
+                pass
@@ -0,0 +1,188 @@
+import collections
+import threading
+import time
+
+DROP_NEWEST = "drop_newest"
+DROP_OLDEST = "drop_oldest"
+BLOCK_WITH_TIMEOUT = "block_with_timeout"
+
+OVERFLOW_POLICIES = (DROP_NEWEST, DROP_OLDEST, BLOCK_WITH_TIMEOUT)
+
+
+class LogBuffer(object):
+    """
+    A thread-safe FIFO buffer with optional record count and byte caps.
+
+    Records are kept in a ``collections.deque`` so adding a record, evicting the oldest one and
+    draining the whole buffer are all O(1) per record. When a cap is reached the configured
+    overflow policy decides what happens to the incoming record:
+
+    * ``drop_newest``: the incoming record is discarded.
+    * ``drop_oldest``: the oldest buffered records are evicted to make room.
+    * ``block_with_timeout``: the caller waits up to `block_timeout` seconds for the flush thread
+      to free some room, and the incoming record is discarded if it does not. `on_full` is called
+      first, so the flush thread can be woken up to drain the buffer.
+
+    Attributes:
+        max_records (int): Maximum number of buffered records, or None for no limit.
+        max_bytes (int): Maximum estimated size of the buffered records, or None for no limit.
+        overflow_policy (str): What to do when the buffer is full.
+        block_timeout (float): Seconds to wait for room with the ``block_with_timeout`` policy.
+        size_bytes (int): Estimated size of the buffered records.
+        dropped (int): Number of records discarded because the buffer was full.
+        on_full (callable): Called without arguments before waiting for room, or None.
+    """
+
+    def __init__(self, max_records=None, max_bytes=None, overflow_policy=DROP_NEWEST, block_timeout=1.0,
+                 on_full=None):
+        """
+        Initialize the LogBuffer.
+
+        Args:
+            max_records (int, optional): Maximum number of buffered records. Defaults to None (unbounded).
+            max_bytes (int, optional): Maximum estimated size in bytes of the buffered records.
+                Defaults to None (unbounded).
+            overflow_policy (str, optional): One of "drop_newest", "drop_oldest" or "block_with_timeout".
+                Defaults to "drop_newest".
+            block_timeout (float, optional): Seconds to wait for room with "block_with_timeout". Defaults to 1.
+            on_full (callable, optional): Called before waiting for room with "block_with_timeout". Defaults to None.
+
+        Raises:
+            ValueError: If the overflow policy is unknown.
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError("overflow_policy must be one of: {}".format(", ".join(OVERFLOW_POLICIES)))
+
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.on_full = on_full
+
+        self.size_bytes = 0
+        self.dropped = 0
+
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+
+    def _has_room(self, size):
+        if self.max_records is not None and len(self._items) >= self.max_records:
+            return False
+        if self.max_bytes is not None and self._items and self.size_bytes + size > self.max_bytes:
+            return False
+        return True
+
+    def put(self, item, size=0):
+        """
+        Add an item to the buffer, applying the overflow policy if the buffer is full.
+
+        Args:
+            item (object): The item to buffer.
+            size (int, optional): The estimated size of the item in bytes. Defaults to 0.
+
+        Returns:
+            bool: True if the item was buffered, False if it was dropped.
+        """
+        with self._lock:
+            if not self._has_room(size):
+                if self.overflow_policy == DROP_OLDEST:
+                    while self._items and not self._has_room(size):
+                        _, evicted_size = self._items.popleft()
+                        self.size_bytes -= evicted_size
+                        self.dropped += 1
+                elif self.overflow_policy == BLOCK_WITH_TIMEOUT:
+                    if self.on_full is not None:
+                        self.on_full()
+                    deadline = time.monotonic() + self.block_timeout
+                    while not self._has_room(size):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.dropped += 1
+                            return False
+                        self._not_full.wait(remaining)
+                else:
+                    self.dropped += 1
+                    return False
+
+            self._items.append((item, size))
+            self.size_bytes += size
+            return True
+
+    def get(self):
+        """
+        Remove and return the oldest item.
+
+        Returns:
+            object: The oldest buffered item.
+
+        Raises:
+            IndexError: If the buffer is empty.
+        """
+        with self._lock:
+            item, size = self._items.popleft()
+            self.size_bytes -= size
+            self._not_full.notify()
+            return item
+
+    def evict(self):
+        """
+        Discard the oldest item, counting it as dropped.
+
+        Returns:
+            bool: True if an item was discarded, False if the buffer is empty.
+        """
+        with self._lock:
+            if not self._items:
+                return False
+            _, size = self._items.popleft()
+            self.size_bytes -= size
+            self.dropped += 1
+            self._not_full.notify()
+            return True
+
+    def requeue(self, entries):
+        """
+        Put items that could not be pushed back at the head of the buffer, ahead of the newer items.
+
+        The oldest requeued items are dropped if they do not fit the caps.
+
+        Args:
+            entries (list): (item, size) tuples, oldest first.
+        """
+        with self._lock:
+            for item, size in reversed(entries):
+                if not self._has_room(size):
+                    self.dropped += 1
+                    continue
+                self._items.appendleft((item, size))
+                self.size_bytes += size
+
+    def drain(self):
+        """
+        Remove and return every buffered item in FIFO order.
+
+        The underlying deque is swapped out while holding the lock, so producers are only blocked
+        for a constant amount of time regardless of how many items are drained.
+
+        Returns:
+            list: The drained items.
+        """
+        with self._lock:
+            items = self._items
+            self._items = collections.deque()
+            self.size_bytes = 0
+            self._not_full.notify_all()
+        return [item for item, _ in items]
+
+    def qsize(self):
+        """
+        Return the number of buffered items.
+        """
+        return len(self._items)
+
+    def empty(self):
+        """
+        Return True if the buffer holds no items.
+        """
+        return not self._items
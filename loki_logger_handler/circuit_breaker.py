@@ -0,0 +1,121 @@
+import threading
+import time
+
+import requests
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.RequestException):
+    """
+    Raised instead of posting a request while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Stops pushing to Loki after repeated failures, so a Loki outage does not keep the flush thread busy.
+
+    The breaker opens after `failure_threshold` consecutive failed pushes. While it is open, pushes are
+    rejected without any network call and the handler keeps the records in its buffer (or spool).
+    Once `reset_timeout` elapsed, a single probe push is let through (half open): the breaker closes
+    if it succeeds and opens again otherwise.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures opening the breaker.
+        reset_timeout (float): Seconds the breaker stays open before letting a probe through.
+        state (str): "closed", "open" or "half_open".
+        consecutive_failures (int): Number of consecutive failed pushes.
+        transitions (list): The last state changes, as (timestamp, old state, new state) tuples.
+    """
+
+    MAX_TRANSITIONS = 100
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, on_state_change=None):
+        """
+        Initialize a CircuitBreaker object.
+
+        Args:
+            failure_threshold (int, optional): Consecutive failures opening the breaker. Defaults to 5.
+            reset_timeout (float, optional): Seconds the breaker stays open before letting a probe through. Defaults to 30.
+            on_state_change (callable, optional): Called with the old and new state on every transition.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_state_change = on_state_change
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.transitions = []
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """
+        Check whether pushes are currently rejected, without changing the state.
+
+        Returns:
+            bool: True while the breaker is open and its reset timeout has not elapsed.
+        """
+        return self.state == OPEN and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def allow_request(self):
+        """
+        Check whether a push may be attempted. Lets a single probe through once the reset timeout elapsed.
+
+        Returns:
+            bool: True if the push may be attempted.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state != OPEN or time.monotonic() - self._opened_at < self.reset_timeout:
+                # Open, or a probe is already in flight
+                return False
+            transition = self._set_state(HALF_OPEN)
+        self._notify(transition)
+        return True
+
+    def record_success(self):
+        """
+        Record a successful push.
+        """
+        transition = None
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                transition = self._set_state(CLOSED)
+        self._notify(transition)
+
+    def record_failure(self):
+        """
+        Record a failed push.
+        """
+        transition = None
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (
+                    self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                transition = self._set_state(OPEN)
+        self._notify(transition)
+
+    def _set_state(self, state):
+        """
+        Change the state while holding the lock.
+
+        Returns:
+            tuple: The old and new state, to be passed to `_notify` once the lock is released.
+        """
+        old_state, self.state = self.state, state
+        self.transitions.append((time.time(), old_state, state))
+        del self.transitions[:-self.MAX_TRANSITIONS]
+        return old_state, state
+
+    def _notify(self, transition):
+        """
+        Call `on_state_change` outside of the lock, so the callback may use the breaker.
+        """
+        if transition is not None and self.on_state_change is not None:
+            self.on_state_change(*transition)
@@ -0,0 +1,93 @@
+"""
+Record snapshots used by the deferred formatting mode.
+
+With `deferred_formatting`, `emit` does not format records: it stores a cheap snapshot of them, which
+is formatted by the flush thread. The snapshot must not change when the caller later mutates the
+objects it logged, so arguments that may be mutable are resolved right away and the mutable values
+of extra fields are deep-copied; a value that cannot be copied (e.g. holding a lock) is kept as is
+and formatted as it is at flush time. Exceptions are kept as their ``exc_info`` tuple, so that the
+flush thread formats them with the `StacktraceFormatter` cache and deduplication.
+"""
+import copy
+import logging
+
+# Message arguments that can be kept as is, since they cannot change after the call
+_IMMUTABLE_TYPES = frozenset((str, int, float, bool, type(None), bytes))
+
+# Attributes every LogRecord has, the others were passed with `extra`
+_RECORD_ATTRIBUTES = frozenset(logging.LogRecord("", logging.INFO, "", 0, "", (), None).__dict__)
+
+# Estimated size of the fields of a formatted record besides its message
+_RECORD_OVERHEAD_BYTES = 256
+
+
+def _immutable_args(args):
+    if isinstance(args, dict):
+        args = args.values()
+    return _IMMUTABLE_TYPES.issuperset(map(type, args))
+
+
+def _copy_extra(extra, keys):
+    for key in keys:
+        value = extra[key]
+        if type(value) not in _IMMUTABLE_TYPES:
+            try:
+                extra[key] = copy.deepcopy(value)
+            except Exception:
+                pass
+
+
+def snapshot_record(record):
+    """
+    Take a snapshot of a log record that can be formatted later.
+
+    Args:
+        record (logging.LogRecord or dict): The log record, or a loguru record.
+
+    Returns:
+        logging.LogRecord or dict: The snapshot.
+    """
+    if isinstance(record, dict):
+        snapshot = dict(record)
+        if isinstance(snapshot.get("extra"), dict):
+            snapshot["extra"] = dict(snapshot["extra"])
+            _copy_extra(snapshot["extra"], list(snapshot["extra"]))
+        return snapshot
+
+    snapshot = logging.LogRecord.__new__(type(record))
+    snapshot.__dict__ = record.__dict__.copy()
+    _copy_extra(snapshot.__dict__, snapshot.__dict__.keys() - _RECORD_ATTRIBUTES)
+
+    if type(record.msg) is not str or (record.args and not _immutable_args(record.args)):
+        snapshot.msg = record.getMessage()
+        snapshot.args = None
+    elif isinstance(record.args, dict):
+        # A single mapping argument is kept by the record as is, the caller may still mutate it
+        snapshot.args = dict(record.args)
+    return snapshot
+
+
+class DeferredRecord(object):
+    """
+    A buffered record snapshot waiting to be formatted.
+
+    Attributes:
+        record (logging.LogRecord or dict): The record snapshot.
+        size (int): Estimated size of the formatted record in bytes, used to cap the buffer.
+        timestamp_ns (int): The time the record was emitted, in nanoseconds, or None.
+    """
+
+    __slots__ = ("record", "size", "timestamp_ns")
+
+    def __init__(self, record, timestamp_ns=None):
+        """
+        Initialize a DeferredRecord object.
+
+        Args:
+            record (logging.LogRecord or dict): The record snapshot.
+            timestamp_ns (int, optional): The time the record was emitted, in nanoseconds.
+        """
+        self.record = record
+        self.timestamp_ns = timestamp_ns
+        message = record.get("message") if isinstance(record, dict) else record.msg
+        self.size = _RECORD_OVERHEAD_BYTES + (len(message) if isinstance(message, str) else 0)
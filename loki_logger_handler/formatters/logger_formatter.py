@@ -1,35 +1,117 @@
-import traceback
+import logging
 import time
 
+from loki_logger_handler.formatters.stacktrace import StacktraceFormatter
+
+
+def _record_attributes():
+    """
+    List the attributes every LogRecord of the running Python has, e.g. `taskName` since Python 3.12.
+    """
+    return frozenset(logging.LogRecord("", logging.INFO, "", 0, "", (), None).__dict__)
+
+
 class LoggerFormatter:
     """
     A custom formatter for log records that formats the log record into a structured dictionary.
+
+    The output fields are declared once and compiled into a function when the formatter is created,
+    so formatting a record only reads the attributes it needs. Attributes that are not standard
+    LogRecord attributes (e.g. passed with `extra`) are added as is.
+
+    Attributes:
+        DEFAULT_FIELDS (dict): Output fields of every record, mapped to the LogRecord attribute they are read from.
+            "message" is the rendered message and "exc_info" the formatted stacktrace.
+        DEFAULT_ERROR_FIELDS (dict): Additional output fields of the records of the ERROR level.
+        LOG_RECORD_FIELDS (frozenset): Attributes that are never added as custom fields.
     """
-    LOG_RECORD_FIELDS = {
-        "msg",
-        "levelname",
-        "msecs",
-        "name",
-        "pathname",
-        "filename",
-        "module",
-        "lineno",
-        "funcName",
-        "created",
-        "thread",
-        "threadName",
-        "process",
-        "processName",
-        "relativeCreated",
-        "stack_info",
-        "args",
-        "exc_info",
-        "levelno",
-        "exc_text",
+    DEFAULT_FIELDS = {
+        "message": "message",
+        "timestamp": "created",
+        "process": "process",
+        "thread": "thread",
+        "function": "funcName",
+        "module": "module",
+        "name": "name",
+        "level": "levelname",
+    }
+    DEFAULT_ERROR_FIELDS = {
+        "file": "filename",
+        "path": "pathname",
+        "line": "lineno",
+        "stacktrace": "exc_info",
     }
+    _STANDARD_ATTRIBUTES = _record_attributes()
+    # "message" and "asctime" are set on the record by logging.Formatter
+    LOG_RECORD_FIELDS = _STANDARD_ATTRIBUTES | {"message", "asctime"}
 
-    def __init__(self):
-        pass
+    def __init__(self, fields=None, error_fields=None, rename=None, exclude=None, include_extra=True,
+                 stacktrace_cache_size=256, stacktrace_dedup_window=None):
+        """
+        Initialize the LoggerFormatter object.
+
+        Args:
+            fields (dict, optional): Output fields mapped to the LogRecord attribute they are read from.
+                Defaults to `DEFAULT_FIELDS`.
+            error_fields (dict, optional): Additional fields of the records of the ERROR level. Defaults to `DEFAULT_ERROR_FIELDS`.
+            rename (dict, optional): New names of output fields, custom fields included, e.g. {"level": "severity"}.
+            exclude (iterable, optional): Output fields and custom fields to leave out.
+            include_extra (bool, optional): Whether to add the custom fields of the records. Defaults to True.
+            stacktrace_cache_size (int, optional): Number of rendered tracebacks kept to format repeated exceptions. Defaults to 256.
+            stacktrace_dedup_window (float, optional): Seconds during which a repeated stacktrace is replaced with
+                its fingerprint and a repeat count. Defaults to None (always write the full stacktrace).
+        """
+        self.fields = dict(self.DEFAULT_FIELDS if fields is None else fields)
+        self.error_fields = dict(self.DEFAULT_ERROR_FIELDS if error_fields is None else error_fields)
+        self.rename = dict(rename or {})
+        self.exclude = frozenset(exclude or ())
+        self.include_extra = include_extra
+        self.stacktraces = StacktraceFormatter(stacktrace_cache_size, stacktrace_dedup_window)
+
+        # Attributes read by the fields must not be added again as custom fields
+        self._skip_extra = (
+            self.LOG_RECORD_FIELDS | self.exclude | frozenset(self.fields.values()) | frozenset(self.error_fields.values())
+        )
+        self._format_fields = self._compile()
+
+    def _compile(self):
+        """
+        Build the function reading the declared fields of a record.
+
+        Returns:
+            callable: A function taking a LogRecord and returning the formatted fields as a dictionary.
+        """
+        def expression(attribute):
+            if attribute == "message":
+                return "record.getMessage()"
+            if attribute == "exc_info":
+                return "format_stacktrace(attributes.get('exc_info'))"
+            return "attributes.get({!r})".format(attribute)
+
+        def items(fields):
+            return [
+                (self.rename.get(key, key), attribute) for key, attribute in fields.items()
+                if key not in self.exclude
+            ]
+
+        lines = [
+            "def format_fields(record):",
+            "    attributes = record.__dict__",
+            "    formatted = {" + ", ".join(
+                "{!r}: {}".format(key, expression(attribute)) for key, attribute in items(self.fields)
+            ) + "}",
+        ]
+        error_items = items(self.error_fields)
+        if error_items:
+            # Check if the log level indicates an error (case-insensitive and can be partial)
+            lines.append("    if str(attributes.get('levelname', '')).upper().startswith('ER'):")
+            for key, attribute in error_items:
+                lines.append("        formatted[{!r}] = {}".format(key, expression(attribute)))
+        lines.append("    return formatted")
+
+        namespace = {"format_stacktrace": self._format_stacktrace}
+        exec("\n".join(lines), namespace)
+        return namespace["format_fields"]
 
     def format(self, record):
         """
@@ -41,54 +123,33 @@ class LoggerFormatter:
         Returns:
             dict: A dictionary representation of the log record.
         """
-
-        formatted = {
-            "message": record.getMessage(),
-            "timestamp": record.created,
-            "process": record.process,
-            "thread": record.thread,
-            "function": record.funcName,
-            "module": record.module,
-            "name": record.name,
-            "level": record.levelname,
-        }
-
-        # Capture any custom fields added to the log record
-        custom_fields = {
-            key: value for key, value in record.__dict__.items()
-            if key not in self.LOG_RECORD_FIELDS
-        }
-       
+        formatted = self._format_fields(record)
         loki_metadata = {}
 
-        for key in custom_fields:
-            if "loki_metadata" == key:
-                value = getattr(record, key)
-                if isinstance(value, dict):
-                    loki_metadata = value
-            else:
-                formatted[key] = getattr(record, key)
-
-        # Check if the log level indicates an error (case-insensitive and can be partial)
-        if record.levelname.upper().startswith("ER"):
-            formatted["file"] = record.filename
-            formatted["path"] = record.pathname
-            formatted["line"] = record.lineno
-            formatted["stacktrace"] = self._format_stacktrace(record.exc_info)
+        attributes = record.__dict__
+        # Most records have no custom fields, their attributes need not be walked
+        if attributes.keys() - self._STANDARD_ATTRIBUTES:
+            skip = self._skip_extra
+            for key, value in attributes.items():
+                if key in skip:
+                    continue
+                if "loki_metadata" == key:
+                    if isinstance(value, dict):
+                        loki_metadata = value
+                elif self.include_extra:
+                    formatted[self.rename.get(key, key)] = value
 
         return formatted, loki_metadata
 
-    @staticmethod
-    def _format_stacktrace(exc_info):
+    def _format_stacktrace(self, exc_info):
         """
         Format the stacktrace if exc_info is present.
 
         Args:
-            exc_info (tuple or None): Exception info tuple as returned by sys.exc_info().
+            exc_info (tuple or traceback.TracebackException or None): Exception info tuple as returned by
+                sys.exc_info(), or the TracebackException captured by the deferred formatting mode.
 
         Returns:
             str or None: Formatted stacktrace as a string, or None if exc_info is not provided.
         """
-        if exc_info:
-            return "".join(traceback.format_exception(*exc_info))
-        return None
+        return self.stacktraces.format(exc_info)
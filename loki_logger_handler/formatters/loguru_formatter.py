@@ -1,13 +1,20 @@
-import traceback
-import sys
+from loki_logger_handler.formatters.stacktrace import StacktraceFormatter
 
 
 class LoguruFormatter:
     """
     A custom formatter for log records generated by Loguru, formatting the record into a structured dictionary.
     """
-    def __init__(self):
-        pass
+    def __init__(self, stacktrace_cache_size=256, stacktrace_dedup_window=None):
+        """
+        Initialize the LoguruFormatter object.
+
+        Args:
+            stacktrace_cache_size (int, optional): Number of rendered tracebacks kept to format repeated exceptions. Defaults to 256.
+            stacktrace_dedup_window (float, optional): Seconds during which a repeated stacktrace is replaced with
+                its fingerprint and a repeat count. Defaults to None (always write the full stacktrace).
+        """
+        self.stacktraces = StacktraceFormatter(stacktrace_cache_size, stacktrace_dedup_window)
 
     def format(self, record):
         """
@@ -77,18 +84,8 @@ class LoguruFormatter:
             - If the log record contains an exception, this method extracts the exception type,
               value, and traceback, formats the traceback, and adds it to the 'stacktrace' key
               in the formatted dictionary.
-            - Handles both Python 2.7 and Python 3.x versions for formatting exceptions.
+            - Repeated exceptions reuse their rendered frames, see `StacktraceFormatter`.
         """
         if record.get("exception"):
             exc_type, exc_value, exc_traceback = record.get("exception")
-            if sys.version_info[0] == 2:
-                    # Python 2.7: Use the older method for formatting exceptions
-                formatted_traceback = traceback.format_exception(
-                        exc_type, exc_value, exc_traceback
-                    )
-            else:
-                    # Python 3.x: This is the same
-                formatted_traceback = traceback.format_exception(
-                        exc_type, exc_value, exc_traceback
-                    )
-            formatted["stacktrace"] = "".join(formatted_traceback)
+            formatted["stacktrace"] = self.stacktraces.format((exc_type, exc_value, exc_traceback))
@@ -0,0 +1,170 @@
+import hashlib
+import threading
+import time
+import traceback
+
+from collections import OrderedDict
+
+_CAUSE_MESSAGE = "\nThe above exception was the direct cause of the following exception:\n\n"
+_CONTEXT_MESSAGE = "\nDuring handling of the above exception, another exception occurred:\n\n"
+_TRACEBACK_HEADER = "Traceback (most recent call last):\n"
+
+try:
+    _EXCEPTION_GROUP = BaseExceptionGroup  # Python 3.11+
+except NameError:
+    _EXCEPTION_GROUP = ()
+
+
+class StacktraceFormatter(object):
+    """
+    Formats exceptions like `traceback.format_exception`, reusing the rendered frames of repeated exceptions.
+
+    The rendered frames are cached by exception type and by the code object, line and instruction of
+    every frame of the traceback, chained exceptions included. Only the exception messages are
+    rendered again for a cached traceback.
+
+    With `dedup_window`, the full stacktrace of an exception is only written the first time it occurs
+    within the window. It is followed by a ``[stacktrace <fingerprint>]`` line, and the repeats only
+    hold the exception message and a ``[stacktrace <fingerprint> repeated <count> times]`` line.
+
+    Attributes:
+        max_entries (int): Maximum number of cached tracebacks.
+        dedup_window (float): Seconds during which repeated stacktraces are replaced with their fingerprint, or None.
+    """
+
+    def __init__(self, max_entries=256, dedup_window=None):
+        """
+        Initialize a StacktraceFormatter object.
+
+        Args:
+            max_entries (int, optional): Maximum number of cached tracebacks. Defaults to 256.
+            dedup_window (float, optional): Seconds during which repeated stacktraces are replaced with
+                their fingerprint. Defaults to None (always write the full stacktrace).
+        """
+        self.max_entries = max_entries
+        self.dedup_window = dedup_window
+        self._cache = OrderedDict()
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def format(self, exc_info):
+        """
+        Format an exception.
+
+        Args:
+            exc_info (tuple or traceback.TracebackException): Exception info tuple as returned by sys.exc_info(),
+                or an already captured TracebackException.
+
+        Returns:
+            str or None: The formatted stacktrace, or None if there is no exception.
+        """
+        if isinstance(exc_info, traceback.TracebackException):
+            return "".join(exc_info.format())
+        if not exc_info or exc_info[0] is None:
+            return None
+
+        exc_type, exc_value, exc_traceback = exc_info
+        if exc_value is None or (_EXCEPTION_GROUP and isinstance(exc_value, _EXCEPTION_GROUP)):
+            return "".join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+
+        chain = self._chain(exc_type, exc_value, exc_traceback)
+        key = tuple((exc_type, self._frames_key(tb)) for exc_type, _, tb, _ in chain)
+
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+        if entry is None:
+            entry = self._render_frames(key, chain)
+            with self._lock:
+                self._cache[key] = entry
+                if len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        frames, fingerprint = entry
+
+        parts = []
+        if self.dedup_window is not None:
+            repeats = self._count(fingerprint)
+            if repeats:
+                for exc_type, exc_value, _, separator in chain:
+                    parts.extend(traceback.format_exception_only(exc_type, exc_value))
+                    parts.append(separator)
+                parts.append("[stacktrace {} repeated {} times]\n".format(fingerprint, repeats))
+                return "".join(parts)
+
+        for (exc_type, exc_value, _, separator), frames_text in zip(chain, frames):
+            parts.append(frames_text)
+            parts.extend(traceback.format_exception_only(exc_type, exc_value))
+            parts.append(separator)
+        if self.dedup_window is not None:
+            parts.append("[stacktrace {}]\n".format(fingerprint))
+        return "".join(parts)
+
+    @staticmethod
+    def _chain(exc_type, exc_value, exc_traceback):
+        """
+        List the chained exceptions, oldest first, as traceback.format_exception prints them.
+
+        Returns:
+            list: (exception type, exception, traceback, separator printed after it) tuples.
+        """
+        chain = [(exc_type, exc_value, exc_traceback, "")]
+        seen = {id(exc_value)}
+        while True:
+            exc_value = chain[-1][1]
+            cause = exc_value.__cause__
+            context = exc_value.__context__
+            if cause is not None and id(cause) not in seen:
+                following, separator = cause, _CAUSE_MESSAGE
+            elif context is not None and not exc_value.__suppress_context__ and id(context) not in seen:
+                following, separator = context, _CONTEXT_MESSAGE
+            else:
+                break
+            seen.add(id(following))
+            chain.append((type(following), following, following.__traceback__, separator))
+
+        # The separator of an exception is printed after it, before the exception it led to
+        chain.reverse()
+        return chain
+
+    @staticmethod
+    def _frames_key(tb):
+        key = []
+        while tb is not None:
+            key.append((tb.tb_frame.f_code, tb.tb_lineno, tb.tb_lasti))
+            tb = tb.tb_next
+        return tuple(key)
+
+    @staticmethod
+    def _render_frames(key, chain):
+        """
+        Render the frames of every exception of a chain, and their fingerprint.
+        """
+        frames = []
+        for _, _, tb, _ in chain:
+            frames.append(_TRACEBACK_HEADER + "".join(traceback.format_list(traceback.extract_tb(tb))) if tb else "")
+
+        digest = hashlib.sha1()
+        for (exc_type, _), frames_text in zip(key, frames):
+            digest.update(exc_type.__qualname__.encode("utf-8"))
+            digest.update(frames_text.encode("utf-8"))
+        return frames, digest.hexdigest()[:12]
+
+    def _count(self, fingerprint):
+        """
+        Count an occurrence of a stacktrace in the current dedup window.
+
+        Returns:
+            int: The number of previous occurrences within the window.
+        """
+        now = time.time()
+        with self._lock:
+            window = self._seen.get(fingerprint)
+            if window is None or now - window[0] >= self.dedup_window:
+                self._seen[fingerprint] = [now, 0]
+                self._seen.move_to_end(fingerprint)
+                if len(self._seen) > self.max_entries:
+                    self._seen.popitem(last=False)
+                return 0
+            window[1] += 1
+            return window[1]
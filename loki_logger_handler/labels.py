@@ -0,0 +1,240 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+from loki_logger_handler.logproto import format_labels
+
+# Policies applied to the values of a label key that exceeded its cardinality limit
+DEMOTE_TO_METADATA = "metadata"
+REPLACE_WITH_OVERFLOW = "overflow"
+LABEL_OVERFLOW_POLICIES = (DEMOTE_TO_METADATA, REPLACE_WITH_OVERFLOW)
+
+# Label value used by the "overflow" policy
+OVERFLOW_LABEL_VALUE = "__overflow__"
+
+# Marks a label key missing from a log record in the registry lookup keys
+_MISSING = object()
+
+
+class LabelSet(dict):
+    """
+    An immutable set of stream labels.
+
+    Label names and values are stored as strings, the only type Loki accepts. Instances are shared
+    by every log line of a stream, so they must not be modified.
+
+    Attributes:
+        key (str): The labels rendered as a Loki stream selector, ``{key="value", ...}``.
+            Label values are escaped, so two different label sets never share the same key.
+    """
+
+    __slots__ = ("key",)
+
+    def __init__(self, labels=None):
+        """
+        Initialize a LabelSet object.
+
+        Args:
+            labels (dict, optional): The stream labels. Defaults to no labels.
+        """
+        super(LabelSet, self).__init__(
+            (str(key), str(value)) for key, value in (labels or {}).items()
+        )
+        self.key = format_labels(self)
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("LabelSet is immutable")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __reduce__(self):
+        return (LabelSet, (dict(self),))
+
+
+class LabelRegistry(object):
+    """
+    Interns the label sets of the log lines.
+
+    Every distinct combination of static labels and `label_keys` values maps to a single `LabelSet`.
+    The lookup only reads the `label_keys` values of a record, so resolving the labels of a record
+    does not copy or sort any dictionary once its label set is cached. The cache is a bounded LRU.
+
+    With `max_values_per_key`, a label key that takes more distinct values than the limit within a
+    window of `values_window` seconds stops being a label: its values are returned as structured
+    metadata, or replaced with `OVERFLOW_LABEL_VALUE`, so a single bad key cannot create an unbounded
+    number of streams. Every window starts a new count and makes the demoted keys labels again; the
+    cached label sets are dropped then, so the values still in use are counted in the new window.
+
+    Attributes:
+        labels (LabelSet): The static labels.
+        label_keys (tuple): The record keys used as labels.
+        max_entries (int): Maximum number of cached label sets.
+        max_values_per_key (int): Maximum number of distinct values of a label key, or None.
+        overflow_policy (str): What to do with the values of a key over the limit.
+        values_window (float): Seconds over which the distinct values are counted, or None for ever.
+        demoted_keys (frozenset): The label keys that exceeded the limit in the current window.
+        demoted_records (int): Number of records whose labels were demoted.
+    """
+
+    def __init__(self, labels, label_keys=None, max_entries=1024, max_values_per_key=None,
+                 overflow_policy=DEMOTE_TO_METADATA, values_window=600.0, on_demote=None):
+        """
+        Initialize a LabelRegistry object.
+
+        Args:
+            labels (dict): The static labels attached to every log line.
+            label_keys (iterable, optional): Record keys whose values are used as labels. Defaults to None.
+            max_entries (int, optional): Maximum number of cached label sets. Defaults to 1024.
+            max_values_per_key (int, optional): Maximum number of distinct values of a label key. Defaults to None (unlimited).
+            overflow_policy (str, optional): "metadata" to move the values of a key over the limit to structured
+                metadata, or "overflow" to replace them with `OVERFLOW_LABEL_VALUE`. Defaults to "metadata".
+            values_window (float, optional): Seconds over which the distinct values of a key are counted.
+                Defaults to 600. None counts them for ever, so a demoted key is never a label again.
+            on_demote (callable, optional): Called with the label key when it exceeds the limit.
+
+        Raises:
+            ValueError: If the overflow policy is unknown.
+        """
+        if overflow_policy not in LABEL_OVERFLOW_POLICIES:
+            raise ValueError("Unknown label overflow policy: {}".format(overflow_policy))
+        self.labels = LabelSet(labels)
+        self.label_keys = tuple(label_keys or ())
+        self.max_entries = max_entries
+        self.max_values_per_key = max_values_per_key
+        self.overflow_policy = overflow_policy
+        self.values_window = values_window
+        self.on_demote = on_demote
+        self.demoted_keys = frozenset()
+        self.demoted_records = 0
+        self._values = {key: set() for key in self.label_keys}
+        self._window_end = None
+        if max_values_per_key is not None and values_window is not None:
+            self._window_end = time.monotonic() + values_window
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def resolve(self, log_record):
+        """
+        Get the label set of a log record.
+
+        Args:
+            log_record (dict): The formatted log record.
+
+        Returns:
+            tuple: The interned `LabelSet`, and a dictionary of the label values demoted to structured
+                metadata, or None.
+        """
+        if not self.label_keys:
+            return self.labels, None
+
+        if self._window_end is not None and time.monotonic() >= self._window_end:
+            self._start_window()
+
+        lookup, demoted, is_demoted = self._lookup(log_record)
+
+        with self._lock:
+            if is_demoted:
+                self.demoted_records += 1
+            label_set = self._cache.get(lookup)
+            if label_set is not None:
+                self._cache.move_to_end(lookup)
+                return label_set, demoted
+
+        if self.max_values_per_key is not None:
+            lookup, demoted = self._admit(log_record, lookup, demoted, is_demoted)
+
+        labels = dict(self.labels)
+        for key, value in zip(self.label_keys, lookup):
+            if value is not _MISSING:
+                labels[key] = value
+        label_set = LabelSet(labels)
+
+        with self._lock:
+            # Another thread may have interned the same labels in the meantime
+            label_set = self._cache.setdefault(lookup, label_set)
+            self._cache.move_to_end(lookup)
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return label_set, demoted
+
+    def _lookup(self, log_record):
+        """
+        Build the cache key of a log record from its `label_keys` values, applying the demoted keys.
+        """
+        demoted_keys = self.demoted_keys
+        lookup = []
+        demoted = None
+        is_demoted = False
+        for key in self.label_keys:
+            if key not in log_record:
+                lookup.append(_MISSING)
+            elif key in demoted_keys:
+                is_demoted = True
+                if self.overflow_policy == REPLACE_WITH_OVERFLOW:
+                    lookup.append(OVERFLOW_LABEL_VALUE)
+                else:
+                    if demoted is None:
+                        demoted = {}
+                    demoted[key] = log_record[key]
+                    lookup.append(_MISSING)
+            else:
+                value = log_record[key]
+                # Keyed by the rendered label value: 1, 1.0 and True are equal but different labels,
+                # and unhashable values (lists, dicts) are rendered as strings anyway
+                lookup.append(value if value.__class__ is str else str(value))
+
+        return tuple(lookup), demoted, is_demoted
+
+    def _start_window(self):
+        """
+        Start counting the distinct values of the label keys again, making the demoted keys labels again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._window_end:
+                # Started by another thread in the meantime
+                return
+            self._window_end = now + self.values_window
+            self._values = {key: set() for key in self.label_keys}
+            self.demoted_keys = frozenset()
+            self._cache.clear()
+
+    def _admit(self, log_record, lookup, demoted, is_demoted):
+        """
+        Count the distinct values of every label key of a new label set, demoting the keys over the limit.
+        """
+        newly_demoted = []
+        with self._lock:
+            for key, value in zip(self.label_keys, lookup):
+                if value is _MISSING or key in self.demoted_keys:
+                    continue
+                values = self._values[key]
+                value = str(value)
+                if value in values:
+                    continue
+                if len(values) < self.max_values_per_key:
+                    values.add(value)
+                    continue
+                # Cached label sets may hold values of the demoted key
+                self.demoted_keys = self.demoted_keys | {key}
+                self._values[key] = set()
+                self._cache.clear()
+                newly_demoted.append(key)
+
+        if not newly_demoted:
+            return lookup, demoted
+        if not is_demoted:
+            with self._lock:
+                self.demoted_records += 1
+        for key in newly_demoted:
+            if self.on_demote is not None:
+                self.on_demote(key)
+        lookup, demoted, _ = self._lookup(log_record)
+        return lookup, demoted
@@ -0,0 +1,311 @@
+"""
+Priority lanes: per-level buffers with their own flush latency and budget.
+
+By default every record waits in a single FIFO buffer for the same flush tick, so an error can be
+delayed by the flush interval or discarded because the buffer filled up with debug records. With
+lanes, records are buffered by level: an error lane can be flushed almost immediately and keeps its
+own capacity, while the lower lanes are the first ones shed when the shared budget is exhausted.
+"""
+import bisect
+import logging
+import threading
+import time
+
+from loki_logger_handler.buffer import LogBuffer, BLOCK_WITH_TIMEOUT, DROP_NEWEST, DROP_OLDEST
+
+
+def level_number(level):
+    """
+    Convert a level to its number.
+
+    Args:
+        level (int or str): A level number, or a level name such as "ERROR".
+
+    Returns:
+        int: The level number.
+
+    Raises:
+        ValueError: If the level name is unknown.
+    """
+    if isinstance(level, int):
+        return level
+    number = logging.getLevelName(str(level).upper())
+    if not isinstance(number, int):
+        raise ValueError("Unknown level: {}".format(level))
+    return number
+
+
+class Lane(object):
+    """
+    The records of one level and above, up to the level of the next lane.
+
+    Attributes:
+        level (int): The lowest level of the lane records.
+        flush_interval (float): Maximum number of seconds a record waits in the lane before the buffer is
+            flushed, 0 to flush as soon as a record is buffered, or None to wait for the handler `timeout`.
+        max_records (int): Maximum number of records of the lane, or None for no limit.
+        max_bytes (int): Maximum estimated size of the records of the lane, or None for no limit.
+    """
+
+    def __init__(self, level, flush_interval=None, max_records=None, max_bytes=None):
+        """
+        Initialize a Lane object.
+
+        Args:
+            level (int or str): The lowest level of the lane records, e.g. logging.ERROR or "ERROR".
+            flush_interval (float, optional): Maximum seconds a record waits before a flush. Defaults to None (the handler `timeout`).
+            max_records (int, optional): Maximum number of records of the lane. Defaults to None (unbounded).
+            max_bytes (int, optional): Maximum estimated size in bytes of the records of the lane. Defaults to None (unbounded).
+
+        Raises:
+            ValueError: If the level name is unknown.
+        """
+        self.level = level_number(level)
+        self.flush_interval = flush_interval
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+
+    def __repr__(self):
+        return "Lane({}, flush_interval={})".format(logging.getLevelName(self.level), self.flush_interval)
+
+
+class LaneBuffer(object):
+    """
+    A buffer made of one `LogBuffer` per lane, with the interface of `LogBuffer`.
+
+    A lane full of its own records applies the overflow policy to them. When the shared `max_records`
+    or `max_bytes` budget is reached, the oldest records of the lowest non-empty lane below the incoming
+    record's lane are evicted to make room, so a lane never loses capacity to the lanes under it. With the
+    "drop_oldest" policy the incoming record's own lane is shed last, otherwise the record is dropped.
+    The "block_with_timeout" policy only applies to the lane budgets.
+
+    Attributes:
+        lanes (list): The lanes, by increasing level.
+        max_records (int): Maximum number of records of all the lanes, or None for no limit.
+        max_bytes (int): Maximum estimated size of the records of all the lanes, or None for no limit.
+        overflow_policy (str): What to do when a lane, or the buffer, is full.
+        block_timeout (float): Seconds to wait for room in a lane with the ``block_with_timeout`` policy.
+    """
+
+    def __init__(self, lanes, max_records=None, max_bytes=None, overflow_policy=DROP_NEWEST, block_timeout=1.0,
+                 on_full=None):
+        """
+        Initialize the LaneBuffer.
+
+        Args:
+            lanes (list): The `Lane` objects. Records below the lowest lane level go to the lowest lane.
+            max_records (int, optional): Maximum number of records of all the lanes. Defaults to None (unbounded).
+            max_bytes (int, optional): Maximum estimated size in bytes of the records of all the lanes.
+                Defaults to None (unbounded).
+            overflow_policy (str, optional): One of "drop_newest", "drop_oldest" or "block_with_timeout".
+                Defaults to "drop_newest".
+            block_timeout (float, optional): Seconds to wait for room with "block_with_timeout". Defaults to 1.
+            on_full (callable, optional): Called before waiting for room in a lane with "block_with_timeout". Defaults to None.
+
+        Raises:
+            ValueError: If there is no lane, two lanes have the same level, or the overflow policy is unknown.
+        """
+        self.lanes = sorted(lanes, key=lambda lane: lane.level)
+        self._levels = [lane.level for lane in self.lanes]
+        if not self.lanes:
+            raise ValueError("At least one lane is required")
+        if len(set(self._levels)) != len(self._levels):
+            raise ValueError("Lanes must have distinct levels")
+
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+
+        self._buffers = [
+            LogBuffer(lane.max_records, lane.max_bytes, overflow_policy, block_timeout, on_full) for lane in self.lanes
+        ]
+        # Monotonic time of the oldest record of every lane since it was last drained
+        self._first_put = [None] * len(self.lanes)
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def lane_for(self, level):
+        """
+        Get the lane of a level.
+
+        Args:
+            level (int): The record level.
+
+        Returns:
+            Lane: The lane buffering the records of that level.
+        """
+        return self.lanes[self._index(level)]
+
+    def _index(self, level):
+        return max(bisect.bisect_right(self._levels, level) - 1, 0)
+
+    def _has_room(self, size):
+        records = self.qsize()
+        if self.max_records is not None and records >= self.max_records:
+            return False
+        if self.max_bytes is not None and records and self.size_bytes + size > self.max_bytes:
+            return False
+        return True
+
+    def _make_room(self, index, size):
+        """
+        Shed the lowest lanes until a record of the lane at `index` fits the shared budget.
+
+        Returns:
+            bool: True if the record fits.
+        """
+        # The record's own lane may only be shed with the drop_oldest policy
+        limit = index + 1 if self.overflow_policy == DROP_OLDEST else index
+        while not self._has_room(size):
+            for victim in range(limit):
+                if self._buffers[victim].evict():
+                    break
+            else:
+                return False
+        return True
+
+    def put(self, item, size=0, level=logging.NOTSET):
+        """
+        Add an item to the lane of its level, shedding lower lanes if the buffer is full.
+
+        Args:
+            item (object): The item to buffer.
+            size (int, optional): The estimated size of the item in bytes. Defaults to 0.
+            level (int, optional): The level of the record. Defaults to logging.NOTSET.
+
+        Returns:
+            bool: True if the item was buffered, False if it was dropped.
+        """
+        index = self._index(level)
+        if self.max_records is None and self.max_bytes is None:
+            return self._put_in_lane(index, item, size)
+
+        with self._lock:
+            if not self._make_room(index, size):
+                self._rejected += 1
+                return False
+            if self.overflow_policy != BLOCK_WITH_TIMEOUT:
+                # Put while holding the lock, so no other record takes the room made for this one
+                return self._put_in_lane(index, item, size)
+        # Waiting for room in the lane must not block the records of the other lanes
+        return self._put_in_lane(index, item, size)
+
+    def _put_in_lane(self, index, item, size):
+        if not self._buffers[index].put(item, size):
+            return False
+        if self._first_put[index] is None:
+            self._first_put[index] = time.monotonic()
+        return True
+
+    def requeue(self, entries, lane=None):
+        """
+        Put items that could not be pushed back at the head of their lane.
+
+        Args:
+            entries (list): (item, size) tuples, oldest first.
+            lane (Lane, optional): The lane the items were drained from. Defaults to the lowest lane.
+        """
+        index = self.lanes.index(lane) if lane is not None else 0
+        self._buffers[index].requeue(entries)
+        if self._first_put[index] is None:
+            self._first_put[index] = time.monotonic()
+
+    def drain(self):
+        """
+        Remove and return every buffered item, the highest lane first and every lane in FIFO order.
+
+        Returns:
+            list: The drained items.
+        """
+        items = []
+        for index in reversed(range(len(self._buffers))):
+            self._first_put[index] = None
+            items.extend(self._buffers[index].drain())
+        return items
+
+    def drain_lanes(self):
+        """
+        Remove and return the buffered items lane by lane, the highest lane first.
+
+        Returns:
+            list: (lane, items) tuples of the non-empty lanes, every lane in FIFO order.
+        """
+        batches = []
+        for index in reversed(range(len(self._buffers))):
+            self._first_put[index] = None
+            items = self._buffers[index].drain()
+            if items:
+                batches.append((self.lanes[index], items))
+        return batches
+
+    def due_in(self, now=None):
+        """
+        Get the number of seconds until a lane must be flushed.
+
+        An empty lane with a `flush_interval` counts for its interval, so that a record buffered in the
+        meantime is never flushed late. Lanes flushed as soon as a record is buffered are skipped while empty.
+
+        Args:
+            now (float, optional): The current `time.monotonic` value.
+
+        Returns:
+            float: The delay, 0 if a lane is due, or None if no lane has a `flush_interval`.
+        """
+        if now is None:
+            now = time.monotonic()
+        delays = []
+        for lane, first_put in zip(self.lanes, self._first_put):
+            if lane.flush_interval is None:
+                continue
+            if first_put is not None:
+                delays.append(first_put + lane.flush_interval - now)
+            elif lane.flush_interval > 0:
+                delays.append(lane.flush_interval)
+        if not delays:
+            return None
+        return max(min(delays), 0)
+
+    def lane_stats(self):
+        """
+        Describe the lanes.
+
+        Returns:
+            list: For every lane by increasing level, a dict with its "level" name and its buffered
+            "records", "bytes" and "dropped" records.
+        """
+        return [
+            {
+                "level": logging.getLevelName(lane.level),
+                "records": buffer.qsize(),
+                "bytes": buffer.size_bytes,
+                "dropped": buffer.dropped,
+            }
+            for lane, buffer in zip(self.lanes, self._buffers)
+        ]
+
+    @property
+    def size_bytes(self):
+        """
+        int: Estimated size of the buffered records.
+        """
+        return sum(buffer.size_bytes for buffer in self._buffers)
+
+    @property
+    def dropped(self):
+        """
+        int: Number of records discarded because a lane, or the buffer, was full.
+        """
+        return self._rejected + sum(buffer.dropped for buffer in self._buffers)
+
+    def qsize(self):
+        """
+        Return the number of buffered items.
+        """
+        return sum(buffer.qsize() for buffer in self._buffers)
+
+    def empty(self):
+        """
+        Return True if no lane holds items.
+        """
+        return all(buffer.empty() for buffer in self._buffers)
@@ -0,0 +1,152 @@
+"""
+Pure-Python encoder for Loki's native ``logproto.PushRequest`` protobuf message.
+
+Only the subset of the schema needed to push logs is implemented::
+
+    message PushRequest { repeated StreamAdapter streams = 1; }
+    message StreamAdapter { string labels = 1; repeated EntryAdapter entries = 2; }
+    message EntryAdapter {
+        google.protobuf.Timestamp timestamp = 1;
+        string line = 2;
+        repeated LabelPairAdapter structuredMetadata = 3;
+    }
+    message LabelPairAdapter { string name = 1; string value = 2; }
+"""
+import json
+
+# Field keys, pre-computed as (field_number << 3) | wire_type
+_LENGTH_DELIMITED = 2
+_VARINT = 0
+
+_PUSH_STREAMS = bytes(((1 << 3) | _LENGTH_DELIMITED,))
+_STREAM_LABELS = bytes(((1 << 3) | _LENGTH_DELIMITED,))
+_STREAM_ENTRIES = bytes(((2 << 3) | _LENGTH_DELIMITED,))
+_ENTRY_TIMESTAMP = bytes(((1 << 3) | _LENGTH_DELIMITED,))
+_ENTRY_LINE = bytes(((2 << 3) | _LENGTH_DELIMITED,))
+_ENTRY_METADATA = bytes(((3 << 3) | _LENGTH_DELIMITED,))
+_TIMESTAMP_SECONDS = bytes(((1 << 3) | _VARINT,))
+_TIMESTAMP_NANOS = bytes(((2 << 3) | _VARINT,))
+_LABEL_NAME = bytes(((1 << 3) | _LENGTH_DELIMITED,))
+_LABEL_VALUE = bytes(((2 << 3) | _LENGTH_DELIMITED,))
+
+_SMALL_VARINTS = [bytes((i,)) for i in range(128)]
+
+
+def encode_varint(value):
+    """
+    Encode an unsigned integer as a protobuf varint.
+
+    Args:
+        value (int): The value to encode.
+
+    Returns:
+        bytes: The encoded varint.
+    """
+    if value < 128:
+        return _SMALL_VARINTS[value]
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _field(key, payload):
+    """
+    Encode a length-delimited field.
+    """
+    return key + encode_varint(len(payload)) + payload
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    """
+    Render a label set in the Prometheus selector syntax expected by Loki.
+
+    Args:
+        labels (dict): The stream labels.
+
+    Returns:
+        str: The labels rendered as ``{key="value", ...}``.
+    """
+    return "{" + ", ".join(
+        '{}="{}"'.format(key, _escape_label_value(value))
+        for key, value in sorted(labels.items())
+    ) + "}"
+
+
+def encode_entry(timestamp, line, metadata=None):
+    """
+    Encode a single ``EntryAdapter`` message.
+
+    Args:
+        timestamp (int or str): The entry timestamp in nanoseconds since the epoch.
+        line (str or dict): The log line. Non string values are JSON encoded.
+        metadata (dict, optional): Structured metadata attached to the entry.
+
+    Returns:
+        bytes: The encoded entry.
+    """
+    seconds, nanos = divmod(int(timestamp), 1000000000)
+    ts = b""
+    if seconds:
+        ts += _TIMESTAMP_SECONDS + encode_varint(seconds)
+    if nanos:
+        ts += _TIMESTAMP_NANOS + encode_varint(nanos)
+
+    if not isinstance(line, str):
+        line = json.dumps(line, ensure_ascii=False)
+
+    entry = _field(_ENTRY_TIMESTAMP, ts) + _field(_ENTRY_LINE, line.encode("utf-8"))
+    if metadata:
+        for name, value in metadata.items():
+            pair = _field(_LABEL_NAME, str(name).encode("utf-8")) + _field(
+                _LABEL_VALUE, str(value).encode("utf-8")
+            )
+            entry += _field(_ENTRY_METADATA, pair)
+    return entry
+
+
+def encode_stream(labels, entries):
+    """
+    Encode a ``StreamAdapter`` message.
+
+    Args:
+        labels (dict): The stream labels.
+        entries (iterable): Already encoded ``EntryAdapter`` messages.
+
+    Returns:
+        bytes: The encoded stream.
+    """
+    parts = [_field(_STREAM_LABELS, format_labels(labels).encode("utf-8"))]
+    for entry in entries:
+        parts.append(_STREAM_ENTRIES)
+        parts.append(encode_varint(len(entry)))
+        parts.append(entry)
+    return b"".join(parts)
+
+
+def encode_push_request(streams):
+    """
+    Encode a ``PushRequest`` message from a list of Stream objects.
+
+    Args:
+        streams (list): The Stream objects to encode.
+
+    Returns:
+        bytes: The encoded (uncompressed) push request.
+    """
+    parts = []
+    for stream in streams:
+        encoded = encode_stream(
+            stream.stream,
+            (encode_entry(*value) for value in stream.values),
+        )
+        parts.append(_PUSH_STREAMS)
+        parts.append(encode_varint(len(encoded)))
+        parts.append(encoded)
+    return b"".join(parts)
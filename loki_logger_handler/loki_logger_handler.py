@@ -5,15 +5,67 @@ except ImportError:
     import Queue as queue  # Python 2.7
 
 import atexit
+import contextlib
 import logging
+import os
+import shutil
 import threading
+import time
+import weakref
 import requests
 
+from loki_logger_handler.buffer import LogBuffer, DROP_NEWEST
+from loki_logger_handler.circuit_breaker import CircuitOpenError
+from loki_logger_handler.compression import EncodedBody
+from loki_logger_handler.deferred import DeferredRecord, snapshot_record
 from loki_logger_handler.formatters.logger_formatter import LoggerFormatter
-from loki_logger_handler.loki_request import LokiRequest
-from loki_logger_handler.stream import Stream
+from loki_logger_handler.labels import LabelRegistry, LabelSet, DEMOTE_TO_METADATA
+from loki_logger_handler.lanes import LaneBuffer, level_number
+from loki_logger_handler.logproto import format_labels
+from loki_logger_handler.loki_request import LokiRequest, PROTOBUF_FORMAT
+from loki_logger_handler.metrics import Metrics
+from loki_logger_handler.serializers import AUTO, get_serializer
+from loki_logger_handler.spool import Spool, SpoolLockedError, claim_stale_spools
+from loki_logger_handler.stream import Stream, time_ns
 from loki_logger_handler.streams import Streams
 
+# Chunks are cut below the byte budget to leave room for estimation errors
+_CHUNK_FILL_FACTOR = 0.9
+_MIN_ENCODED_SIZE_RATIO = 0.01
+# A record whose own timestamp is further than this from the time it is emitted (e.g. a replayed
+# record) keeps its own timestamp
+_EMIT_TIMESTAMP_TOLERANCE_NS = 1000000000
+# Streams whose last timestamp is tracked by `monotonic_timestamps`, the tracking restarts beyond
+_MAX_STREAM_CLOCKS = 10000
+
+# Handlers to reset in the child process after a fork
+_live_handlers = weakref.WeakSet()
+
+
+def _reset_handlers_after_fork():
+    for handler in list(_live_handlers):
+        try:
+            handler._reset_after_fork()
+        except Exception as e:
+            # A broken handler must not prevent the others from being reset
+            handler.handle_unexpected_error(e)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_handlers_after_fork)
+
+
+def _close_handlers_at_exit():
+    for handler in list(_live_handlers):
+        try:
+            handler.close()
+        except Exception as e:
+            handler.handle_unexpected_error(e)
+
+
+# Runs before logging.shutdown, which was registered when logging was imported
+atexit.register(_close_handlers_at_exit)
+
 
 class LokiLoggerHandler(logging.Handler):
     """
@@ -32,6 +84,27 @@ class LokiLoggerHandler(logging.Handler):
         enable_structured_loki_metadata=False,
         loki_metadata=None,
         loki_metadata_keys=None,
+        max_label_values=None,
+        label_overflow_policy=DEMOTE_TO_METADATA,
+        label_values_window=600.0,
+        json_backend=AUTO,
+        deferred_formatting=False,
+        buffer_max_records=None,
+        buffer_max_bytes=None,
+        buffer_overflow_policy=DROP_NEWEST,
+        buffer_block_timeout=1.0,
+        max_batch_lines=None,
+        max_batch_bytes=None,
+        max_request_bytes=None,
+        spool_directory=None,
+        spool_segment_bytes=16 * 1024 * 1024,
+        spool_max_bytes=None,
+        spool_fsync=False,
+        sender_workers=0,
+        max_in_flight_batches=None,
+        shutdown_timeout=5.0,
+        priority_lanes=None,
+        monotonic_timestamps=False,
         **kwargs
 
     ):
@@ -49,13 +122,48 @@ class LokiLoggerHandler(logging.Handler):
             enable_structured_loki_metadata (bool, optional):  Whether to include structured loki_metadata in the logs. Defaults to False. Only supported for Loki 3.0 and above
             loki_metadata (dict, optional): Default loki_metadata values. Defaults to None. Only supported for Loki 3.0 and above
             loki_metadata_keys (array, optional): Specific log record keys to extract as loki_metadata. Only supported for Loki 3.0 and above
+            max_label_values (int, optional): Maximum number of distinct values of each `label_keys` key within `label_values_window`. A key exceeding it stops being a label until the window ends, see `label_overflow_policy`. Defaults to None (unlimited).
+            label_overflow_policy (str, optional): What to do with the values of a label key over `max_label_values`: "metadata" sends them as structured metadata (Loki 3.0 and above) when `enable_structured_loki_metadata` is set and only keeps them in the log line otherwise, "overflow" replaces them with the "__overflow__" label value. Defaults to "metadata".
+            label_values_window (float, optional): Seconds over which the distinct values of the `label_keys` are counted for `max_label_values`. Every window makes the demoted keys labels again. None counts them for ever. Defaults to 600.
+            json_backend (str, optional): JSON library used to serialize the payloads: "orjson", "ujson", "msgspec" or "json". Defaults to "auto", the fastest installed one.
+            deferred_formatting (bool, optional): Whether to format records in the flush thread instead of the logging thread. `emit` then only stores a snapshot of the record. Defaults to False.
+            buffer_max_records (int, optional): Maximum number of records kept in memory. Defaults to None (unbounded).
+            buffer_max_bytes (int, optional): Maximum estimated size in bytes of the records kept in memory. Defaults to None (unbounded).
+            buffer_overflow_policy (str, optional): What to do when the buffer is full: "drop_newest", "drop_oldest" or "block_with_timeout". Defaults to "drop_newest".
+            buffer_block_timeout (float, optional): Seconds `emit` waits for room with the "block_with_timeout" policy. Defaults to 1 second.
+            max_batch_lines (int, optional): Flush as soon as this many records are buffered instead of waiting for `timeout`. Defaults to None.
+            max_batch_bytes (int, optional): Flush as soon as the buffered records reach this estimated size in bytes instead of waiting for `timeout`. Defaults to None.
+            max_request_bytes (int, optional): Maximum size of a push request body, measured after serialization and compression. Larger batches are split into several requests. Defaults to None (a single request per flush).
+            spool_directory (str, optional): Directory of a disk spool. When set, every encoded batch is written to the spool before being pushed and only deleted once Loki accepted it, so logs survive Loki outages and process restarts. When another process holds the directory lock, the handler spools into a `worker-<pid>` subdirectory instead. Defaults to None (no spool).
+            spool_segment_bytes (int, optional): Size of the spool segment files. Defaults to 16 MiB.
+            spool_max_bytes (int, optional): Maximum size of the spool on disk, the oldest segments are deleted beyond it. Defaults to None (unbounded).
+            spool_fsync (bool, optional): Whether to fsync the spool after every batch. Defaults to False.
+            sender_workers (int, optional): Number of threads posting batches, so the next batch is serialized while the previous ones are in flight. Lines of a stream are always posted by the same worker, in order. Defaults to 0 (the flush thread posts the batches itself).
+            max_in_flight_batches (int, optional): Maximum number of encoded batches queued or being posted by the sender workers. Defaults to twice `sender_workers`.
+            shutdown_timeout (float, optional): Default number of seconds `flush` and `close` wait for the records to be pushed, also used when the interpreter exits. Defaults to 5 seconds.
+            priority_lanes (list, optional): `Lane` objects buffering the records by level, each with its own flush latency and budget, e.g. an ERROR lane flushed immediately. `buffer_max_records` and `buffer_max_bytes` then cap all the lanes, the lowest ones being shed first. Defaults to None (a single buffer).
+            monotonic_timestamps (bool, optional): Whether to make the timestamps of every stream strictly increasing, also across pushes, by moving a timestamp equal to or older than the previous one of its stream 1 ns after it. Loki configured without `unordered_writes` then never rejects entries as out of order. Defaults to False.
         """
         super(LokiLoggerHandler, self).__init__()
 
         self.labels = labels
         self.label_keys = label_keys if label_keys is not None else {}
+        self.max_label_values = max_label_values
+        self.label_overflow_policy = label_overflow_policy
+        self.label_values_window = label_values_window
+        self.label_registry = self._create_label_registry()
         self.timeout = timeout
+        self.max_batch_lines = max_batch_lines
+        self.max_batch_bytes = max_batch_bytes
+        self.max_request_bytes = max_request_bytes
+        # Observed encoded body size per estimated record byte, used to size chunks
+        self._encoded_size_ratio = 1.0
         self.formatter = default_formatter
+        self.serializer = get_serializer(json_backend)
+        self.deferred_formatting = deferred_formatting
+        self.monotonic_timestamps = monotonic_timestamps
+        # Last timestamp pushed per stream key, with `monotonic_timestamps`
+        self._stream_clock = {}
 
         self.enable_self_errors = enable_self_errors
 
@@ -66,16 +174,35 @@ class LokiLoggerHandler(logging.Handler):
             console_handler = logging.StreamHandler()
             self.debug_logger.addHandler(console_handler)
 
-        self.request = LokiRequest(url, **kwargs)
+        self.request = self._create_request(url, **kwargs)
 
-        self.buffer = queue.Queue()
-        self.flush_thread = threading.Thread(target=self._flush)
+        if sender_workers and spool_directory is not None:
+            raise ValueError("sender_workers cannot be combined with spool_directory")
+        self.sender_workers = sender_workers
+        self.max_in_flight_batches = max_in_flight_batches or 2 * sender_workers
 
-        self.flush_event = threading.Event()
+        self.spool = None
+        self._spool_directory = spool_directory
+        # Spools left by forked workers that exited, replayed after the own spool
+        self._stale_spools = []
+        if spool_directory is not None:
+            try:
+                self.spool = Spool(
+                    spool_directory,
+                    segment_max_bytes=spool_segment_bytes,
+                    max_bytes=spool_max_bytes,
+                    fsync=spool_fsync,
+                )
+            except SpoolLockedError:
+                # Another process spools into the directory, use a subdirectory like a forked worker
+                self.spool = self._create_worker_spool(spool_segment_bytes, spool_max_bytes, spool_fsync)
+            self._stale_spools = [Spool(path) for path in claim_stale_spools(spool_directory)]
 
-        # Set daemon for Python 2 and 3 compatibility
-        self.flush_thread.daemon = True
-        self.flush_thread.start()
+        self.priority_lanes = priority_lanes
+        self.buffer = self._create_buffer(
+            buffer_max_records, buffer_max_bytes, buffer_overflow_policy, buffer_block_timeout
+        )
+        self.flush_event = threading.Event()
 
         self.message_in_json_format = message_in_json_format
 
@@ -85,6 +212,186 @@ class LokiLoggerHandler(logging.Handler):
         self.loki_metadata = loki_metadata
         self.loki_metadata_keys = loki_metadata_keys if loki_metadata_keys is not None else []
 
+        self.metrics = Metrics(self._collect_metrics)
+
+        self.shutdown_timeout = shutdown_timeout
+        self._init_flush_state()
+
+        self._forked = False
+        self._fork_lock = threading.Lock()
+        _live_handlers.add(self)
+
+        self._start_flush_thread()
+
+    def _create_request(self, url, **kwargs):
+        """
+        Create the object used to push logs to Loki.
+
+        Args:
+            url (str): The URL of the Loki server.
+            **kwargs: Options forwarded to `LokiRequest`.
+
+        Returns:
+            LokiRequest: The request object.
+        """
+        return LokiRequest(url, **kwargs)
+
+    def _create_buffer(self, max_records, max_bytes, overflow_policy, block_timeout):
+        """
+        Create the buffer of the records waiting to be pushed.
+
+        Args:
+            max_records (int): Maximum number of buffered records, or None.
+            max_bytes (int): Maximum estimated size of the buffered records, or None.
+            overflow_policy (str): What to do when the buffer is full.
+            block_timeout (float): Seconds to wait for room with the "block_with_timeout" policy.
+
+        Returns:
+            LogBuffer or LaneBuffer: The buffer, split in `priority_lanes` when they are set.
+        """
+        if self.priority_lanes is not None:
+            return LaneBuffer(
+                self.priority_lanes, max_records, max_bytes, overflow_policy, block_timeout, self._request_flush
+            )
+        return LogBuffer(
+            max_records=max_records,
+            max_bytes=max_bytes,
+            overflow_policy=overflow_policy,
+            block_timeout=block_timeout,
+            # A producer waiting for room wakes the flush thread up to drain the buffer
+            on_full=self._request_flush,
+        )
+
+    def _create_label_registry(self):
+        """
+        Create the registry resolving the labels of the log records.
+
+        Returns:
+            LabelRegistry: The label registry.
+        """
+        return LabelRegistry(
+            self.labels,
+            self.label_keys,
+            max_values_per_key=self.max_label_values,
+            overflow_policy=self.label_overflow_policy,
+            values_window=self.label_values_window,
+            on_demote=self._label_demoted,
+        )
+
+    def _label_demoted(self, key):
+        """
+        Count a label key that exceeded `max_label_values` in the metrics.
+
+        Args:
+            key (str): The label key.
+        """
+        self.metrics.increment("label_keys_demoted")
+
+    def _init_flush_state(self):
+        """
+        Create the state shared by the flush thread, `flush` and `close`.
+        """
+        # Only one thread at a time drains the buffer and posts
+        self._send_lock = threading.Lock()
+        # Counts of the flushes requested by `flush` and of those the flush thread completed
+        self._flush_done = threading.Condition()
+        self._flush_requested = 0
+        self._flush_completed = 0
+        self._flush_running = False
+        self._closing = False
+        self._closed = False
+
+    def _start_flush_thread(self):
+        """
+        Start the background thread that periodically sends the buffered logs.
+        """
+        self.flush_thread = threading.Thread(target=self._flush)
+
+        # Set daemon for Python 2 and 3 compatibility
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+        self.sender_queues = []
+        self.sender_threads = []
+        if self.sender_workers:
+            self._in_flight = threading.BoundedSemaphore(self.max_in_flight_batches)
+            for _ in range(self.sender_workers):
+                jobs = queue.Queue()
+                sender_thread = threading.Thread(target=self._send_worker, args=(jobs,))
+                sender_thread.daemon = True
+                sender_thread.start()
+                self.sender_queues.append(jobs)
+                self.sender_threads.append(sender_thread)
+
+    def _reset_after_fork(self):
+        """
+        Make the handler usable in a child process after a fork.
+
+        The child inherits a copy of the parent's buffer, a flush thread that no longer runs and the
+        parent's HTTP connections. The buffered records still belong to the parent, which sends them,
+        so the child starts with an empty buffer, a new session, and restarts its threads lazily on
+        the first record it logs. A spool is moved to a per-process subdirectory, since two processes
+        cannot append to the same segment files; the parent keeps replaying it once the child exited.
+        The session and spool files inherited from the parent are closed in the child.
+        """
+        self.buffer = self._create_buffer(
+            self.buffer.max_records,
+            self.buffer.max_bytes,
+            self.buffer.overflow_policy,
+            self.buffer.block_timeout,
+        )
+        self.flush_event = threading.Event()
+        self.flush_thread = None
+        self.label_registry = self._create_label_registry()
+        self._stream_clock = {}
+        self.metrics = Metrics(self._collect_metrics)
+        self._init_flush_state()
+        self.sender_queues = []
+        self.sender_threads = []
+        self.request.close()
+        self.request.session = self.request._create_session()
+        self.request._interrupt = threading.Event()
+        if getattr(self.request, "circuit_breaker", None) is not None:
+            self.request.circuit_breaker._lock = threading.Lock()
+        if self.spool is not None:
+            # The spools claimed by the parent are replayed by the parent
+            for spool in [self.spool] + self._stale_spools:
+                spool.detach()
+            self._stale_spools = []
+            self.spool = self._create_worker_spool(
+                self.spool.segment_max_bytes, self.spool.max_bytes, self.spool.fsync
+            )
+        self._fork_lock = threading.Lock()
+        self._forked = True
+
+    def _create_worker_spool(self, segment_max_bytes, max_bytes, fsync):
+        """
+        Create the spool of this process in a ``worker-<pid>`` subdirectory of the spool directory.
+
+        Args:
+            segment_max_bytes (int): Size after which a new segment is started.
+            max_bytes (int): Maximum total size of the spool, or None.
+            fsync (bool): Whether to fsync every append.
+
+        Returns:
+            Spool: The spool.
+        """
+        return Spool(
+            os.path.join(self._spool_directory, "worker-{}".format(os.getpid())),
+            segment_max_bytes=segment_max_bytes,
+            max_bytes=max_bytes,
+            fsync=fsync,
+        )
+
+    def _restart_after_fork(self):
+        """
+        Start the flush thread of a forked child, once.
+        """
+        with self._fork_lock:
+            if self._forked:
+                self._forked = False
+                self._start_flush_thread()
+
     def emit(self, record):
         """
         Emit a log record.
@@ -93,56 +400,779 @@ class LokiLoggerHandler(logging.Handler):
             record (logging.LogRecord): The log record to be emitted.
         """
         try:
-            formatted_record, log_loki_metadata = self.formatter.format(record)
-            self._put(formatted_record, log_loki_metadata)
+            # Records are emitted under the handler lock, so the timestamps follow the buffer order
+            timestamp_ns = self._emit_timestamp_ns(record)
+            if self.deferred_formatting:
+                self._enqueue(DeferredRecord(snapshot_record(record), timestamp_ns), self._record_level(record))
+            elif self.priority_lanes is not None:
+                formatted_record, log_loki_metadata = self.formatter.format(record)
+                self._put(formatted_record, log_loki_metadata, self._record_level(record), timestamp_ns=timestamp_ns)
+            else:
+                formatted_record, log_loki_metadata = self.formatter.format(record)
+                self._put(formatted_record, log_loki_metadata, timestamp_ns=timestamp_ns)
         except Exception as e:
              self.handle_unexpected_error(e)
 
+    @staticmethod
+    def _emit_timestamp_ns(record):
+        """
+        Take the timestamp of a record being emitted, in nanoseconds.
+
+        `LogRecord.created` is a float, which cannot hold sub-microsecond precision, so records emitted
+        in the same microsecond would share a timestamp. The current time is used instead, unless the
+        record was created long before (e.g. a record replayed from elsewhere).
+
+        Args:
+            record (logging.LogRecord or dict): The log record, or a loguru record.
+
+        Returns:
+            int: The timestamp in nanoseconds since the epoch.
+        """
+        now = time_ns()
+        created = getattr(record, "created", None)
+        if isinstance(created, float) and abs(now - created * 1e9) > _EMIT_TIMESTAMP_TOLERANCE_NS:
+            return int(created * 1e9)
+        return now
+
     def _flush(self):
         """
         Flush the buffer by sending the logs to the Loki server.
-        This function runs in a separate thread and periodically sends logs.
+        This function runs in a separate thread and periodically sends logs, until the handler is closed.
         """
-        atexit.register(self._send)
+        self._flush_running = True
+        next_tick = time.monotonic() + self.timeout
+        try:
+            while not self._closing:
 
-        while True:
+                # Wait until flush_event is set, a lane is due or timeout elapses
+                woken = self.flush_event.wait(timeout=self._flush_wait(next_tick))
 
-            # Wait until flush_event is set or timeout elapses
-            self.flush_event.wait(timeout=self.timeout)
+                # Reset the event for the next cycle
+                self.flush_event.clear()
 
-            # Reset the event for the next cycle
-            self.flush_event.clear()
+                if not woken and not self._flush_due(next_tick):
+                    continue
+                next_tick = time.monotonic() + self.timeout
 
-            if not self.buffer.empty():
-                try:
-                    self._send()
-                except Exception as e:
-                    self.handle_unexpected_error(e)
+                with self._flush_done:
+                    requested = self._flush_requested
+                flush_requested = requested > self._flush_completed
+
+                if self._circuit_open() and self.spool is None:
+                    # Keep the records buffered until Loki can be probed again
+                    continue
+
+                if flush_requested or not self.buffer.empty() or self._spool_pending():
+                    try:
+                        self._send()
+                        if flush_requested:
+                            self._wait_for_senders()
+                    except Exception as e:
+                        self.handle_unexpected_error(e)
+
+                if flush_requested:
+                    with self._flush_done:
+                        self._flush_completed = requested
+                        self._flush_done.notify_all()
+        finally:
+            self._flush_running = False
+            with self._flush_done:
+                self._flush_done.notify_all()
 
+    def _flush_wait(self, next_tick):
+        """
+        Get the number of seconds the flush thread sleeps, until the timeout tick or the next lane deadline.
+
+        Args:
+            next_tick (float): The `time.monotonic` value of the next timeout tick.
 
+        Returns:
+            float: The delay in seconds.
+        """
+        if self.priority_lanes is None:
+            return self.timeout
+        delay = next_tick - time.monotonic()
+        due_in = self.buffer.due_in()
+        if due_in is not None and not self._circuit_open():
+            delay = min(delay, due_in)
+        return max(delay, 0)
+
+    def _flush_due(self, next_tick):
+        """
+        Check whether the flush thread, woken up by no event, should send the buffered records.
+
+        Args:
+            next_tick (float): The `time.monotonic` value of the next timeout tick.
+
+        Returns:
+            bool: True at the timeout tick or when a lane reached its `flush_interval`.
+        """
+        if self.priority_lanes is None or time.monotonic() >= next_tick:
+            return True
+        return self.buffer.due_in() == 0
+
+    def flush(self, timeout=None):
+        """
+        Push every record emitted before the call, waiting at most `timeout` seconds.
+
+        The flush thread is woken up and this method returns once the records it drained were posted
+        (or failed, or were written to the spool). A push still running at the deadline is not interrupted.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to `shutdown_timeout`.
+
+        Returns:
+            bool: True if the records were handed to Loki in time, False otherwise (e.g. while the circuit breaker is open).
+            Once the handler is closed, returns at once whether the buffer is empty.
+        """
+        if self._closed:
+            # logging.shutdown flushes the handlers closed at exit, which must not wait again
+            return self.buffer.empty()
+        return self._flush_and_wait(timeout)
+
+    def _flush_and_wait(self, timeout=None):
+        """
+        Implement `flush`, also while the handler is being closed.
+        """
+        if timeout is None:
+            timeout = self.shutdown_timeout
+        if self._circuit_open() and self.spool is None:
+            return self.buffer.empty()
+        if threading.current_thread() is self.flush_thread:
+            # Waiting for the flush thread from the flush thread would never end
+            return False
+        if not self._flush_running:
+            return self._send_with_deadline(timeout)
+
+        with self._flush_done:
+            self._flush_requested += 1
+            target = self._flush_requested
+            self._request_flush()
+            self._flush_done.wait_for(
+                lambda: self._flush_completed >= target or not self._flush_running, timeout
+            )
+            return self._flush_completed >= target
+
+    def close(self, timeout=None):
+        """
+        Push the buffered records, then stop the flush thread and the sender workers and release the
+        HTTP connections, waiting at most `timeout` seconds in total.
+
+        Called when the interpreter exits. Pushes still running at the deadline stop retrying.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to `shutdown_timeout`.
+
+        Returns:
+            bool: True if the buffered records were handed to Loki in time, False otherwise.
+        """
+        if self._closed:
+            return self.buffer.empty()
+        self._closed = True
+        if timeout is None:
+            timeout = self.shutdown_timeout
+        deadline = time.monotonic() + timeout
+
+        flushed = self._flush_and_wait(timeout)
+
+        self._closing = True
+        self.flush_event.set()
+        threads = list(self.sender_threads)
+        if self.flush_thread is not None and self._flush_running:
+            threads.insert(0, self.flush_thread)
+        for jobs in self.sender_queues:
+            jobs.put(None)
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join(max(deadline - time.monotonic(), 0))
+        if any(thread.is_alive() for thread in threads):
+            # Abort the backoff delays of the pushes still running
+            self.request.interrupt()
+        elif not self.buffer.empty() and deadline > time.monotonic():
+            # Records emitted while the final flush ran, pushed from this thread now that the workers stopped
+            self.sender_queues = []
+            flushed = self._send_with_deadline(deadline - time.monotonic()) and flushed
+
+        self.request.close()
+        if self.spool is not None:
+            self.spool.close()
+        for spool in self._stale_spools:
+            spool.close()
+        _live_handlers.discard(self)
+        super(LokiLoggerHandler, self).close()
+        return flushed
+
+    def _send_with_deadline(self, timeout):
+        """
+        Send the buffered logs from a new thread, when the flush thread is not running.
+
+        Args:
+            timeout (float): Seconds to wait for the send.
+
+        Returns:
+            bool: True if the send completed in time.
+        """
+        done = threading.Event()
+
+        def send():
+            try:
+                self._send()
+            except Exception as e:
+                self.handle_unexpected_error(e)
+            finally:
+                done.set()
+
+        sender = threading.Thread(target=send)
+        sender.daemon = True
+        sender.start()
+        return done.wait(timeout)
+
+    def _wait_for_senders(self):
+        """
+        Wait until the sender workers posted every body dispatched to them.
+        """
+        if not self.sender_queues:
+            return
+        for _ in range(self.max_in_flight_batches):
+            self._in_flight.acquire()
+        for _ in range(self.max_in_flight_batches):
+            self._in_flight.release()
 
     def _send(self):
         """
         Send the buffered logs to the Loki server.
+
+        The drained records are split into several push requests when `max_request_bytes` is set,
+        so that a large backlog is never posted (or lost) as a single oversized body. With
+        `priority_lanes`, the records of every lane are pushed in their own requests, the highest
+        lane first, so errors never wait behind a backlog of lower level records.
+        With a spool, the chunks are appended to it and the spool is then replayed oldest first,
+        unless the circuit breaker is open. Concurrent calls run one after the other.
+        """
+        with self._send_lock:
+            batches = self._drain_batches()
+            for index, (lane, logs) in enumerate(batches):
+                if self.sender_queues:
+                    sent = self._dispatch(logs, lane)
+                else:
+                    sent = self._deliver_logs(logs, lane)
+                if not sent:
+                    # The circuit breaker opened, keep the lower lanes buffered as well
+                    self._requeue_batches(batches[index + 1:])
+                    break
+
+            if self.sender_queues:
+                return
+
+            if self.spool is not None and not self._circuit_open():
+                try:
+                    self.spool.replay(self._post_spooled)
+                    self._replay_stale_spools()
+                except requests.RequestException as e:
+                    self.handle_unexpected_error(e)
+
+    def _spool_pending(self):
+        """
+        Check whether the spool, or a spool claimed from an exited worker, holds unsent frames.
+
+        Returns:
+            bool: True if frames are waiting to be replayed.
+        """
+        if self.spool is None:
+            return False
+        return self.spool.pending() or any(spool.pending() for spool in self._stale_spools)
+
+    def _replay_stale_spools(self):
+        """
+        Replay the spools claimed from exited workers, deleting each one once it is empty.
+
+        Raises:
+            requests.RequestException: If a frame was not acknowledged; it stays spooled.
+        """
+        for spool in list(self._stale_spools):
+            spool.replay(self._post_spooled)
+            if not spool.pending():
+                spool.close()
+                shutil.rmtree(spool.directory, ignore_errors=True)
+                self._stale_spools.remove(spool)
+
+    def _circuit_open(self):
+        """
+        Check whether the circuit breaker of the request currently rejects pushes.
+
+        Returns:
+            bool: True if pushes are rejected.
+        """
+        breaker = getattr(self.request, "circuit_breaker", None)
+        return breaker is not None and breaker.is_open()
+
+    def _deliver_logs(self, logs, lane=None):
+        """
+        Encode log lines and deliver the bodies one after the other.
+
+        When the circuit breaker is open, or opens on the way, the lines not pushed yet are put back
+        in the buffer instead of being lost.
+
+        Args:
+            logs (list): The LogLine objects to send.
+            lane (Lane, optional): The priority lane the lines were drained from.
+
+        Returns:
+            bool: False if the circuit breaker stopped the delivery.
+        """
+        chunks = self._chunk(logs)
+        for chunk in chunks:
+            delivered = 0
+            for body in self._encode_chunk(chunk):
+                try:
+                    if self.spool is None and self._circuit_open():
+                        raise CircuitOpenError("Circuit breaker is open, push skipped")
+                    self._deliver(body)
+                except requests.RequestException as e:
+                    if not self._push_failed(e, chunk, delivered, chunks, lane):
+                        return False
+                delivered += body.records
+        return True
+
+    def _push_failed(self, error, chunk, delivered, later_chunks, lane=None):
+        """
+        Handle a body of a chunk that could not be pushed.
+
+        A failed push is reported and its lines are dropped. When the circuit breaker is open, the
+        lines of the chunk not pushed yet and those of the later chunks are put back in the buffer.
+
+        Args:
+            error (requests.RequestException): The error of the push.
+            chunk (list): The chunk the body was encoded from, as a list of LogLine lists.
+            delivered (int): The number of lines of the chunk in the bodies already handled.
+            later_chunks (iterable): The chunks of the batch not encoded yet.
+            lane (Lane, optional): The priority lane the lines were drained from.
+
+        Returns:
+            bool: False if the circuit breaker stopped the delivery.
+        """
+        if isinstance(error, CircuitOpenError):
+            unsent = self._chunk_lines(chunk)[delivered:]
+            for later_chunk in later_chunks:
+                unsent.extend(self._chunk_lines(later_chunk))
+            self._requeue(unsent, lane)
+            return False
+        self.handle_unexpected_error(error)
+        return True
+
+    def _requeue_batches(self, batches):
+        """
+        Put drained batches that were not pushed back in the buffer.
+
+        Args:
+            batches (list): (lane, LogLine list) pairs, as returned by `_drain_batches`.
+        """
+        for lane, logs in batches:
+            self._requeue(logs, lane)
+
+    def _requeue(self, logs, lane=None):
+        """
+        Put log lines that could not be pushed because the circuit breaker is open back in the buffer.
+
+        Args:
+            logs (list): The LogLine objects, oldest first.
+            lane (Lane, optional): The priority lane the lines were drained from.
+        """
+        if not logs:
+            return
+        if self.monotonic_timestamps:
+            # The lines were not pushed, their stream clock must not be ahead of them
+            for log in logs:
+                if log.timestamp_ns is not None and log.timestamp_ns <= self._stream_clock.get(log.key, 0):
+                    self._stream_clock[log.key] = log.timestamp_ns - 1
+        entries = [(log, log.size) for log in logs]
+        if self.priority_lanes is None:
+            self.buffer.requeue(entries)
+        else:
+            self.buffer.requeue(entries, lane)
+
+    @staticmethod
+    def _chunk_lines(chunk):
+        """
+        Flatten a chunk, as a list of LogLine lists, in the order its bodies are encoded.
+        """
+        return [log for stream_logs in chunk for log in stream_logs]
+
+    def _dispatch(self, logs, lane=None):
+        """
+        Encode log lines and hand the bodies over to the sender workers.
+
+        Every stream is pinned to one worker, so its lines are posted in order even though several
+        batches are in flight. Blocks while `max_in_flight_batches` bodies are waiting to be posted.
+        The lines are put back in the buffer while the circuit breaker is open.
+
+        Args:
+            logs (list): The LogLine objects to send.
+            lane (Lane, optional): The priority lane the lines were drained from.
+
+        Returns:
+            bool: False if the circuit breaker stopped the dispatch.
+        """
+        shards = [[] for _ in self.sender_queues]
+        for log in logs:
+            shards[hash(log.key) % len(shards)].append(log)
+
+        for index, (jobs, shard_logs) in enumerate(zip(self.sender_queues, shards)):
+            chunks = self._chunk(shard_logs)
+            for chunk in chunks:
+                if self._circuit_open():
+                    unsent = self._chunk_lines(chunk)
+                    for later_chunk in chunks:
+                        unsent.extend(self._chunk_lines(later_chunk))
+                    for later_logs in shards[index + 1:]:
+                        unsent.extend(later_logs)
+                    self._requeue(unsent, lane)
+                    return False
+                for body in self._encode_chunk(chunk):
+                    body.lane = lane
+                    self._in_flight.acquire()
+                    jobs.put(body)
+        return True
+
+    def _send_worker(self, jobs):
+        """
+        Post the bodies queued for one sender worker, in order.
+
+        Args:
+            jobs (queue.Queue): The queue of encoded bodies.
+        """
+        while True:
+            body = jobs.get()
+            if body is None:
+                # Stopped by close
+                return
+            stopped = False
+            try:
+                self._post(body)
+            except CircuitOpenError:
+                stopped = self._requeue_jobs(body, jobs)
+            except Exception as e:
+                self.handle_unexpected_error(e)
+            finally:
+                self._in_flight.release()
+            if stopped:
+                return
+
+    def _requeue_jobs(self, body, jobs):
+        """
+        Put the lines of a body rejected by the open circuit breaker back in the buffer, together with
+        those of the bodies still queued behind it, which would be rejected as well.
+
+        Args:
+            body (EncodedBody): The rejected body.
+            jobs (queue.Queue): The queue of the sender worker.
+
+        Returns:
+            bool: True if the worker was stopped by close while its queue was emptied.
+        """
+        bodies = [body]
+        stopped = False
+        while True:
+            try:
+                queued = jobs.get_nowait()
+            except queue.Empty:
+                break
+            if queued is None:
+                stopped = True
+                break
+            bodies.append(queued)
+            self._in_flight.release()
+
+        # Consecutive bodies of a lane are requeued at once, the newest first since a requeue
+        # puts the lines back at the head of the buffer
+        groups = []
+        for queued in bodies:
+            if groups and groups[-1][0] is queued.lane:
+                groups[-1][1].extend(self._chunk_lines(queued.chunk))
+            else:
+                groups.append((queued.lane, self._chunk_lines(queued.chunk)))
+        for lane, logs in reversed(groups):
+            self._requeue(logs, lane)
+        return stopped
+
+    def _chunk(self, logs):
+        """
+        Group log lines by stream and split them into chunks that fit the request byte budget.
+
+        Lines of a stream are sorted by timestamp, so when a stream is split across chunks
+        every chunk holds a contiguous, ordered slice of it.
+
+        Args:
+            logs (list): The LogLine objects to send.
+
+        Yields:
+            list: A chunk, as a list of LogLine lists sharing the same labels.
+        """
+        grouped = {}
+        for log in logs:
+            stream_logs = grouped.get(log.key)
+            if stream_logs is None:
+                grouped[log.key] = stream_logs = []
+            stream_logs.append(log)
+
+        budget = None
+        if self.max_request_bytes is not None:
+            budget = self.max_request_bytes * _CHUNK_FILL_FACTOR / self._encoded_size_ratio
+
+        chunk = []
+        chunk_size = 0
+        for key, stream_logs in grouped.items():
+            stream_logs.sort(key=LogLine.sort_key)
+            if self.monotonic_timestamps:
+                self._make_monotonic(key, stream_logs)
+            start = 0
+            if budget is not None:
+                for index, log in enumerate(stream_logs):
+                    chunk_size += log.size
+                    if chunk_size >= budget:
+                        chunk.append(stream_logs[start:index + 1])
+                        yield chunk
+                        chunk = []
+                        chunk_size = 0
+                        start = index + 1
+            if start < len(stream_logs):
+                chunk.append(stream_logs[start:])
+        if chunk:
+            yield chunk
+
+    def _make_monotonic(self, key, stream_logs):
+        """
+        Make the timestamps of the sorted lines of a stream strictly increasing, and greater than the
+        last timestamp of the stream already handed over for pushing.
+
+        Args:
+            key (str): The stream key.
+            stream_logs (list): The LogLine objects of the stream, sorted by timestamp.
+        """
+        last = self._stream_clock.get(key, 0)
+        for log in stream_logs:
+            timestamp = log.timestamp_ns
+            if timestamp is None:
+                timestamp = time_ns()
+            if timestamp <= last:
+                timestamp = last + 1
+            log.timestamp_ns = last = timestamp
+
+        if key not in self._stream_clock and len(self._stream_clock) >= _MAX_STREAM_CLOCKS:
+            self._stream_clock.clear()
+        self._stream_clock[key] = last
+
+    def _encode_chunk(self, chunk):
+        """
+        Serialize and encode a chunk, splitting it in halves if the encoded body is too large.
+
+        Args:
+            chunk (list): A list of LogLine lists sharing the same labels.
+
+        Yields:
+            bytes: The encoded bodies.
+        """
+        streams = []
+        for stream_logs in chunk:
+            stream = Stream(stream_logs[0].labels, self.loki_metadata,
+                            self.message_in_json_format, serializer=self.serializer)
+            for log in stream_logs:
+                stream.append_value(log.line, log.loki_metadata, log.timestamp_ns)
+            streams.append(stream)
+
+        payload = self._serialize(Streams(streams))
+        body = self.request.encode(payload)
+
+        if self.max_request_bytes is not None:
+            estimated = sum(log.size for stream_logs in chunk for log in stream_logs)
+            if body and estimated:
+                self._encoded_size_ratio = max(len(body) / float(estimated), _MIN_ENCODED_SIZE_RATIO)
+
+            if len(body) > self.max_request_bytes:
+                halves = self._split_chunk(chunk)
+                if halves:
+                    for half in halves:
+                        for half_body in self._encode_chunk(half):
+                            yield half_body
+                    return
+
+        yield self._describe_body(body, chunk, len(payload) if isinstance(payload, bytes) else None)
+
+    def _describe_body(self, body, chunk, uncompressed_size=None):
+        """
+        Attach the chunk, its record count and its oldest record timestamp to its encoded body,
+        and record its sizes in the metrics.
+
+        Args:
+            body (bytes): The encoded push request body.
+            chunk (list): The chunk the body was built from.
+            uncompressed_size (int, optional): The size of the serialized payload, when known.
+
+        Returns:
+            EncodedBody: The body, with its `chunk`, `records` and `oldest` attributes.
         """
-        temp_streams = {}
+        if not isinstance(body, EncodedBody):
+            body = EncodedBody(body)
+        body.chunk = chunk
+        # Lines of a stream are sorted by timestamp, the first one is the oldest
+        oldest = min(LogLine.sort_key(stream_logs[0]) for stream_logs in chunk)
+        body.records = sum(len(stream_logs) for stream_logs in chunk)
+        body.oldest = oldest / 1e9 if oldest != float("inf") else None
 
-        while not self.buffer.empty():
-            log = self.buffer.get()
-            if log.key not in temp_streams:
-                stream = Stream(log.labels, self.loki_metadata,
-                                self.message_in_json_format)
-                temp_streams[log.key] = stream
+        if uncompressed_size is None:
+            uncompressed_size = getattr(body, "uncompressed_size", len(body))
+        self.metrics.increment("bytes_uncompressed", uncompressed_size)
+        self.metrics.increment("bytes_compressed", len(body))
+        self.metrics.observe("batch_records", body.records)
+        return body
 
-            temp_streams[log.key].append_value(log.line, log.loki_metadata)
+    def _deliver(self, body):
+        """
+        Post an encoded body, or append it to the spool when one is configured.
 
-        if temp_streams:
-            streams = Streams(list(temp_streams.values()))
+        Args:
+            body (bytes): The encoded push request body.
+
+        Raises:
+            requests.RequestException: If the request fails.
+        """
+        if self.spool is not None:
             try:
-                self.request.send(streams.serialize())
-            except requests.RequestException as e:
-                 self.handle_unexpected_error(e)
+                headers = self.request.body_headers(body)
+                self.spool.append(body, headers.get("Content-Type"), headers.get("Content-Encoding"))
+                return
+            except (IOError, OSError) as e:
+                # The disk is unusable, fall back to pushing the batch directly
+                self.handle_unexpected_error(e)
+        self._post(body)
+
+    def _post(self, body, headers=None):
+        """
+        Post an encoded body and record the outcome in the metrics.
+
+        Args:
+            body (bytes): The encoded push request body.
+            headers (dict, optional): Headers overriding the default ones for this body.
+
+        Raises:
+            requests.RequestException: If the request fails.
+        """
+        with self._recording_push(body):
+            if headers is None:
+                self.request.post(body)
+            else:
+                self.request.post(body, headers)
+
+    @contextlib.contextmanager
+    def _recording_push(self, body):
+        """
+        Record the push of a body made in the block in the metrics.
+
+        Args:
+            body (bytes): The encoded push request body.
+
+        Raises:
+            requests.RequestException: If the push made in the block failed.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except requests.RequestException as e:
+            self._record_push(body, started, e)
+            raise
+        self._record_push(body, started)
+
+    def _record_push(self, body, started, error=None):
+        """
+        Record a push in the metrics.
+
+        Args:
+            body (bytes): The encoded push request body, carrying its record count when built by `_encode_chunk`.
+            started (float): The `time.perf_counter` value when the push started.
+            error (Exception, optional): The error of a failed push.
+        """
+        metrics = self.metrics
+        records = getattr(body, "records", 0)
+        if error is not None:
+            # Records rejected by the open circuit breaker are kept buffered
+            if not isinstance(error, CircuitOpenError):
+                metrics.increment("records_failed", records)
+                metrics.increment("push_failures")
+                metrics.observe("push_latency_seconds", time.perf_counter() - started)
+            return
+        metrics.increment("pushes")
+        metrics.increment("records_sent", records)
+        metrics.observe("push_latency_seconds", time.perf_counter() - started)
+        oldest = getattr(body, "oldest", None)
+        if oldest is not None:
+            metrics.observe("emit_to_ack_seconds", max(time.time() - oldest, 0.0))
+
+    def _post_spooled(self, body, content_type, content_encoding):
+        """
+        Post a body replayed from the spool with the headers it was encoded with.
+
+        A body rejected with a non retryable status (e.g. 400 for entries that are too old) is reported
+        and acknowledged anyway, otherwise it would block the spool forever.
 
+        Args:
+            body (bytes): The encoded push request body.
+            content_type (str): The body Content-Type header.
+            content_encoding (str): The body Content-Encoding header, or None.
+
+        Raises:
+            requests.RequestException: If the request fails and should be replayed later.
+        """
+        try:
+            self._post(body, {"Content-Type": content_type, "Content-Encoding": content_encoding})
+        except requests.RequestException as e:
+            response = getattr(e, "response", None)
+            if response is None or response.status_code in self.request.retry_policy.retry_on_status:
+                raise
+            self.handle_unexpected_error(e)
+
+    @staticmethod
+    def _split_chunk(chunk):
+        """
+        Split a chunk in two halves with roughly the same number of lines.
+
+        Args:
+            chunk (list): A list of LogLine lists sharing the same labels.
+
+        Returns:
+            tuple: The two halves, or None if the chunk holds a single line.
+        """
+        total = sum(len(stream_logs) for stream_logs in chunk)
+        if total < 2:
+            return None
+
+        first, second = [], []
+        remaining = total // 2
+        for stream_logs in chunk:
+            if remaining >= len(stream_logs):
+                first.append(stream_logs)
+                remaining -= len(stream_logs)
+            elif remaining > 0:
+                first.append(stream_logs[:remaining])
+                second.append(stream_logs[remaining:])
+                remaining = 0
+            else:
+                second.append(stream_logs)
+        return first, second
+
+    def _serialize(self, streams):
+        """
+        Serialize the streams in the wire format configured on the request.
+
+        Args:
+            streams (Streams): The streams to serialize.
+
+        Returns:
+            iterable or bytes: The chunks of the JSON payload, compressed by the request as they are
+            produced, or a protobuf message when `payload_format` is "protobuf".
+        """
+        if self.request.payload_format == PROTOBUF_FORMAT:
+            return streams.serialize_protobuf()
+        return streams.iter_serialize()
 
     def write(self, message):
         """
@@ -153,25 +1183,208 @@ class LokiLoggerHandler(logging.Handler):
         """
         self.emit(message.record)
 
-    def _put(self, log_record, log_loki_metadata):
+    def put_formatted(self, log_record, loki_metadata=None):
+        """
+        Buffer a record that was already formatted, e.g. by a `LokiCollectorHandler` in another process.
+
+        Labels, structured metadata and batching are applied as for the records emitted to the handler.
+
+        Args:
+            log_record (dict): The formatted log record.
+            loki_metadata (dict, optional): The structured metadata of the record. Defaults to None.
+        """
+        self._put(log_record, loki_metadata if loki_metadata is not None else {})
+
+    def _put(self, log_record, log_loki_metadata, level=None, timestamp_ns=None):
         """
         Put a log record into the buffer.
 
         Args:
             log_record (dict): The formatted log record.
+            level (int, optional): The record level, routing it to its priority lane. Defaults to the
+                level named by the "level" field of the record.
+            timestamp_ns (int, optional): The entry timestamp in nanoseconds. Defaults to the "timestamp"
+                field of the record.
         """
-        labels = self.labels.copy()
+        if level is None and self.priority_lanes is not None:
+            try:
+                level = level_number(log_record.get("level", logging.NOTSET))
+            except ValueError:
+                level = logging.NOTSET
+        self._enqueue(self._make_log_line(log_record, log_loki_metadata, timestamp_ns), level)
 
-        self.assign_labels_from_log(log_record, labels)
+    @staticmethod
+    def _record_level(record):
+        """
+        Get the level number of a log record.
+
+        Args:
+            record (logging.LogRecord or dict): The log record, or a loguru record.
+
+        Returns:
+            int: The level number.
+        """
+        if isinstance(record, dict):
+            level = record.get("level")
+            return getattr(level, "no", logging.NOTSET)
+        return record.levelno
+
+    def _make_log_line(self, log_record, log_loki_metadata, timestamp_ns=None):
+        """
+        Resolve the labels and structured metadata of a formatted log record.
+
+        Args:
+            log_record (dict): The formatted log record.
+            log_loki_metadata (dict): The structured metadata of the record.
+            timestamp_ns (int, optional): The entry timestamp in nanoseconds. Defaults to the "timestamp"
+                field of the record.
+
+        Returns:
+            LogLine: The log line.
+        """
+        labels, demoted_labels = self.label_registry.resolve(log_record)
 
         if self.enable_structured_loki_metadata:
             self.extract_and_clean_metadata(log_record, log_loki_metadata)
+            if demoted_labels:
+                log_loki_metadata = dict(log_loki_metadata or {}, **demoted_labels)
 
             log_line = LogLine(labels, log_record, log_loki_metadata)
         else:
+            # Without structured metadata, the demoted values stay in the log line only
             log_line = LogLine(labels, log_record)
+        if timestamp_ns is not None:
+            log_line.timestamp_ns = timestamp_ns
+        return log_line
+
+    def _enqueue(self, item, level=None):
+        """
+        Add a log line, or a record waiting to be formatted, to the buffer.
+
+        Args:
+            item (LogLine or DeferredRecord): The buffered item.
+            level (int, optional): The record level, routing it to its priority lane.
+        """
+        if self._forked:
+            self._restart_after_fork()
 
-        self.buffer.put(log_line)
+        if self.priority_lanes is None:
+            if self.buffer.put(item, item.size):
+                self.metrics.increment("records_enqueued")
+                if self._batch_ready():
+                    self._request_flush()
+            return
+
+        if level is None:
+            level = logging.NOTSET
+        if self.buffer.put(item, item.size, level):
+            self.metrics.increment("records_enqueued")
+            if self.buffer.lane_for(level).flush_interval == 0 or self._batch_ready():
+                self._request_flush()
+
+    def _drain(self):
+        """
+        Take every buffered record out of the buffer, formatting the deferred ones.
+
+        Returns:
+            list: The LogLine objects.
+        """
+        return self._format_items(self.buffer.drain())
+
+    def _drain_batches(self):
+        """
+        Take every buffered record out of the buffer, lane by lane with `priority_lanes`.
+
+        Returns:
+            list: (lane, LogLine objects) tuples, the highest lane first. The lane is None without `priority_lanes`.
+        """
+        if self.priority_lanes is None:
+            return [(None, self._drain())]
+        return [(lane, self._format_items(items)) for lane, items in self.buffer.drain_lanes()]
+
+    def _format_items(self, logs):
+        """
+        Format the deferred records of drained items.
+
+        Args:
+            logs (list): The drained LogLine and DeferredRecord objects.
+
+        Returns:
+            list: The LogLine objects.
+        """
+        if not self.deferred_formatting:
+            return logs
+
+        log_lines = []
+        for item in logs:
+            if isinstance(item, DeferredRecord):
+                try:
+                    formatted_record, log_loki_metadata = self.formatter.format(item.record)
+                    item = self._make_log_line(formatted_record, log_loki_metadata, item.timestamp_ns)
+                except Exception as e:
+                    self.handle_unexpected_error(e)
+                    continue
+            log_lines.append(item)
+        return log_lines
+
+    def _request_flush(self):
+        """
+        Wake up the flush thread before the timeout elapses.
+        """
+        self.flush_event.set()
+
+    def _batch_ready(self):
+        """
+        Check whether the buffered records reached one of the batch thresholds.
+
+        Returns:
+            bool: True if the flush thread should be woken up before the timeout elapses.
+        """
+        if self.max_batch_lines is not None and self.buffer.qsize() >= self.max_batch_lines:
+            return not self.flush_event.is_set()
+        if self.max_batch_bytes is not None and self.buffer.size_bytes >= self.max_batch_bytes:
+            return not self.flush_event.is_set()
+        return False
+
+    def stats(self):
+        """
+        Take a snapshot of the handler metrics, see `Metrics.stats`.
+
+        Use `handler.metrics.render_prometheus()` to expose them to Prometheus.
+
+        Returns:
+            dict: The metric values by name.
+        """
+        return self.metrics.stats()
+
+    def _collect_metrics(self):
+        """
+        Read the metrics kept by the buffer and the request.
+
+        Returns:
+            dict: The metric values by name.
+        """
+        return {
+            "records_dropped": self.buffer.dropped,
+            "retries": getattr(self.request, "retries", 0),
+            "queue_records": self.buffer.qsize(),
+            "queue_bytes": self.buffer.size_bytes,
+            "labels_demoted": self.label_registry.demoted_records,
+        }
+
+    @property
+    def dropped_records(self):
+        """
+        int: Number of records discarded because the buffer was full.
+        """
+        return self.buffer.dropped
+
+    @property
+    def demoted_label_records(self):
+        """
+        int: Number of records whose label values were demoted by the `max_label_values` guard.
+        """
+        return self.label_registry.demoted_records
 
     def assign_labels_from_log(self, log_record, labels):
         """
@@ -233,34 +1446,100 @@ class LogLine:
     Represents a single log line with associated labels.
 
     Attributes:
-        labels (dict): Labels associated with the log line.
+        labels (dict): Labels associated with the log line, usually an interned `LabelSet`.
         key (str): A unique key generated from the labels.
         line (str): The actual log line content.
+        size (int): Estimated size of the log line in bytes, used to cap the buffer.
+        timestamp_ns (int): The entry timestamp in nanoseconds, or None to stamp the line when it is serialized.
     """
 
-    def __init__(self, labels, line, loki_metadata=None):
+    def __init__(self, labels, line, loki_metadata=None, timestamp_ns=None):
         """
         Initialize a LogLine object.
 
         Args:
             labels (dict): Labels associated with the log line.
             line (str): The actual log line content.
+            loki_metadata (dict, optional): The structured metadata of the line.
+            timestamp_ns (int, optional): The entry timestamp in nanoseconds. Defaults to the "timestamp"
+                field of the line.
         """
         self.labels = labels
-        self.key = self._key_from_labels(labels)
+        self.key = labels.key if isinstance(labels, LabelSet) else self._key_from_labels(labels)
         self.line = line
         self.loki_metadata = loki_metadata
+        self.size = self._estimate_size(line) + self._estimate_size(loki_metadata)
+        self.timestamp_ns = timestamp_ns if timestamp_ns is not None else self._line_timestamp_ns(line)
+
+    @staticmethod
+    def _line_timestamp_ns(line):
+        """
+        Read the "timestamp" field of a formatted record, in nanoseconds.
+
+        Args:
+            line (dict or str): The log line content.
+
+        Returns:
+            int: The timestamp, or None if the line has no numeric timestamp.
+        """
+        if isinstance(line, dict):
+            timestamp = line.get("timestamp")
+            if isinstance(timestamp, int):
+                return timestamp * 1000000000
+            if isinstance(timestamp, float):
+                return int(timestamp * 1e9)
+        return None
+
+    @staticmethod
+    def sort_key(log_line):
+        """
+        Key used to order the lines of a stream by their timestamp.
+
+        Lines without a timestamp are stamped when serialized, so they sort last.
+
+        Args:
+            log_line (LogLine): The log line.
+
+        Returns:
+            int: The line timestamp in nanoseconds, or infinity.
+        """
+        timestamp = log_line.timestamp_ns
+        return timestamp if timestamp is not None else float("inf")
+
+    @staticmethod
+    def _estimate_size(value):
+        """
+        Estimate the serialized size of a log line without serializing it.
+
+        Only the top level of a dictionary is inspected, nested values count as a fixed amount.
+
+        Args:
+            value (dict or str): The value to measure.
+
+        Returns:
+            int: The estimated size in bytes.
+        """
+        if isinstance(value, dict):
+            size = 2
+            for key, item in value.items():
+                size += (len(key) if isinstance(key, str) else 16) + (len(item) if isinstance(item, str) else 16) + 6
+            return size
+        if isinstance(value, str):
+            return len(value)
+        return 0
 
     @staticmethod
     def _key_from_labels(labels):
         """
-        Generate a unique key from the labels values.
+        Generate a unique key from the labels.
+
+        The key is the Loki stream selector of the labels, whose values are escaped,
+        so different labels never produce the same key.
 
         Args:
             labels (dict): Labels to generate the key from.
 
         Returns:
-            str: A unique key generated from the labels values.
+            str: A unique key generated from the labels.
         """
-        key_list = sorted(labels.values())
-        return "_".join(key_list)
+        return format_labels(labels)
@@ -1,6 +1,20 @@
-import gzip
+import threading
+import time
 import requests
 
+from loki_logger_handler import snappy
+from loki_logger_handler.circuit_breaker import CircuitOpenError
+from loki_logger_handler.compression import GZIP, compress_chunks, create_compressor
+from loki_logger_handler.retry import RetryPolicy
+from loki_logger_handler.transports import REQUESTS, create_transport
+
+JSON_FORMAT = "json"
+PROTOBUF_FORMAT = "protobuf"
+
+_CONTENT_TYPES = {
+    JSON_FORMAT: "application/json",
+    PROTOBUF_FORMAT: "application/x-protobuf",
+}
 
 
 class LokiRequest:
@@ -9,13 +23,28 @@ class LokiRequest:
 
     Attributes:
         url (str): The URL of the Loki server.
-        compressed (bool): Whether to compress the logs using gzip.
+        compressed (bool): Whether to compress the logs.
+        compression (str): The compression codec, "gzip", "deflate" or "zstd", or None.
+        compression_level (int): The compression level, None for the codec default.
+        compression_min_bytes (int): Bodies smaller than this are sent uncompressed, or None.
+        payload_format (str): The push body format, either "json" or "protobuf".
         auth (tuple): Basic authentication credentials to include in the request.
         headers (dict): Additional headers to include in the request.
-        session (requests.Session): The session used for making HTTP requests.
+        session (requests.Session): The transport used for making HTTP requests, a `requests.Session` by default.
+        retry_policy (RetryPolicy): The policy used to retry failed requests.
+        retries (int): Number of retried attempts since the object was created.
+        connect_timeout (float): Seconds to wait for the connection to Loki, or None.
+        read_timeout (float): Seconds to wait for Loki to send data, or None.
+        batch_deadline (float): Total seconds spent posting a body, retries included, or None.
+        circuit_breaker (CircuitBreaker): The breaker rejecting pushes while Loki keeps failing, or None.
+        transport (str or callable): The transport name, or the callable creating it.
+        pool_maxsize (int): Number of connections kept alive by the transport.
     """
 
-    def __init__(self, url, compressed=False, auth=None, additional_headers=None, insecure_ssl_verify=True):
+    def __init__(self, url, compressed=False, auth=None, additional_headers=None, insecure_ssl_verify=True,
+                 payload_format=JSON_FORMAT, retry_policy=None, compression=None, compression_level=None,
+                 compression_min_bytes=None, connect_timeout=10.0, read_timeout=30.0, batch_deadline=None,
+                 circuit_breaker=None, transport=REQUESTS, pool_maxsize=10):
         """
         Initialize the LokiRequest object with the server URL, compression option, and additional headers.
 
@@ -25,43 +54,262 @@ class LokiRequest:
             auth (tuple, optional): Basic authentication credentials to include in the request. Defaults to None.
             additional_headers (dict, optional): Additional headers to include in the request.
             Defaults to an empty dictionary.
+            payload_format (str, optional): "json" to push JSON bodies or "protobuf" to push snappy compressed
+            ``logproto.PushRequest`` messages. With "protobuf" the `compressed` option is ignored. Defaults to "json".
+            retry_policy (RetryPolicy, optional): How failed requests are retried, e.g. `RetryPolicy()`.
+            Defaults to None: a failed request is not retried.
+            compression (str, optional): Compression codec of JSON bodies: "gzip", "deflate" or "zstd" (requires the
+            zstandard package). Defaults to "gzip" when `compressed` is True, no compression otherwise.
+            compression_level (int, optional): The compression level. Defaults to the codec default (6 for gzip and deflate, 3 for zstd).
+            compression_min_bytes (int, optional): JSON bodies smaller than this are sent uncompressed. Defaults to None (always compress).
+            connect_timeout (float, optional): Seconds to wait for the connection to Loki. Defaults to 10, None waits forever.
+            read_timeout (float, optional): Seconds to wait for Loki to send data. Defaults to 30, None waits forever.
+            batch_deadline (float, optional): Total seconds spent posting a body, retries and backoff delays included.
+            No retry is attempted past it. Defaults to None (bounded by the retry policy only).
+            circuit_breaker (CircuitBreaker, optional): Stops pushing for a while after repeated failures. Defaults to None.
+            transport (str or callable, optional): "requests" for a pooled `requests.Session`, "http.client" for the
+            lighter `HTTPClientTransport`, or a callable returning an object with a `requests.Session` compatible
+            `post` method. Defaults to "requests".
+            pool_maxsize (int, optional): Number of connections kept alive, at least `sender_workers`. Defaults to 10.
+
+        Raises:
+            ValueError: If the payload format, the compression codec or the transport is unknown.
         """
+        if payload_format not in _CONTENT_TYPES:
+            raise ValueError("payload_format must be one of: {}".format(", ".join(sorted(_CONTENT_TYPES))))
+
+        if compression is None and compressed:
+            compression = GZIP
+        if payload_format != JSON_FORMAT:
+            compression = None
+        if compression is not None:
+            # Fail early on an unknown or missing codec
+            create_compressor(compression, compression_level)
+
         self.url = url
-        self.compressed = compressed
+        self.payload_format = payload_format
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_min_bytes = compression_min_bytes
+        self.compressed = compression is not None
         self.auth = auth
         self.headers = additional_headers if additional_headers is not None else {}
-        self.headers["Content-Type"] = "application/json"
-        self.session = requests.Session()
+        self.headers["Content-Type"] = _CONTENT_TYPES[payload_format]
+        if self.compressed:
+            self.headers["Content-Encoding"] = compression
+        self.transport = transport
+        self.pool_maxsize = pool_maxsize
+        self.session = self._create_session()
         self.insecure_ssl_verify = insecure_ssl_verify
+        # Retries are opt-in, a single attempt keeps the behavior of the versions without a retry policy
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_attempts=1)
+        self.retries = 0
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.batch_deadline = batch_deadline
+        self.circuit_breaker = circuit_breaker
+        # Set to cut short any backoff delay in progress
+        self._interrupt = threading.Event()
+
+    def _create_session(self):
+        """
+        Create the HTTP transport used to post the logs.
+
+        Returns:
+            requests.Session: The transport, a `requests.Session` by default.
+        """
+        return create_transport(self.transport, self.pool_maxsize)
 
     def send(self, data):
         """
         Send the log data to the Loki server.
 
         Args:
-            data (str): The log data to be sent.
+            data (str or bytes): The log data to be sent, a JSON string or a protobuf message
+            depending on `payload_format`.
 
         Raises:
             requests.RequestException: If the request fails.
         """
-        response = None
+        self.post(self.encode(data))
+
+    def encode(self, data):
+        """
+        Encode serialized log data into the request body, compressing it if configured.
+
+        JSON data can be given as an iterable of chunks, which are compressed as they are produced.
+
+        Args:
+            data (str or bytes or iterable): The serialized log data, a JSON string (or its chunks) or a
+            protobuf message depending on `payload_format`.
+
+        Returns:
+            bytes: The body to be posted to Loki. A compressed body is an `EncodedBody`, which knows
+            whether it was actually compressed.
+        """
+        if self.payload_format == PROTOBUF_FORMAT:
+            return snappy.compress(data)
+        chunks = (data,) if isinstance(data, (str, bytes)) else data
+        if self.compressed:
+            return compress_chunks(chunks, self.compression, self.compression_level, self.compression_min_bytes)
+        return b"".join(chunk if isinstance(chunk, bytes) else chunk.encode("utf-8") for chunk in chunks)
+
+    def body_headers(self, body, headers=None):
+        """
+        Get the headers to post a body with.
+
+        Args:
+            body (bytes): The body returned by `encode`.
+            headers (dict, optional): Headers overriding the default ones for this body.
+                A None value removes the header.
+
+        Returns:
+            dict: The request headers.
+        """
+        content_encoding = getattr(body, "content_encoding", self.compression)
+        if content_encoding != self.compression:
+            headers = dict({"Content-Encoding": content_encoding}, **(headers or {}))
+        if not headers:
+            return self.headers
+        request_headers = dict(self.headers)
+        request_headers.update(headers)
+        return {key: value for key, value in request_headers.items() if value is not None}
+
+    def post(self, body, headers=None):
+        """
+        Post an already encoded body to the Loki server, retrying transient failures.
+
+        Retries run on the calling (flush) thread and never hold the handler buffer,
+        so new records keep being accepted while a backoff delay is in progress.
+
+        Args:
+            body (bytes): The body returned by `encode`.
+            headers (dict, optional): Headers overriding the default ones for this body.
+                A None value removes the header.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open; nothing was sent.
+            requests.RequestException: If the request fails and cannot be retried.
+        """
+        headers = self.body_headers(body, headers)
+        self._check_circuit()
+
+        succeeded = False
+        status_code = None
         try:
-            if self.compressed:
-                self.headers["Content-Encoding"] = "gzip"
-                data = gzip.compress(data.encode("utf-8"))
-            
-            response = self.session.post(self.url, data=data, auth=self.auth, headers=self.headers, verify=self.insecure_ssl_verify)
-            response.raise_for_status()
-            
+            self._post_with_retries(body, headers)
+            succeeded = True
         except requests.RequestException as e:
-            
-            if response is not None:
-                response_message=  f"Response status code: {response.status_code}, response text: {response.text}, post request URL: {response.request.url}"
-                raise requests.RequestException(f"Error while sending logs: {str(e)}\nCaptured error details:\n{response_message}") from e
+            response = getattr(e, "response", None)
+            status_code = response.status_code if response is not None else None
+            raise
+        finally:
+            self._record_outcome(succeeded, status_code)
 
-            raise requests.RequestException(f"Error while sending logs: {str(e)}") from e
+    def _post_with_retries(self, body, headers):
+        """
+        Post a body, retrying transient failures until the retry policy or the batch deadline gives up.
+        """
+        deadline = self._start_deadline()
+        attempt = 0
+        while True:
+            attempt += 1
+            response = None
+            try:
+                response = self.session.post(self.url, data=body, auth=self.auth, headers=headers,
+                                             verify=self.insecure_ssl_verify, timeout=self._timeout(deadline))
+                response.raise_for_status()
+                return
 
+            except requests.RequestException as e:
 
-        finally:
-            if response:
-                response.close()
+                status_code = response.status_code if response is not None else None
+                if self.retry_policy.should_retry(attempt, status_code):
+                    retry_after = None
+                    if response is not None:
+                        retry_after = self.retry_policy.parse_retry_after(response.headers.get("Retry-After"))
+                    delay = self.retry_policy.compute_delay(attempt, retry_after)
+                    if self._before_deadline(deadline, delay) and not self._interrupt.wait(delay):
+                        self.retries += 1
+                        continue
+
+                if response is not None:
+                    response_message=  f"Response status code: {response.status_code}, response text: {response.text}, post request URL: {response.request.url}"
+                    raise requests.RequestException(f"Error while sending logs: {str(e)}\nCaptured error details:\n{response_message}", response=response) from e
+
+                raise requests.RequestException(f"Error while sending logs: {str(e)}") from e
+
+
+            finally:
+                if response is not None:
+                    response.close()
+
+    def _start_deadline(self):
+        """
+        Get the monotonic time by which a body must be posted, or None without batch deadline.
+        """
+        if self.batch_deadline is None:
+            return None
+        return time.monotonic() + self.batch_deadline
+
+    @staticmethod
+    def _before_deadline(deadline, delay=0.0):
+        """
+        Check whether an attempt started after `delay` seconds would begin before the deadline.
+        """
+        return deadline is None or time.monotonic() + delay < deadline
+
+    def _timeout(self, deadline):
+        """
+        Get the connect and read timeouts of an attempt, shortened to the time left before the deadline.
+
+        Returns:
+            tuple: The connect and read timeouts in seconds, None meaning no timeout.
+        """
+        if deadline is None:
+            return self.connect_timeout, self.read_timeout
+        remaining = max(deadline - time.monotonic(), 0.001)
+        return (
+            remaining if self.connect_timeout is None else min(self.connect_timeout, remaining),
+            remaining if self.read_timeout is None else min(self.read_timeout, remaining),
+        )
+
+    def _check_circuit(self):
+        """
+        Raise if the circuit breaker rejects the push.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open.
+        """
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow_request():
+            raise CircuitOpenError("Circuit breaker open, logs not sent to {}".format(self.url))
+
+    def _record_outcome(self, succeeded, status_code=None):
+        """
+        Report the outcome of a push to the circuit breaker.
+
+        A non retryable status (e.g. 400 for a malformed batch) means Loki is up, so it does not count as a failure.
+
+        Args:
+            succeeded (bool): Whether the push succeeded.
+            status_code (int, optional): The status code of the failed push, None if no response was received.
+        """
+        if self.circuit_breaker is None:
+            return
+        if succeeded or (status_code is not None and status_code not in self.retry_policy.retry_on_status):
+            self.circuit_breaker.record_success()
+        else:
+            self.circuit_breaker.record_failure()
+
+    def close(self):
+        """
+        Close the connections kept alive by the transport.
+        """
+        if self.session is not None:
+            self.session.close()
+
+    def interrupt(self):
+        """
+        Abort any backoff delay in progress; the failed request is not retried.
+        """
+        self._interrupt.set()
@@ -0,0 +1,224 @@
+"""
+Self-instrumentation of the handler.
+
+Counters and histograms are updated on the hot path without any lock: every thread writes to its own
+shard, and the shards are only merged when the metrics are read. The shard of a thread that ended is
+merged into a base shard, so threads coming and going do not make the metrics grow.
+"""
+import bisect
+import threading
+import weakref
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# Name: (type, help text, histogram buckets)
+METRICS = {
+    "records_enqueued": (COUNTER, "Records accepted by the buffer.", None),
+    "records_dropped": (COUNTER, "Records discarded because the buffer was full.", None),
+    "records_sent": (COUNTER, "Records acknowledged by Loki.", None),
+    "records_failed": (COUNTER, "Records of the pushes that failed.", None),
+    "bytes_uncompressed": (COUNTER, "Size of the encoded push bodies before compression.", None),
+    "bytes_compressed": (COUNTER, "Size of the encoded push bodies after compression.", None),
+    "pushes": (COUNTER, "Push requests acknowledged by Loki.", None),
+    "push_failures": (COUNTER, "Push requests that failed after their retries.", None),
+    "retries": (COUNTER, "Retried push attempts.", None),
+    "queue_records": (GAUGE, "Records waiting in the buffer.", None),
+    "queue_bytes": (GAUGE, "Estimated size in bytes of the records waiting in the buffer.", None),
+    "labels_demoted": (COUNTER, "Records whose label values were demoted by the max_label_values guard.", None),
+    "label_keys_demoted": (COUNTER, "Label keys that exceeded max_label_values within a window.", None),
+    "push_latency_seconds": (
+        HISTOGRAM, "Duration of the push requests, retries included.",
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+    ),
+    "batch_records": (
+        HISTOGRAM, "Records per push request.",
+        (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000),
+    ),
+    "emit_to_ack_seconds": (
+        HISTOGRAM, "Time from the emission of the oldest record of a push to its acknowledgement.",
+        (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+    ),
+}
+
+
+class _Shard(object):
+    """
+    The metrics updated by one thread.
+    """
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters = {name: 0 for name, (kind, _, _) in METRICS.items() if kind == COUNTER}
+        # Histogram: bucket counts, the last one for +Inf, then the sum of the observed values
+        self.histograms = {
+            name: [0] * (len(buckets) + 1) + [0.0]
+            for name, (kind, _, buckets) in METRICS.items() if kind == HISTOGRAM
+        }
+
+    def merge(self, other):
+        """
+        Add the values of another shard to this one.
+        """
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for name, histogram in other.histograms.items():
+            merged = self.histograms[name]
+            for index, value in enumerate(histogram):
+                merged[index] += value
+
+
+class _ThreadMarker(object):
+    """
+    Kept in the thread-local storage of the thread owning a shard, it is freed when the thread ends.
+    """
+    __slots__ = ("__weakref__",)
+
+
+def _retire_shard(metrics_ref, shard):
+    metrics = metrics_ref()
+    if metrics is not None:
+        metrics._retire(shard)
+
+
+class Metrics(object):
+    """
+    Counters, gauges and histograms describing what the handler does with the records.
+
+    Attributes:
+        collect (callable): Returns the values read from the handler state when a snapshot is taken,
+            e.g. the queue depth, as a dict of metric names to values. May be None.
+    """
+
+    def __init__(self, collect=None):
+        """
+        Initialize the Metrics object.
+
+        Args:
+            collect (callable, optional): Returns the values read from the handler state, see `collect`.
+        """
+        self.collect = collect
+        self._local = threading.local()
+        self._shards = []
+        # The metrics of the threads that ended
+        self._base = _Shard()
+        self._lock = threading.Lock()
+        self._bounds = {name: buckets for name, (kind, _, buckets) in METRICS.items() if kind == HISTOGRAM}
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            marker = self._local.marker = _ThreadMarker()
+            with self._lock:
+                self._shards.append(shard)
+            weakref.finalize(marker, _retire_shard, weakref.ref(self), shard)
+            return shard
+
+    def _retire(self, shard):
+        """
+        Merge the shard of a thread that ended into the base shard.
+        """
+        with self._lock:
+            self._base.merge(shard)
+            self._shards.remove(shard)
+
+    def increment(self, name, value=1):
+        """
+        Increment a counter.
+
+        Args:
+            name (str): The counter name.
+            value (int, optional): The increment. Defaults to 1.
+        """
+        try:
+            counters = self._local.shard.counters
+        except AttributeError:
+            counters = self._shard().counters
+        counters[name] += value
+
+    def observe(self, name, value):
+        """
+        Record a value in a histogram.
+
+        Args:
+            name (str): The histogram name.
+            value (float): The observed value.
+        """
+        try:
+            histogram = self._local.shard.histograms[name]
+        except AttributeError:
+            histogram = self._shard().histograms[name]
+        histogram[bisect.bisect_left(self._bounds[name], value)] += 1
+        histogram[-1] += value
+
+    def stats(self):
+        """
+        Take a snapshot of the metrics.
+
+        Returns:
+            dict: Counter and gauge values by name. Histograms are dicts with the "count", the "sum" and the
+            cumulative "buckets" counts by upper bound, "+Inf" included.
+        """
+        with self._lock:
+            base = _Shard()
+            base.merge(self._base)
+            shards = [base] + self._shards
+
+        snapshot = {}
+        for name, (kind, _, buckets) in METRICS.items():
+            if kind == COUNTER:
+                snapshot[name] = sum(shard.counters[name] for shard in shards)
+            elif kind == GAUGE:
+                snapshot[name] = 0
+            else:
+                counts = [0] * (len(buckets) + 1)
+                total = 0.0
+                for shard in shards:
+                    histogram = shard.histograms[name]
+                    for index in range(len(counts)):
+                        counts[index] += histogram[index]
+                    total += histogram[-1]
+                cumulative = {}
+                running = 0
+                for bound, count in zip(list(buckets) + ["+Inf"], counts):
+                    running += count
+                    cumulative[bound] = running
+                snapshot[name] = {"count": running, "sum": total, "buckets": cumulative}
+
+        if self.collect is not None:
+            for name, value in self.collect().items():
+                if METRICS[name][0] == COUNTER:
+                    snapshot[name] += value
+                else:
+                    snapshot[name] = value
+        return snapshot
+
+    def render_prometheus(self, prefix="loki_handler"):
+        """
+        Render a snapshot of the metrics in the Prometheus text exposition format.
+
+        Args:
+            prefix (str, optional): Prefix of the metric names. Defaults to "loki_handler".
+
+        Returns:
+            str: The metrics, counters being suffixed with "_total".
+        """
+        snapshot = self.stats()
+        lines = []
+        for name, (kind, description, _) in METRICS.items():
+            metric = "{}_{}".format(prefix, name) + ("_total" if kind == COUNTER else "")
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} {}".format(metric, kind))
+            value = snapshot[name]
+            if kind != HISTOGRAM:
+                lines.append("{} {}".format(metric, value))
+                continue
+            for bound, count in value["buckets"].items():
+                lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, count))
+            lines.append("{}_sum {}".format(metric, value["sum"]))
+            lines.append("{}_count {}".format(metric, value["count"]))
+        return "\n".join(lines) + "\n"
+
@@ -0,0 +1,96 @@
+import random
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+# Status codes worth retrying: timeouts, rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = frozenset((408, 425, 429, 500, 502, 503, 504))
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with full jitter for failed push requests.
+
+    The delay before retry ``n`` is a random value between 0 and ``min(max_delay, base_delay * 2 ** (n - 1))``,
+    which spreads the retries of many clients failing at the same time. A ``Retry-After`` response
+    header, when present, takes precedence over the computed delay.
+
+    Attributes:
+        max_attempts (int): Total number of attempts, including the first one.
+        base_delay (float): Backoff delay in seconds for the first retry.
+        max_delay (float): Upper bound in seconds of any single delay, including ``Retry-After`` values.
+        retry_on_status (frozenset): HTTP status codes that are retried. Connection errors are always retried.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=30.0, retry_on_status=RETRYABLE_STATUS_CODES):
+        """
+        Initialize the RetryPolicy.
+
+        Args:
+            max_attempts (int, optional): Total number of attempts, including the first one. Defaults to 5.
+            base_delay (float, optional): Backoff delay in seconds for the first retry. Defaults to 0.5.
+            max_delay (float, optional): Upper bound in seconds of any single delay. Defaults to 30.
+            retry_on_status (iterable, optional): HTTP status codes that are retried.
+                Defaults to 408, 425, 429, 500, 502, 503 and 504.
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_on_status = frozenset(retry_on_status)
+
+    def should_retry(self, attempt, status_code=None):
+        """
+        Decide whether a failed attempt should be retried.
+
+        Args:
+            attempt (int): The number of the attempt that failed, starting at 1.
+            status_code (int, optional): The response status code, or None if no response was received.
+
+        Returns:
+            bool: True if another attempt should be made.
+        """
+        if attempt >= self.max_attempts:
+            return False
+        return status_code is None or status_code in self.retry_on_status
+
+    def compute_delay(self, attempt, retry_after=None):
+        """
+        Compute how long to wait before the next attempt.
+
+        Args:
+            attempt (int): The number of the attempt that failed, starting at 1.
+            retry_after (float, optional): Seconds requested by the server through ``Retry-After``.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.max_delay)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Parse a ``Retry-After`` header value.
+
+        Args:
+            value (str): Either a number of seconds or an HTTP date.
+
+        Returns:
+            float or None: The number of seconds to wait, or None if the value is missing or invalid.
+        """
+        if not value:
+            return None
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+        try:
+            parsed = parsedate_tz(value)
+        except (TypeError, ValueError):
+            return None
+        if parsed is None:
+            return None
+        return max(mktime_tz(parsed) - time.time(), 0.0)
@@ -0,0 +1,241 @@
+"""
+JSON serializers used to build the push request payloads.
+
+The fastest available backend is used by default: orjson, ujson or msgspec when one of them is
+installed, the standard library otherwise. Every backend produces the same JSON for the values a
+log record can hold:
+
+* non ASCII characters are written as is (``ensure_ascii=False``),
+* values that are not JSON serializable are written as their ``str()``, including the datetimes,
+  enums and dataclasses some backends encode natively (the records of a service must not change
+  when such a backend gets installed),
+* NaN and infinite floats are written as ``null``, since they are not valid JSON,
+* no whitespace is written between items.
+"""
+import enum
+import json
+import math
+
+from json.encoder import encode_basestring
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+AUTO = "auto"
+
+# Types every backend encodes like the standard library
+_PLAIN_SCALARS = frozenset((str, int, float, bool, type(None)))
+
+
+def _replace_non_finite(value):
+    """
+    Return a copy of a value with the NaN and infinite floats replaced with None.
+    """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _replace_non_finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_replace_non_finite(item) for item in value]
+    return value
+
+
+def _contains_enum(value):
+    """
+    Check whether a value holds an enum, which orjson encodes as its value instead of its ``str()``.
+    """
+    value_type = type(value)
+    if value_type in _PLAIN_SCALARS:
+        return False
+    if value_type is dict:
+        return any(_contains_enum(item) for item in value.values())
+    if value_type is list or value_type is tuple:
+        return any(_contains_enum(item) for item in value)
+    return isinstance(value, enum.Enum)
+
+
+def _is_plain(value):
+    """
+    Check whether a value only holds JSON types, which msgspec encodes like the standard library.
+    """
+    value_type = type(value)
+    if value_type in _PLAIN_SCALARS:
+        return True
+    if value_type is dict:
+        return all(type(key) is str and _is_plain(item) for key, item in value.items())
+    if value_type is list or value_type is tuple:
+        return all(_is_plain(item) for item in value)
+    return False
+
+
+class JsonSerializer(object):
+    """
+    Serializer based on the standard library `json` module.
+
+    Also the base class of the other backends, which fall back to it for the values they cannot encode.
+    """
+
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=str)
+
+    def dumps(self, value):
+        """
+        Serialize a value to JSON.
+
+        Args:
+            value: The value to serialize.
+
+        Returns:
+            str: The JSON document.
+        """
+        try:
+            return self._encoder.encode(value)
+        except ValueError as e:
+            if "out of range float" not in str(e).lower():
+                raise
+            return self._encoder.encode(_replace_non_finite(value))
+
+    def dumps_entry(self, timestamp, line, metadata=None):
+        """
+        Serialize a stream entry, ``[timestamp, line]`` or ``[timestamp, line, metadata]``.
+
+        Args:
+            timestamp (str): The entry timestamp in nanoseconds.
+            line (str): The log line.
+            metadata (dict, optional): The entry structured metadata, with string keys and values.
+
+        Returns:
+            str: The JSON array.
+        """
+        if not isinstance(line, str):
+            return self.dumps([timestamp, line, metadata] if metadata is not None else [timestamp, line])
+        # Entries always have this shape, so the strings are escaped directly instead of walking a list
+        if metadata is None:
+            return '["{}",{}]'.format(timestamp, encode_basestring(line))
+        return '["{}",{},{{{}}}]'.format(timestamp, encode_basestring(line), ",".join(
+            "{}:{}".format(encode_basestring(key), encode_basestring(value)) for key, value in metadata.items()
+        ))
+
+
+class OrjsonSerializer(JsonSerializer):
+    """
+    Serializer based on orjson.
+    """
+
+    name = "orjson"
+
+    # Datetimes and dataclasses go to `default`, like with the standard library
+    OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+               if orjson is not None else 0)
+
+    def dumps(self, value):
+        if _contains_enum(value):
+            # Enums cannot be passed through to `default`
+            return super(OrjsonSerializer, self).dumps(value)
+        try:
+            return orjson.dumps(value, default=str, option=self.OPTIONS).decode("utf-8")
+        except TypeError:
+            # e.g. integers larger than 64 bits
+            return super(OrjsonSerializer, self).dumps(value)
+
+    def dumps_entry(self, timestamp, line, metadata=None):
+        return self.dumps([timestamp, line, metadata] if metadata is not None else [timestamp, line])
+
+
+class UjsonSerializer(JsonSerializer):
+    """
+    Serializer based on ujson.
+    """
+
+    name = "ujson"
+
+    def dumps(self, value):
+        try:
+            return ujson.dumps(value, ensure_ascii=False, escape_forward_slashes=False, default=str)
+        except (OverflowError, TypeError, ValueError):
+            # NaN and infinite floats, or values ujson cannot encode
+            return super(UjsonSerializer, self).dumps(value)
+
+
+class MsgspecSerializer(JsonSerializer):
+    """
+    Serializer based on msgspec.
+    """
+
+    name = "msgspec"
+
+    def __init__(self):
+        super(MsgspecSerializer, self).__init__()
+        self._msgspec_encoder = msgspec.json.Encoder(enc_hook=str)
+
+    def dumps(self, value):
+        if not _is_plain(value):
+            # msgspec encodes datetimes, enums, dataclasses, sets... natively, with no way to pass them to `enc_hook`
+            return super(MsgspecSerializer, self).dumps(value)
+        try:
+            return self._msgspec_encoder.encode(value).decode("utf-8")
+        except (TypeError, ValueError, msgspec.EncodeError):
+            return super(MsgspecSerializer, self).dumps(value)
+
+    def dumps_entry(self, timestamp, line, metadata=None):
+        return self.dumps([timestamp, line, metadata] if metadata is not None else [timestamp, line])
+
+
+_BACKENDS = (
+    ("orjson", orjson, OrjsonSerializer),
+    ("ujson", ujson, UjsonSerializer),
+    ("msgspec", msgspec, MsgspecSerializer),
+    ("json", json, JsonSerializer),
+)
+
+JSON_BACKENDS = tuple(name for name, _, _ in _BACKENDS)
+
+
+def available_backends():
+    """
+    List the installed JSON backends, fastest first.
+
+    Returns:
+        list: The backend names.
+    """
+    return [name for name, module, _ in _BACKENDS if module is not None]
+
+
+def get_serializer(backend=AUTO):
+    """
+    Create a serializer.
+
+    Args:
+        backend (str, optional): "orjson", "ujson", "msgspec", "json", or "auto" for the fastest installed one.
+            Defaults to "auto".
+
+    Returns:
+        JsonSerializer: The serializer.
+
+    Raises:
+        ValueError: If the backend is unknown or not installed.
+    """
+    for name, module, serializer_class in _BACKENDS:
+        if backend in (AUTO, name):
+            if module is not None:
+                return serializer_class()
+            if backend == name:
+                raise ValueError("JSON backend {} is not installed".format(backend))
+    raise ValueError("Unknown JSON backend: {}".format(backend))
+
+
+default_serializer = get_serializer()
@@ -0,0 +1,216 @@
+"""
+Snappy block format encoder used by the Loki protobuf push endpoint.
+
+Loki expects the protobuf ``PushRequest`` body to be compressed with the snappy
+*block* format (not the framed/stream format). When the optional
+``python-snappy`` package is installed its C implementation is used, otherwise
+a pure-Python encoder produces a valid (if slower) snappy block.
+"""
+import struct
+
+try:
+    import snappy as _snappy  # Optional C implementation (python-snappy)
+
+    _native_compress = getattr(_snappy, "compress", None)
+    _native_decompress = getattr(_snappy, "uncompress", None)
+except ImportError:
+    _native_compress = None
+    _native_decompress = None
+
+
+# Snappy works on independent 64 KiB blocks so copy offsets always fit in 2 bytes
+_BLOCK_SIZE = 1 << 16
+_MIN_MATCH = 4
+
+
+def _encode_varint(value):
+    """
+    Encode an unsigned integer as a little-endian base 128 varint.
+
+    Args:
+        value (int): The value to encode.
+
+    Returns:
+        bytearray: The encoded varint.
+    """
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return out
+
+
+def _emit_literal(out, data, start, end):
+    """
+    Append a literal element covering ``data[start:end]`` to ``out``.
+    """
+    length = end - start
+    if length <= 0:
+        return
+    n = length - 1
+    if n < 60:
+        out.append(n << 2)
+    elif n < 1 << 8:
+        out.append(60 << 2)
+        out.append(n)
+    elif n < 1 << 16:
+        out.append(61 << 2)
+        out += struct.pack("<H", n)
+    elif n < 1 << 24:
+        out.append(62 << 2)
+        out += struct.pack("<I", n)[:3]
+    else:
+        out.append(63 << 2)
+        out += struct.pack("<I", n)
+    out += data[start:end]
+
+
+def _emit_copy(out, offset, length):
+    """
+    Append copy elements referencing ``length`` bytes found ``offset`` bytes back.
+    """
+    # Copies longer than 64 bytes are split, keeping the remainder >= 4 bytes
+    while length >= 68:
+        out.append(2 | (63 << 2))
+        out += struct.pack("<H", offset)
+        length -= 64
+    if length > 64:
+        out.append(2 | (59 << 2))
+        out += struct.pack("<H", offset)
+        length -= 60
+    if length < 12 and offset < 2048:
+        out.append(1 | ((length - 4) << 2) | ((offset >> 8) << 5))
+        out.append(offset & 0xFF)
+    else:
+        out.append(2 | ((length - 1) << 2))
+        out += struct.pack("<H", offset)
+
+
+def _compress_block(out, data, base, end):
+    """
+    Compress ``data[base:end]`` (at most one block) into ``out``.
+    """
+    table = {}
+    literal_start = base
+    i = base
+    limit = end - _MIN_MATCH
+    skip = 32
+
+    while i <= limit:
+        chunk = data[i:i + _MIN_MATCH]
+        candidate = table.get(chunk)
+        table[chunk] = i
+        if candidate is None:
+            # Step faster through data that does not compress (snappy heuristic)
+            i += skip >> 5
+            skip += 1
+            continue
+
+        _emit_literal(out, data, literal_start, i)
+
+        match_end = i + _MIN_MATCH
+        source = candidate + _MIN_MATCH
+        while match_end + 8 <= end and data[match_end:match_end + 8] == data[source:source + 8]:
+            match_end += 8
+            source += 8
+        while match_end < end and data[match_end] == data[source]:
+            match_end += 1
+            source += 1
+
+        _emit_copy(out, i - candidate, match_end - i)
+        i = literal_start = match_end
+        skip = 32
+
+    _emit_literal(out, data, literal_start, end)
+
+
+def compress(data):
+    """
+    Compress data using the snappy block format.
+
+    Args:
+        data (bytes): The data to compress.
+
+    Returns:
+        bytes: The snappy compressed block.
+    """
+    if _native_compress is not None:
+        return _native_compress(data)
+
+    data = bytes(data)
+    out = _encode_varint(len(data))
+    for base in range(0, len(data), _BLOCK_SIZE):
+        _compress_block(out, data, base, min(base + _BLOCK_SIZE, len(data)))
+    return bytes(out)
+
+
+def decompress(data):
+    """
+    Decompress a snappy block.
+
+    Args:
+        data (bytes): The snappy compressed block.
+
+    Returns:
+        bytes: The uncompressed data.
+
+    Raises:
+        ValueError: If the block is malformed.
+    """
+    if _native_decompress is not None:
+        return _native_decompress(data)
+
+    data = bytes(data)
+    length = 0
+    shift = 0
+    pos = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated snappy length header")
+        byte = data[pos]
+        pos += 1
+        length |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 0x03
+        if kind == 0:
+            n = tag >> 2
+            if n >= 60:
+                size = n - 59
+                n = int.from_bytes(data[pos:pos + size], "little")
+                pos += size
+            n += 1
+            out += data[pos:pos + n]
+            pos += n
+            continue
+        if kind == 1:
+            copy_length = ((tag >> 2) & 0x07) + 4
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        elif kind == 2:
+            copy_length = (tag >> 2) + 1
+            offset = struct.unpack_from("<H", data, pos)[0]
+            pos += 2
+        else:
+            copy_length = (tag >> 2) + 1
+            offset = struct.unpack_from("<I", data, pos)[0]
+            pos += 4
+        if offset == 0 or offset > len(out):
+            raise ValueError("Invalid snappy copy offset")
+        start = len(out) - offset
+        if copy_length <= offset:
+            out += out[start:start + copy_length]
+        else:
+            for index in range(copy_length):
+                out.append(out[start + index])
+
+    if len(out) != length:
+        raise ValueError("Snappy block length mismatch")
+    return bytes(out)
@@ -0,0 +1,339 @@
+import errno
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Frame layout: magic, body length, CRC32 of meta + body, meta length, then meta and body
+_MAGIC = b"LKSP"
+_FRAME_HEADER = struct.Struct("<4sIIH")
+_SEGMENT_SUFFIX = ".seg"
+_CURSOR_FILE = "cursor"
+_LOCK_FILE = "lock"
+# Subdirectory of a forked worker process, or of a process that claimed the one of an exited worker
+_WORKER_DIRECTORY = re.compile(r"^worker-(\d+)(?:-\d+)?$")
+
+
+def _segment_name(sequence):
+    return "{:020d}{}".format(sequence, _SEGMENT_SUFFIX)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: the process exists but belongs to another user
+        return e.errno != errno.ESRCH
+    return True
+
+
+def claim_stale_spools(directory):
+    """
+    Claim the spools of the worker processes that exited, e.g. the workers of a previous run.
+
+    Forked workers spool into a ``worker-<pid>`` subdirectory, and a restarted application gets new
+    PIDs, so nothing would ever replay the frames those workers left behind. A subdirectory whose
+    process no longer exists is atomically renamed to ``worker-<own pid>-<suffix>``, so that only one
+    of the processes sharing the spool directory replays it.
+
+    Args:
+        directory (str): The spool directory.
+
+    Returns:
+        list: The paths of the claimed subdirectories.
+    """
+    if os.name != "posix" or not os.path.isdir(directory):
+        return []
+
+    claimed = []
+    for name in sorted(os.listdir(directory)):
+        match = _WORKER_DIRECTORY.match(name)
+        if match is None:
+            continue
+        pid = int(match.group(1))
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        path = os.path.join(directory, "worker-{}-{}".format(os.getpid(), int(time.time() * 1000000)))
+        try:
+            os.rename(os.path.join(directory, name), path)
+        except OSError:
+            # Claimed by another process first
+            continue
+        claimed.append(path)
+    return claimed
+
+
+class SpoolLockedError(OSError):
+    """
+    Raised when a spool directory is already used by another spool, in this process or another one.
+    """
+
+
+class Spool(object):
+    """
+    A disk-backed write-ahead spool of encoded push request bodies.
+
+    Bodies are appended sequentially to size-capped segment files. Every frame carries its length and a
+    CRC32 checksum, so a frame torn by a crash is detected and discarded when the spool is reopened.
+    Frames are read back through ``mmap`` in the order they were written and a segment file is only
+    deleted once all of its frames were acknowledged. The read position is persisted after every
+    acknowledged frame, so a restart resumes from the first frame Loki has not accepted yet.
+    An exclusive lock on the directory, where ``fcntl`` is available, keeps a second spool from
+    appending to the same segment files.
+
+    Attributes:
+        directory (str): Directory holding the segment files.
+        segment_max_bytes (int): Size after which a new segment file is started.
+        max_bytes (int): Maximum total size of the spool, the oldest segments are deleted beyond it.
+        fsync (bool): Whether every append is fsynced to disk.
+        dropped_bytes (int): Bytes of unsent frames deleted because the spool exceeded `max_bytes`.
+    """
+
+    def __init__(self, directory, segment_max_bytes=16 * 1024 * 1024, max_bytes=None, fsync=False):
+        """
+        Open (or create) a spool directory.
+
+        Args:
+            directory (str): Directory holding the segment files. Created if missing.
+            segment_max_bytes (int, optional): Size after which a new segment is started. Defaults to 16 MiB.
+            max_bytes (int, optional): Maximum total size of the spool. Defaults to None (unbounded).
+            fsync (bool, optional): Whether to fsync every append. Defaults to False.
+
+        Raises:
+            SpoolLockedError: If another spool uses the directory.
+        """
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.dropped_bytes = 0
+
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._lock_file = self._lock_directory()
+
+        self._segments = sorted(
+            int(name[:-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(_SEGMENT_SUFFIX)
+        )
+        self._read_segment, self._read_offset = self._load_cursor()
+
+        if self._segments:
+            self._recover(self._segments[-1])
+        else:
+            self._segments.append(0)
+        self._writer = open(self._path(self._segments[-1]), "ab")
+        self._write_size = self._writer.tell()
+
+    def _lock_directory(self):
+        """
+        Take an exclusive lock on the directory, released when the lock file is closed.
+        """
+        lock_file = open(os.path.join(self.directory, _LOCK_FILE), "a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            lock_file.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                raise SpoolLockedError(e.errno, "Spool directory is used by another spool", self.directory)
+            raise
+        return lock_file
+
+    def _path(self, sequence):
+        return os.path.join(self.directory, _segment_name(sequence))
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, _CURSOR_FILE)) as f:
+                sequence, offset = f.read().split()
+                sequence, offset = int(sequence), int(offset)
+        except (IOError, OSError, ValueError):
+            return (self._segments[0] if self._segments else 0), 0
+
+        if sequence not in self._segments:
+            return (self._segments[0] if self._segments else 0), 0
+        return sequence, offset
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, _CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write("{} {}".format(self._read_segment, self._read_offset))
+        os.replace(path + ".tmp", path)
+
+    def _recover(self, sequence):
+        """
+        Truncate a segment after its last complete frame, discarding a write torn by a crash.
+        """
+        valid_end = 0
+        for _, _, _, end in self._frames(sequence, 0):
+            valid_end = end
+        path = self._path(sequence)
+        if os.path.getsize(path) != valid_end:
+            with open(path, "r+b") as f:
+                f.truncate(valid_end)
+
+    def _frames(self, sequence, offset):
+        """
+        Iterate over the valid frames of a segment starting at an offset.
+
+        Yields:
+            tuple: The frame content type, content encoding, body and end offset.
+        """
+        path = self._path(sequence)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size <= offset:
+            return
+
+        with open(path, "rb") as f:
+            view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                while offset + _FRAME_HEADER.size <= size:
+                    magic, body_length, checksum, meta_length = _FRAME_HEADER.unpack_from(view, offset)
+                    start = offset + _FRAME_HEADER.size
+                    end = start + meta_length + body_length
+                    if magic != _MAGIC or end > size:
+                        return
+                    payload = view[start:end]
+                    if zlib.crc32(payload) & 0xFFFFFFFF != checksum:
+                        return
+                    content_type, _, content_encoding = payload[:meta_length].decode("ascii").partition("\n")
+                    yield content_type, content_encoding or None, payload[meta_length:], end
+                    offset = end
+            finally:
+                view.close()
+
+    def append(self, body, content_type, content_encoding=None):
+        """
+        Append an encoded body to the spool.
+
+        Args:
+            body (bytes): The encoded push request body.
+            content_type (str): The body Content-Type header.
+            content_encoding (str, optional): The body Content-Encoding header, if any.
+        """
+        meta = "{}\n{}".format(content_type, content_encoding or "").encode("ascii")
+        payload = meta + body
+        frame = _FRAME_HEADER.pack(_MAGIC, len(body), zlib.crc32(payload) & 0xFFFFFFFF, len(meta)) + payload
+
+        with self._lock:
+            self._writer.write(frame)
+            self._writer.flush()
+            if self.fsync:
+                os.fsync(self._writer.fileno())
+            self._write_size += len(frame)
+
+            if self._write_size >= self.segment_max_bytes:
+                self._rotate()
+            if self.max_bytes is not None:
+                self._enforce_max_bytes()
+
+    def _rotate(self):
+        self._writer.close()
+        self._segments.append(self._segments[-1] + 1)
+        self._writer = open(self._path(self._segments[-1]), "ab")
+        self._write_size = 0
+
+    def _enforce_max_bytes(self):
+        sizes = [os.path.getsize(self._path(sequence)) for sequence in self._segments]
+        total = sum(sizes)
+        while total > self.max_bytes and len(self._segments) > 1:
+            sequence = self._segments.pop(0)
+            size = sizes.pop(0)
+            unsent = size - self._read_offset if sequence == self._read_segment else size
+            self.dropped_bytes += max(unsent, 0)
+            total -= size
+            os.remove(self._path(sequence))
+            if sequence == self._read_segment:
+                self._read_segment, self._read_offset = self._segments[0], 0
+                self._save_cursor()
+
+    def pending(self):
+        """
+        Return True if the spool holds frames that were not acknowledged yet.
+        """
+        with self._lock:
+            return self._read_segment != self._segments[-1] or self._read_offset < self._write_size
+
+    def replay(self, post):
+        """
+        Ship the spooled frames, oldest first, until the spool is empty or a frame fails.
+
+        Args:
+            post (callable): Called as ``post(body, content_type, content_encoding)`` for every frame.
+                It must raise to signal that the frame was not acknowledged.
+
+        Returns:
+            int: The number of acknowledged frames.
+
+        Raises:
+            Exception: Whatever `post` raised; the failed frame stays in the spool.
+        """
+        acknowledged = 0
+        while True:
+            with self._lock:
+                sequence, offset = self._read_segment, self._read_offset
+                is_active = sequence == self._segments[-1]
+
+            for content_type, content_encoding, body, end in self._frames(sequence, offset):
+                post(body, content_type, content_encoding)
+                acknowledged += 1
+                with self._lock:
+                    if self._read_segment != sequence:
+                        # The segment was evicted by max_bytes while it was being shipped
+                        break
+                    self._read_offset = end
+                    self._save_cursor()
+
+            with self._lock:
+                if self._read_segment != sequence:
+                    continue
+                if is_active:
+                    if self._read_segment == self._segments[-1] and self._read_offset >= self._write_size:
+                        # Everything was shipped, start a fresh segment instead of growing this one
+                        self._rotate()
+                        self._delete_read_segment()
+                    return acknowledged
+                self._delete_read_segment()
+
+    def _delete_read_segment(self):
+        sequence = self._read_segment
+        self._segments.remove(sequence)
+        os.remove(self._path(sequence))
+        self._read_segment, self._read_offset = self._segments[0], 0
+        self._save_cursor()
+
+    def close(self):
+        """
+        Close the active segment file and release the directory.
+        """
+        with self._lock:
+            self._writer.close()
+            self._lock_file.close()
+
+    def detach(self):
+        """
+        Close the segment file a forked child inherited from its parent.
+
+        The lock is not taken: it may have been held by a thread of the parent, which does not exist
+        in the child. Every append flushes its frame, so nothing the parent wrote is written again.
+        The directory lock is shared with the parent and stays held by it.
+        """
+        self._lock = threading.Lock()
+        self._writer.close()
+        self._lock_file.close()
@@ -1,18 +1,4 @@
-import json
-
-
-class _LokiRequestEncoder(json.JSONEncoder):
-    """
-    A custom JSON encoder for the Streams class.
-    This internal class is used to handle the serialization
-    of Streams objects into the JSON format expected by Loki.
-    """
-    def default(self, o):
-        if isinstance(o, Streams):
-            # Convert the Streams object to a dictionary format suitable for Loki
-            return {"streams": [stream.__dict__ for stream in o.streams]}
-        # Use the default serialization method for other objects
-        return super(_LokiRequestEncoder, self).default(o)
+from loki_logger_handler.logproto import encode_push_request
 
 
 class Streams(object):  # Explicitly inherit from object for Python 2 compatibility
@@ -52,8 +38,34 @@ class Streams(object):  # Explicitly inherit from object for Python 2 compatibil
     def serialize(self):
         """
         Serialize the Streams object to a JSON string.
+
+        The log lines were encoded when they were appended; every stream renders its
+        ``[timestamp, line, metadata]`` entries around them here, see `Stream`.
         
         Returns:
             str: The JSON string representation of the Streams object.
         """
-        return json.dumps(self, cls=_LokiRequestEncoder)
+        return "".join(self.iter_serialize())
+
+    def iter_serialize(self):
+        """
+        Serialize the Streams object to JSON, one stream at a time.
+
+        Yields:
+            str: Consecutive chunks of the JSON string representation of the Streams object.
+        """
+        yield '{"streams":['
+        separator = ""
+        for stream in self.streams:
+            yield separator + stream.payload_fragment()
+            separator = ","
+        yield "]}"
+
+    def serialize_protobuf(self):
+        """
+        Serialize the Streams object to a Loki ``logproto.PushRequest`` protobuf message.
+
+        Returns:
+            bytes: The uncompressed protobuf representation of the Streams object.
+        """
+        return encode_push_request(self.streams)
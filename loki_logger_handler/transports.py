@@ -0,0 +1,287 @@
+"""
+HTTP transports posting the push requests.
+
+A transport is any object with a ``post(url, data, auth, headers, verify, timeout)`` method behaving like
+`requests.Session.post`, and a ``close()`` method. Two are provided:
+
+* "requests": a `requests.Session` with an explicitly sized connection pool.
+* "http.client": `HTTPClientTransport`, a lean client keeping its connections alive and rendering the
+  request head once per set of headers. It avoids the per-request work of `requests` (settings merging,
+  hooks, cookies) which shows at high push rates.
+"""
+import base64
+import http.client
+import socket
+import ssl
+import threading
+
+from urllib.parse import urlsplit, unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+REQUESTS = "requests"
+HTTP_CLIENT = "http.client"
+
+TRANSPORTS = (REQUESTS, HTTP_CLIENT)
+
+
+def create_requests_session(pool_maxsize=10, pool_block=False):
+    """
+    Create a `requests.Session` with a connection pool sized for the push requests.
+
+    Args:
+        pool_maxsize (int, optional): Number of connections kept alive per host. Defaults to 10.
+        pool_block (bool, optional): Whether to wait for a free connection instead of opening an extra one. Defaults to False.
+
+    Returns:
+        requests.Session: The session.
+    """
+    session = requests.Session()
+    # Retries are handled by LokiRequest
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=pool_block, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def create_transport(transport=REQUESTS, pool_maxsize=10):
+    """
+    Create a transport.
+
+    Args:
+        transport (str or callable, optional): "requests", "http.client", or a callable returning a transport.
+            Defaults to "requests".
+        pool_maxsize (int, optional): Number of connections kept alive. Defaults to 10.
+
+    Returns:
+        object: The transport.
+
+    Raises:
+        ValueError: If the transport name is unknown.
+    """
+    if transport == REQUESTS:
+        return create_requests_session(pool_maxsize)
+    if transport == HTTP_CLIENT:
+        return HTTPClientTransport(pool_maxsize)
+    if callable(transport):
+        return transport()
+    raise ValueError("transport must be one of: {}, or a callable".format(", ".join(TRANSPORTS)))
+
+
+class _RequestInfo(object):
+    __slots__ = ("url",)
+
+    def __init__(self, url):
+        self.url = url
+
+
+class TransportResponse(object):
+    """
+    The response of `HTTPClientTransport`, with the attributes of `requests.Response` used by `LokiRequest`.
+
+    Attributes:
+        status_code (int): The response status code.
+        headers (dict): The response headers, with case-insensitive names.
+        content (bytes): The response body.
+        request: An object whose `url` attribute is the requested URL.
+    """
+
+    def __init__(self, status_code, headers, content, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.request = _RequestInfo(url)
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def raise_for_status(self):
+        """
+        Raise `requests.HTTPError` for 4xx and 5xx responses.
+        """
+        if self.status_code >= 400:
+            raise requests.HTTPError(
+                "{} Error for url: {}".format(self.status_code, self.request.url), response=self
+            )
+
+    def close(self):
+        pass
+
+
+class _Connection(object):
+    """
+    A kept-alive connection to the Loki host.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.used = False
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class HTTPClientTransport(object):
+    """
+    A minimal HTTP/1.1 transport built on `http.client`, with kept-alive connections.
+
+    The request line and headers are rendered to bytes once per set of headers and reused, so a push
+    only adds the Content-Length and the body. Connections are taken from a pool of idle ones, which
+    makes the transport safe to share between the sender workers.
+    """
+
+    def __init__(self, pool_maxsize=10):
+        """
+        Initialize the HTTPClientTransport object.
+
+        Args:
+            pool_maxsize (int, optional): Number of idle connections kept alive. Defaults to 10.
+        """
+        self.pool_maxsize = pool_maxsize
+        self.connections_opened = 0
+        self._idle = []
+        self._heads = {}
+        self._lock = threading.Lock()
+        self._ssl_contexts = {}
+
+    def post(self, url, data=None, auth=None, headers=None, verify=True, timeout=None):
+        """
+        Post a body.
+
+        Args:
+            url (str): The URL to post to.
+            data (bytes): The request body.
+            auth (tuple, optional): Basic authentication credentials.
+            headers (dict, optional): The request headers.
+            verify (bool or str, optional): Whether to verify the TLS certificate, or the path of a CA bundle. Defaults to True.
+            timeout (float or tuple, optional): The connect and read timeouts in seconds, or a single timeout for both.
+
+        Returns:
+            TransportResponse: The response.
+
+        Raises:
+            requests.ConnectTimeout: If the connection timed out.
+            requests.ReadTimeout: If Loki did not answer in time.
+            requests.ConnectionError: If the connection failed.
+        """
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        data = data or b""
+        parts, head = self._head(url, auth, headers or {})
+        request = head + str(len(data)).encode("ascii") + b"\r\n\r\n" + data
+
+        while True:
+            connection = self._acquire(parts, verify, connect_timeout)
+            # Loki may have received the request once any of it was written, unless it closed the
+            # connection without answering: a kept-alive connection is only retried in those cases
+            retry_safe = connection.used
+            try:
+                connection.sock.settimeout(read_timeout)
+                written = connection.sock.send(request)
+                retry_safe = False
+                connection.sock.sendall(memoryview(request)[written:])
+                response = http.client.HTTPResponse(connection.sock, method="POST")
+                try:
+                    response.begin()
+                except http.client.RemoteDisconnected:
+                    retry_safe = connection.used
+                    raise
+                content = response.read()
+            except socket.timeout as e:
+                connection.close()
+                raise requests.ReadTimeout(str(e) or "Read timed out")
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                if retry_safe:
+                    # The kept-alive connection went stale, try once more on a new one
+                    continue
+                raise requests.ConnectionError(str(e) or type(e).__name__)
+
+            connection.used = True
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return TransportResponse(
+                response.status, CaseInsensitiveDict(response.getheaders()), content, url
+            )
+
+    def _head(self, url, auth, headers):
+        """
+        Get the parsed URL and the rendered request head, without the Content-Length value.
+        """
+        key = (url, auth, tuple(headers.items()))
+        cached = self._heads.get(key)
+        if cached is not None:
+            return cached
+
+        parts = urlsplit(url)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        lines = ["POST {} HTTP/1.1".format(path), "Host: {}".format(parts.netloc.rpartition("@")[2])]
+        if auth is None and parts.username:
+            auth = (unquote(parts.username), unquote(parts.password or ""))
+        if auth is not None:
+            credentials = "{}:{}".format(*auth).encode("utf-8")
+            lines.append("Authorization: Basic {}".format(base64.b64encode(credentials).decode("ascii")))
+        for name, value in headers.items():
+            lines.append("{}: {}".format(name, value))
+        cached = (parts, ("\r\n".join(lines) + "\r\nContent-Length: ").encode("latin-1"))
+
+        if len(self._heads) >= 64:
+            self._heads.clear()
+        self._heads[key] = cached
+        return cached
+
+    def _acquire(self, parts, verify, connect_timeout):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+
+        secure = parts.scheme == "https"
+        port = parts.port or (443 if secure else 80)
+        try:
+            sock = socket.create_connection((parts.hostname, port), timeout=connect_timeout)
+        except socket.timeout as e:
+            raise requests.ConnectTimeout(str(e) or "Connect timed out")
+        except OSError as e:
+            raise requests.ConnectionError(str(e) or type(e).__name__)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if secure:
+            try:
+                sock = self._ssl_context(verify).wrap_socket(sock, server_hostname=parts.hostname)
+            except (OSError, ssl.SSLError) as e:
+                sock.close()
+                raise requests.exceptions.SSLError(str(e))
+        self.connections_opened += 1
+        return _Connection(sock)
+
+    def _ssl_context(self, verify):
+        context = self._ssl_contexts.get(verify)
+        if context is None:
+            context = ssl.create_default_context(cafile=verify if isinstance(verify, str) else None)
+            if not verify:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self._ssl_contexts[verify] = context
+        return context
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.pool_maxsize:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
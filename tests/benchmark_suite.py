@@ -0,0 +1,399 @@
+"""
+Reproducible benchmarks of the handler, pushing to the in-process Loki stand-in of `tests.loki_server`.
+
+Results are written as JSON so they can be compared between versions::
+
+    python -m tests.benchmark_suite --output before.json
+    python -m tests.benchmark_suite --output after.json --baseline before.json
+
+`--scale` shrinks or grows the amount of work of every benchmark (1.0 by default).
+"""
+import argparse
+import datetime
+import gzip
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+import timeit
+
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from loki_logger_handler import snappy
+from loki_logger_handler.compression import GZIP, available_codecs, compress_chunks
+from loki_logger_handler.formatters.logger_formatter import LoggerFormatter
+from loki_logger_handler.formatters.loguru_formatter import LoguruFormatter
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler
+from loki_logger_handler.serializers import available_backends, get_serializer
+from loki_logger_handler.stream import Stream
+from loki_logger_handler.streams import Streams
+
+from tests.loki_server import LokiServer
+
+LABELS = {"application": "bench", "environment": "benchmark"}
+
+# Throughput is measured with this many logging threads besides the single threaded run
+THREADS = 4
+
+
+def _count(base, scale):
+    return max(int(base * scale), 10)
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def _logger(handler):
+    logger = logging.getLogger("benchmark_{}".format(id(handler)))
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+def _release(logger, handler):
+    logger.removeHandler(handler)
+    handler.close(1)
+
+
+def _log(logger, index):
+    logger.info("GET /api/items/%d %s", index, "ok", extra={"request_id": "req-{}".format(index)})
+
+
+def _wait_for_lines(server, count, timeout=30):
+    deadline = time.monotonic() + timeout
+    while server.received < count:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Loki stand-in received {} of {} lines".format(server.received, count))
+        time.sleep(0.001)
+
+
+def _log_record(index):
+    return logging.LogRecord(
+        "bench", logging.INFO, __file__, index, 'GET /api/items/%d "ok"', (index,), None
+    )
+
+
+def _formatted_records(lines):
+    formatter = LoggerFormatter()
+    return [formatter.format(_log_record(line))[0] for line in range(lines)]
+
+
+def _build_streams(formatted, serializer=None):
+    streams = []
+    for index in range(4):
+        stream = Stream(dict(LABELS, worker=str(index)), serializer=serializer)
+        for record in formatted[index::4]:
+            stream.append_value(record)
+        streams.append(stream)
+    return Streams(streams)
+
+
+def _loguru_record(index):
+    """
+    Build a record shaped like the ones loguru passes to its sinks, without requiring loguru.
+    """
+    return {
+        "message": 'GET /api/items/{} "ok"'.format(index),
+        "time": datetime.datetime.now(datetime.timezone.utc),
+        "process": SimpleNamespace(id=1234),
+        "thread": SimpleNamespace(id=5678),
+        "function": "handle",
+        "module": "bench",
+        "name": "bench",
+        "level": SimpleNamespace(name="INFO"),
+        "file": SimpleNamespace(name="bench.py", path="/srv/bench.py"),
+        "line": index,
+        "exception": None,
+        "extra": {"request_id": "req-{}".format(index)},
+    }
+
+
+def bench_emit_latency(server, scale):
+    """
+    Latency of `logger.info` calls, eager and deferred formatting.
+    """
+    calls = _count(20000, scale)
+    results = OrderedDict()
+    for name, options in (("eager", {}), ("deferred", {"deferred_formatting": True})):
+        handler = LokiLoggerHandler(server.url, labels=LABELS, timeout=60, **options)
+        logger = _logger(handler)
+        try:
+            latencies = []
+            for index in range(calls):
+                start = time.perf_counter()
+                _log(logger, index)
+                latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            results[name] = {
+                "p50_us": _percentile(latencies, 0.5) * 1e6,
+                "p99_us": _percentile(latencies, 0.99) * 1e6,
+            }
+        finally:
+            # The records are not pushed, only their emission was measured
+            handler.buffer.drain()
+            _release(logger, handler)
+    return results
+
+
+def bench_throughput(server, scale):
+    """
+    Records per second logged by one and by several threads, while the handler pushes them to Loki.
+    """
+    records = _count(40000, scale)
+    results = OrderedDict()
+    for threads in (1, THREADS):
+        handler = LokiLoggerHandler(server.url, labels=LABELS, timeout=60, max_batch_lines=1000)
+        logger = _logger(handler)
+        per_thread = records // threads
+        expected = server.received + per_thread * threads
+
+        def work():
+            for index in range(per_thread):
+                _log(logger, index)
+
+        try:
+            workers = [threading.Thread(target=work) for _ in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            handler._request_flush()
+            _wait_for_lines(server, expected)
+        finally:
+            _release(logger, handler)
+
+        results["{}_thread{}".format(threads, "s" if threads > 1 else "")] = {
+            "records_per_second": per_thread * threads / elapsed,
+        }
+    return results
+
+
+def bench_formatters(server, scale):
+    """
+    Cost of formatting a record with `LoggerFormatter` and `LoguruFormatter`.
+    """
+    number = _count(20000, scale)
+    results = OrderedDict()
+
+    formatter = LoggerFormatter()
+    records = [_log_record(index) for index in range(number)]
+    for record in records:
+        record.request_id = "req-{}".format(record.lineno)
+    seconds = min(timeit.repeat(lambda: [formatter.format(record) for record in records], number=1, repeat=3))
+    results["logger_formatter"] = {"us_per_record": seconds / number * 1e6}
+
+    formatter = LoguruFormatter()
+    records = [_loguru_record(index) for index in range(number)]
+    seconds = min(timeit.repeat(lambda: [formatter.format(record) for record in records], number=1, repeat=3))
+    results["loguru_formatter"] = {"us_per_record": seconds / number * 1e6}
+    return results
+
+
+def bench_serialize(server, scale):
+    """
+    Cost and size of the JSON push payload: appending the formatted records to the streams, then `Streams.serialize`.
+    """
+    lines = _count(10000, scale)
+    formatted = _formatted_records(lines)
+
+    streams = _build_streams(formatted)
+    payload = streams.serialize().encode("utf-8")
+    append_seconds = min(timeit.repeat(lambda: _build_streams(formatted), number=1, repeat=3))
+    serialize_seconds = min(timeit.repeat(streams.serialize, number=1, repeat=3))
+    return OrderedDict((
+        ("append_ms_per_1000_lines", append_seconds / lines * 1e6),
+        ("serialize_ms_per_1000_lines", serialize_seconds / lines * 1e6),
+        ("bytes_per_line", len(payload) / float(lines)),
+        ("gzip_bytes_per_line", len(gzip.compress(payload, 6)) / float(lines)),
+    ))
+
+
+def bench_payload_formats(server, scale):
+    """
+    Cost and size of the push payload formats: JSON, gzipped JSON and snappy compressed protobuf.
+    """
+    lines = _count(2000, scale)
+    streams = _build_streams(_formatted_records(lines))
+    results = OrderedDict()
+    for name, encode in (
+        ("json", lambda: streams.serialize().encode("utf-8")),
+        ("json_gzip", lambda: compress_chunks(streams.iter_serialize(), GZIP, 6)),
+        ("protobuf_snappy", lambda: snappy.compress(streams.serialize_protobuf())),
+    ):
+        seconds = min(timeit.repeat(encode, number=1, repeat=3))
+        results[name] = OrderedDict((
+            ("ms_per_1000_lines", seconds / lines * 1e6),
+            ("bytes_per_line", len(encode()) / float(lines)),
+        ))
+    return results
+
+
+def bench_json_backends(server, scale):
+    """
+    Cost of appending and serializing the records with every installed JSON backend.
+    """
+    lines = _count(2000, scale)
+    formatted = _formatted_records(lines)
+    results = OrderedDict()
+    for backend in available_backends():
+        serializer = get_serializer(backend)
+        seconds = min(timeit.repeat(lambda: _build_streams(formatted, serializer).serialize(), number=1, repeat=3))
+        results[backend] = {"ms_per_1000_lines": seconds / lines * 1e6}
+    return results
+
+
+def bench_compression(server, scale):
+    """
+    CPU cost per MB of JSON payload and compression ratio of every available codec and level.
+    """
+    streams = _build_streams(_formatted_records(_count(8000, scale)))
+    payload_mb = len(streams.serialize().encode("utf-8")) / 1e6
+    results = OrderedDict()
+    for codec in available_codecs():
+        for level in (1, 3, 6, 9):
+            body = compress_chunks(streams.iter_serialize(), codec, level)
+            seconds = min(timeit.repeat(
+                lambda: compress_chunks(streams.iter_serialize(), codec, level), number=1, repeat=3
+            ))
+            results["{}_{}".format(codec, level)] = OrderedDict((
+                ("ms_per_mb", seconds / payload_mb * 1e3),
+                ("ratio", payload_mb * 1e6 / len(body)),
+            ))
+    return results
+
+
+def bench_end_to_end(server, scale):
+    """
+    Time from the first `logger.info` call of a batch until Loki acknowledged all its records.
+    """
+    batch = 500
+    rounds = max(_count(20, scale) // 2, 3)
+    results = OrderedDict()
+    for name, options in (("json", {}), ("json_gzip", {"compressed": True})):
+        handler = LokiLoggerHandler(server.url, labels=LABELS, timeout=60, max_batch_lines=batch, **options)
+        logger = _logger(handler)
+        durations = []
+        try:
+            for _ in range(rounds):
+                expected = server.received + batch
+                start = time.perf_counter()
+                for index in range(batch):
+                    _log(logger, index)
+                _wait_for_lines(server, expected)
+                durations.append(time.perf_counter() - start)
+        finally:
+            _release(logger, handler)
+        durations.sort()
+        results[name] = {
+            "p50_ms": _percentile(durations, 0.5) * 1e3,
+            "max_ms": durations[-1] * 1e3,
+        }
+    return results
+
+
+BENCHMARKS = OrderedDict((
+    ("emit_latency", bench_emit_latency),
+    ("throughput", bench_throughput),
+    ("formatters", bench_formatters),
+    ("serialize", bench_serialize),
+    ("payload_formats", bench_payload_formats),
+    ("json_backends", bench_json_backends),
+    ("compression", bench_compression),
+    ("end_to_end", bench_end_to_end),
+))
+
+
+def run(scale=1.0, names=None):
+    """
+    Run the benchmarks against a Loki stand-in started for the run.
+
+    Args:
+        scale (float, optional): Multiplier of the amount of work of every benchmark. Defaults to 1.0.
+        names (iterable, optional): The benchmarks to run. Defaults to all of them.
+
+    Returns:
+        dict: The environment ("meta") and the results of every benchmark ("results").
+
+    Raises:
+        RuntimeError: If Loki did not receive, or rejected as invalid, some of the records.
+    """
+    server = LokiServer().start()
+    try:
+        results = OrderedDict()
+        for name in names or BENCHMARKS:
+            results[name] = BENCHMARKS[name](server, scale)
+        if server.rejected:
+            raise RuntimeError("Loki stand-in rejected {} invalid pushes".format(server.rejected))
+    finally:
+        server.stop()
+
+    return OrderedDict((
+        ("meta", OrderedDict((
+            ("python", platform.python_version()),
+            ("implementation", platform.python_implementation()),
+            ("platform", platform.platform()),
+            ("scale", scale),
+            ("date", datetime.datetime.now(datetime.timezone.utc).isoformat()),
+        ))),
+        ("results", results),
+    ))
+
+
+def compare(results, baseline):
+    """
+    Compare two runs.
+
+    Args:
+        results (dict): The results of `run`.
+        baseline (dict): The results of a previous run.
+
+    Returns:
+        dict: For every metric found in both runs, its relative change (e.g. 0.1 for 10% more)
+        keyed by its dotted path, e.g. "emit_latency.eager.p50_us".
+    """
+    changes = OrderedDict()
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            other = previous.get(key) if isinstance(previous, dict) else None
+            if isinstance(value, dict):
+                walk(value, other, path + (key,))
+            elif isinstance(value, (int, float)) and isinstance(other, (int, float)) and other:
+                changes[".".join(path + (key,))] = (value - other) / float(other)
+
+    walk(results["results"], baseline.get("results", {}), ())
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="File to write the JSON results to")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--scale", type=float, default=1.0, help="Amount of work multiplier")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS), help="Benchmark to run")
+    args = parser.parse_args(argv)
+
+    results = run(args.scale, args.only)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            changes = compare(results, json.load(baseline))
+        for path, change in changes.items():
+            print("{:<45} {:+7.1%}".format(path, change), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
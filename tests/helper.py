@@ -21,3 +21,61 @@ class FileObject(object):  # Explicitly inherit from object for Python 2.7 compa
     def __init__(self, name, path):
         self.name = name
         self.path = path
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def _read_fields(data):
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = _read_varint(data, pos)
+        else:
+            length, pos = _read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        yield field, value
+
+
+def decode_push_request(data):
+    """Decode a logproto.PushRequest into the equivalent JSON push body dict."""
+    streams = []
+    for _, stream_data in _read_fields(data):
+        stream = {"labels": None, "values": []}
+        for field, value in _read_fields(stream_data):
+            if field == 1:
+                stream["labels"] = value.decode("utf-8")
+            elif field == 2:
+                seconds = nanos = 0
+                line = None
+                metadata = {}
+                for entry_field, entry_value in _read_fields(value):
+                    if entry_field == 1:
+                        for ts_field, ts_value in _read_fields(entry_value):
+                            if ts_field == 1:
+                                seconds = ts_value
+                            else:
+                                nanos = ts_value
+                    elif entry_field == 2:
+                        line = entry_value.decode("utf-8")
+                    elif entry_field == 3:
+                        pair = dict(_read_fields(entry_value))
+                        metadata[pair[1].decode("utf-8")] = pair[2].decode("utf-8")
+                entry = [str(seconds * 1000000000 + nanos), line]
+                if metadata:
+                    entry.append(metadata)
+                stream["values"].append(entry)
+        streams.append(stream)
+    return {"streams": streams}
@@ -0,0 +1,241 @@
+"""
+In-process stand-ins for the Loki push API, used by the tests and benchmarks.
+"""
+import asyncio
+import gzip
+import json
+import threading
+import zlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loki_logger_handler import snappy
+from loki_logger_handler.compression import zstandard
+from loki_logger_handler.logproto import format_labels
+
+from tests.helper import decode_push_request
+
+
+def decode_push_body(body, headers):
+    """
+    Decode and validate a Loki push body.
+
+    Args:
+        body (bytes): The request body.
+        headers (dict): The request headers, with lower-cased names.
+
+    Returns:
+        list: The pushed streams, as ``{"stream": labels, "values": [[ts, line, metadata?], ...]}`` dicts.
+
+    Raises:
+        ValueError: If the body is not a valid push request.
+    """
+    content_type = headers.get("content-type", "")
+    if content_type == "application/x-protobuf":
+        streams = decode_push_request(snappy.decompress(body))["streams"]
+        for stream in streams:
+            stream["stream"] = stream.pop("labels")
+    else:
+        content_encoding = headers.get("content-encoding")
+        if content_encoding == "gzip":
+            body = gzip.decompress(body)
+        elif content_encoding == "deflate":
+            body = zlib.decompress(body, -zlib.MAX_WBITS)
+        elif content_encoding == "zstd" and zstandard is not None:
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        streams = json.loads(body.decode("utf-8"))["streams"]
+
+    for stream in streams:
+        if not stream.get("stream") or not isinstance(stream.get("values"), list):
+            raise ValueError("Invalid stream: {!r}".format(stream))
+        for value in stream["values"]:
+            if len(value) not in (2, 3) or not value[0].isdigit() or not isinstance(value[1], str):
+                raise ValueError("Invalid entry: {!r}".format(value))
+    return streams
+
+
+class AsyncLokiServer(object):
+    """
+    An asyncio HTTP/1.1 server accepting Loki push requests over kept-alive connections.
+
+    Attributes:
+        pushes (list): The decoded streams of every accepted push.
+        connections (int): Number of accepted TCP connections.
+        responses (list): Status codes to answer with before accepting pushes, consumed in order.
+    """
+
+    def __init__(self, responses=None):
+        self.pushes = []
+        self.connections = 0
+        self.responses = list(responses or [])
+        self.pushed = asyncio.Event()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return "http://{}:{}/loki/api/v1/push".format(host, port)
+
+    @property
+    def lines(self):
+        return [value[1] for streams in self.pushes for stream in streams for value in stream["values"]]
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                if self.responses:
+                    status = self.responses.pop(0)
+                else:
+                    try:
+                        self.pushes.append(decode_push_body(body, headers))
+                        status = 204
+                    except ValueError:
+                        status = 400
+                    self.pushed.set()
+
+                writer.write("HTTP/1.1 {} Status\r\nContent-Length: 0\r\n\r\n".format(status).encode("ascii"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class LokiServer(object):
+    """
+    A threaded HTTP/1.1 server accepting Loki push requests over kept-alive connections.
+
+    Attributes:
+        pushes (list): The decoded streams of every accepted push.
+        connections (int): Number of accepted TCP connections.
+        responses (list): Status codes to answer with before accepting pushes, consumed in order.
+        delay (float): Seconds to wait before answering each request.
+        rejected (int): Number of invalid pushes, answered with a 400.
+        received (int): Number of lines of the accepted pushes.
+        ordered (bool): Whether to reject, like Loki without `unordered_writes`, pushes holding an entry
+            older than the last accepted one of its stream.
+        out_of_order (int): Number of entries rejected as out of order.
+    """
+
+    def __init__(self, responses=None, delay=0, ordered=False):
+        self.pushes = []
+        self.connections = 0
+        self.rejected = 0
+        self.received = 0
+        self.ordered = ordered
+        self.out_of_order = 0
+        self._last_timestamps = {}
+        self.responses = list(responses or [])
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return "http://{}:{}/loki/api/v1/push".format(host, port)
+
+    @property
+    def lines(self):
+        with self._lock:
+            return [value[1] for streams in self.pushes for stream in streams for value in stream["values"]]
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with server._lock:
+                    server.connections += 1
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                headers = {key.lower(): value for key, value in self.headers.items()}
+                if server.delay:
+                    threading.Event().wait(server.delay)
+                with server._lock:
+                    status = server.responses.pop(0) if server.responses else None
+                if status is None:
+                    try:
+                        streams = decode_push_body(body, headers)
+                        with server._lock:
+                            if server.ordered and server._check_order(streams):
+                                status = 400
+                            else:
+                                server.pushes.append(streams)
+                                server.received += sum(len(stream["values"]) for stream in streams)
+                                status = 204
+                    except ValueError:
+                        with server._lock:
+                            server.rejected += 1
+                        status = 400
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # Clients giving up on a delayed response are expected
+                pass
+
+        self._server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def _check_order(self, streams):
+        """
+        Count the out of order entries of a push, and record the last timestamps if there is none.
+
+        Returns:
+            int: The number of out of order entries.
+        """
+        last_timestamps = {}
+        rejected = 0
+        for stream in streams:
+            labels = stream["stream"]
+            # Protobuf pushes carry the labels already rendered as a selector
+            key = labels if isinstance(labels, str) else format_labels(labels)
+            last = last_timestamps.get(key, self._last_timestamps.get(key, 0))
+            for value in stream["values"]:
+                timestamp = int(value[0])
+                if timestamp < last:
+                    rejected += 1
+                last = max(last, timestamp)
+            last_timestamps[key] = last
+        self.out_of_order += rejected
+        if not rejected:
+            self._last_timestamps.update(last_timestamps)
+        return rejected
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
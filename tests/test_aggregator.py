@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    from unittest.mock import patch  # Python 3.x
+except ImportError:
+    from mock import patch  # Python 2.7
+
+from loki_logger_handler.aggregator import LokiAggregator, LokiCollectorHandler, decode_frames, encode_frame
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestFrames(unittest.TestCase):
+    def test_round_trip_across_partial_reads(self):
+        data = encode_frame({"message": "ü first"}, {"trace_id": 1}) + encode_frame({"message": "second"})
+        pending = bytearray(data[:10])
+
+        self.assertEqual(decode_frames(pending), [])
+        pending += data[10:]
+        self.assertEqual(decode_frames(pending), [
+            ({"message": "ü first"}, {"trace_id": 1}),
+            ({"message": "second"}, {}),
+        ])
+        self.assertEqual(pending, bytearray())
+
+
+class TestAggregator(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, "loki.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _aggregator(self):
+        with patch("loki_logger_handler.loki_request.requests.Session"), \
+                patch("loki_logger_handler.loki_logger_handler.threading.Thread"):
+            handler = LokiLoggerHandler("http://test_url", labels={"application": "Test"}, label_keys={"worker"})
+        aggregator = LokiAggregator(self.socket_path, handler)
+        aggregator.start()
+        return aggregator
+
+    def _collector_logger(self, name):
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        collector = LokiCollectorHandler(self.socket_path)
+        logger.addHandler(collector)
+        return logger, collector
+
+    def test_records_reach_the_aggregated_handler(self):
+        aggregator = self._aggregator()
+        logger, collector = self._collector_logger("collector_test")
+
+        for index in range(50):
+            logger.info("line %d", index, extra={"worker": str(index % 2)})
+
+        self.assertTrue(_wait_for(lambda: aggregator.received_records == 50))
+        collector.close()
+        aggregator.close()
+
+        aggregator.handler._send()
+        bodies = [c[1]["data"] for c in aggregator.handler.request.session.post.call_args_list]
+        self.assertEqual(len(bodies), 1)
+        streams = json.loads(bodies[0])["streams"]
+        self.assertEqual(sorted(stream["stream"]["worker"] for stream in streams), ["0", "1"])
+        self.assertEqual(sum(len(stream["values"]) for stream in streams), 50)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_forked_workers_share_the_aggregator(self):
+        aggregator = self._aggregator()
+        logger, collector = self._collector_logger("collector_fork_test")
+
+        children = []
+        for worker in range(3):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for index in range(20):
+                        logger.info("worker %d line %d", worker, index, extra={"worker": str(worker)})
+                    collector.close()
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+        self.assertTrue(_wait_for(lambda: aggregator.received_records == 60))
+        aggregator.close()
+
+    def test_aggregator_down_drops_without_blocking(self):
+        logger, collector = self._collector_logger("collector_down_test")
+
+        logger.info("nobody listening")
+        logger.info("still nobody")
+
+        self.assertEqual(collector.dropped_records, 2)
+        self.assertTrue(collector.error)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import threading
+import unittest
+
+import requests
+
+from loki_logger_handler.async_loki_logger_handler import AsyncLokiLoggerHandler
+from loki_logger_handler.async_loki_request import AsyncLokiRequest
+from loki_logger_handler.retry import RetryPolicy
+
+from tests.loki_server import AsyncLokiServer, LokiServer
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _logger(handler):
+    logger = logging.getLogger("async_loki_test_{}".format(id(handler)))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(handler)
+    return logger
+
+
+class TestAsyncLokiLoggerHandler(unittest.TestCase):
+    def test_flushes_on_batch_threshold_over_one_connection(self):
+        async def scenario():
+            server = await AsyncLokiServer().start()
+            handler = AsyncLokiLoggerHandler(server.url, labels={"application": "Test"}, max_batch_lines=5, timeout=60)
+            logger = _logger(handler)
+
+            for batch in range(3):
+                server.pushed.clear()
+                for index in range(5):
+                    logger.info("batch %d line %d", batch, index)
+                await asyncio.wait_for(server.pushed.wait(), 5)
+
+            await handler.aclose()
+            await server.stop()
+            return server
+
+        server = _run(scenario())
+
+        messages = [json.loads(line)["message"] for line in server.lines]
+        self.assertEqual(len(messages), 15)
+        self.assertEqual(messages[0], "batch 0 line 0")
+        self.assertEqual(server.connections, 1)
+
+    def test_aclose_pushes_buffered_records_compressed(self):
+        async def scenario():
+            server = await AsyncLokiServer().start()
+            handler = AsyncLokiLoggerHandler(server.url, labels={"application": "Test"}, compressed=True)
+            logger = _logger(handler)
+            logger.info("buffered")
+            await handler.aclose()
+            await server.stop()
+            return server
+
+        server = _run(scenario())
+
+        self.assertEqual([json.loads(line)["message"] for line in server.lines], ["buffered"])
+
+    def test_retries_transient_errors(self):
+        async def scenario():
+            server = await AsyncLokiServer(responses=[503, 429]).start()
+            handler = AsyncLokiLoggerHandler(
+                server.url, labels={"application": "Test"},
+                retry_policy=RetryPolicy(base_delay=0.01, max_delay=0.01),
+            )
+            logger = _logger(handler)
+            logger.info("retried")
+            await handler.aclose()
+            await server.stop()
+            return server, handler
+
+        server, handler = _run(scenario())
+
+        self.assertEqual(len(server.lines), 1)
+        self.assertEqual(handler.request.retries, 2)
+        self.assertFalse(handler.error)
+
+    def test_reports_unreachable_server(self):
+        async def scenario():
+            handler = AsyncLokiLoggerHandler(
+                "http://127.0.0.1:1/loki/api/v1/push", labels={"application": "Test"},
+                retry_policy=RetryPolicy(max_attempts=1),
+            )
+            _logger(handler).info("lost")
+            await handler.aclose()
+            return handler
+
+        self.assertTrue(_run(scenario()).error)
+
+    def test_encodes_off_the_event_loop(self):
+        encoded_on = []
+
+        async def scenario():
+            server = await AsyncLokiServer().start()
+            handler = AsyncLokiLoggerHandler(server.url, labels={"application": "Test"})
+            encode_bodies = handler._encode_bodies
+            handler._encode_bodies = lambda chunk: encoded_on.append(threading.current_thread()) or encode_bodies(chunk)
+            _logger(handler).info("encoded")
+            await handler.aclose()
+            await server.stop()
+            return server
+
+        server = _run(scenario())
+
+        self.assertEqual(len(server.lines), 1)
+        self.assertEqual(len(encoded_on), 1)
+        self.assertIsNot(encoded_on[0], threading.current_thread())
+
+    def test_close_from_another_thread_pushes_buffered_records(self):
+        server = LokiServer().start()
+        self.addCleanup(server.stop)
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        self.addCleanup(loop.close)
+        self.addCleanup(thread.join)
+        self.addCleanup(loop.call_soon_threadsafe, loop.stop)
+
+        async def log():
+            handler = AsyncLokiLoggerHandler(server.url, labels={"application": "Test"}, timeout=60)
+            _logger(handler).info("buffered")
+            return handler
+
+        handler = asyncio.run_coroutine_threadsafe(log(), loop).result(5)
+
+        self.assertTrue(handler.close(5))
+        self.assertEqual([json.loads(line)["message"] for line in server.lines], ["buffered"])
+
+    def test_flush_from_another_thread_pushes_buffered_records(self):
+        server = LokiServer().start()
+        self.addCleanup(server.stop)
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+        self.addCleanup(loop.close)
+        self.addCleanup(thread.join)
+        self.addCleanup(loop.call_soon_threadsafe, loop.stop)
+
+        async def log():
+            handler = AsyncLokiLoggerHandler(server.url, labels={"application": "Test"}, timeout=60)
+            _logger(handler).info("buffered")
+            return handler
+
+        handler = asyncio.run_coroutine_threadsafe(log(), loop).result(5)
+        self.addCleanup(handler.close, 5)
+
+        self.assertTrue(handler.flush(5))
+        self.assertEqual([json.loads(line)["message"] for line in server.lines], ["buffered"])
+
+    def test_close_after_the_loop_stopped_pushes_buffered_records(self):
+        server = LokiServer().start()
+        self.addCleanup(server.stop)
+
+        async def log():
+            handler = AsyncLokiLoggerHandler(server.url, labels={"application": "Test"}, timeout=60)
+            logger = _logger(handler)
+            logger.info("pushed")
+            await handler.aflush()
+            logger.info("buffered")
+            return handler
+
+        handler = _run(log())
+
+        self.assertTrue(handler.close(5))
+        self.assertEqual([json.loads(line)["message"] for line in server.lines], ["pushed", "buffered"])
+
+    def test_rejects_blocking_buffer_policy(self):
+        with self.assertRaises(ValueError):
+            AsyncLokiLoggerHandler("http://loki", labels={}, buffer_overflow_policy="block_with_timeout")
+
+
+async def _read_request(reader):
+    await reader.readuntil(b"\r\n\r\n")
+    await reader.readexactly(2)
+
+
+class TestAsyncLokiRequest(unittest.TestCase):
+    def _post_twice(self, answer_second):
+        """
+        Post two bodies over a kept-alive connection, the second one answered by `answer_second`.
+
+        Returns:
+            int: The number of requests answered with 204.
+        """
+        answered = []
+
+        async def handle(reader, writer):
+            await _read_request(reader)
+            writer.write(b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n")
+            answered.append(None)
+            if len(answered) == 1:
+                await writer.drain()
+                await answer_second(reader, writer)
+            writer.close()
+
+        async def scenario():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            host, port = server.sockets[0].getsockname()[:2]
+            request = AsyncLokiRequest(
+                "http://{}:{}/loki/api/v1/push".format(host, port), retry_policy=RetryPolicy(max_attempts=1)
+            )
+            try:
+                await request.post(b"{}")
+                await request.post(b"{}")
+            finally:
+                await request.aclose()
+                server.close()
+                await server.wait_closed()
+
+        _run(scenario())
+        return len(answered)
+
+    def test_reconnects_when_loki_closed_the_connection(self):
+        async def close(reader, writer):
+            pass
+
+        self.assertEqual(self._post_twice(close), 2)
+
+    def test_does_not_resend_a_request_answered_in_part(self):
+        async def answer_in_part(reader, writer):
+            await _read_request(reader)
+            writer.write(b"HTTP/1.1 204 No Content\r\nContent-Length: 10\r\n\r\n")
+            await writer.drain()
+
+        with self.assertRaises(requests.RequestException):
+            self._post_twice(answer_in_part)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import gzip
+import json
+import logging
+import os
+import time
+import timeit
+import unittest
+
+try:
+    from unittest.mock import patch  # Python 3.x
+except ImportError:
+    from mock import patch  # Python 2.7
+
+from loki_logger_handler import snappy
+from loki_logger_handler.compression import GZIP, compress_chunks
+from loki_logger_handler.formatters.logger_formatter import LoggerFormatter
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler
+from loki_logger_handler.loki_request import LokiRequest
+from loki_logger_handler.stream import Stream
+from loki_logger_handler.streams import Streams
+
+from tests import benchmark_suite
+from tests.loki_server import LokiServer
+
+
+# Timing comparisons depend on the machine load, they are only asserted when benchmarking on purpose
+STRICT_TIMINGS = os.environ.get("LOKI_BENCHMARKS") == "1"
+
+
+def _assert_faster(test, fast, slow, description):
+    """
+    Assert that a timing is below another with LOKI_BENCHMARKS=1, otherwise report both as a skip reason.
+    """
+    if not STRICT_TIMINGS:
+        test.skipTest("{} (set LOKI_BENCHMARKS=1 to assert it)".format(description))
+    test.assertLess(fast, slow, description)
+
+
+def _build_streams(lines=2000, streams=4):
+    formatter = LoggerFormatter()
+    result = []
+    for index in range(streams):
+        stream = Stream({"application": "bench", "worker": str(index)})
+        for line in range(lines // streams):
+            record = logging.LogRecord(
+                "bench", logging.INFO, __file__, line, 'GET /api/items/%d "ok"', (line,), None
+            )
+            record.request_id = "req-{}".format(line)
+            formatted, _ = formatter.format(record)
+            stream.append_value(formatted)
+        result.append(stream)
+    return Streams(result)
+
+
+def _measure(func, number=3):
+    return min(timeit.repeat(func, number=1, repeat=number))
+
+
+class TestPayloadEncoding(unittest.TestCase):
+    def test_protobuf_is_smaller_than_json(self):
+        streams = _build_streams(2000)
+
+        self.assertLess(len(snappy.compress(streams.serialize_protobuf())), len(streams.serialize().encode("utf-8")))
+
+
+class TestCompressionBenchmark(unittest.TestCase):
+    LINES = 8000
+
+    def test_default_level_is_faster_than_gzip_compress(self):
+        streams = _build_streams(self.LINES)
+        payload_mb = len(streams.serialize().encode("utf-8")) / 1e6
+        self.assertGreater(payload_mb * 1e6 / len(compress_chunks(streams.iter_serialize(), GZIP, 6)), 1)
+
+        level_6 = _measure(lambda: compress_chunks(streams.iter_serialize(), GZIP, 6))
+        level_9 = _measure(lambda: gzip.compress(streams.serialize().encode("utf-8")))
+        _assert_faster(
+            self, level_6, level_9,
+            "gzip level 6 {:.1f} ms/MB < gzip.compress level 9 {:.1f} ms/MB".format(
+                level_6 / payload_mb * 1e3, level_9 / payload_mb * 1e3),
+        )
+
+
+class TestEmitLatencyBenchmark(unittest.TestCase):
+    CALLS = 10000
+    ROUNDS = 5
+
+    def _logger(self, **kwargs):
+        with patch("loki_logger_handler.loki_logger_handler.threading.Thread"):
+            handler = LokiLoggerHandler("http://test_url", labels={"application": "bench"}, **kwargs)
+        logger = logging.getLogger("emit_latency_{}".format(id(handler)))
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        # Nothing is pushed to the dummy URL, not even when the interpreter exits
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(handler.buffer.drain)
+        return logger
+
+    def _latencies(self, logger):
+        latencies = []
+        for index in range(self.CALLS):
+            start = time.perf_counter()
+            logger.info("GET /api/items/%d %s", index, "ok", extra={"request_id": index})
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        return {"p50": latencies[len(latencies) // 2], "p99": latencies[int(len(latencies) * 0.99)]}
+
+    def test_deferred_formatting(self):
+        loggers = {"eager": self._logger(), "deferred": self._logger(deferred_formatting=True)}
+
+        # Rounds alternate between the modes, the best round of each is kept to limit the noise
+        results = {}
+        for _ in range(self.ROUNDS):
+            for name, logger in loggers.items():
+                result = self._latencies(logger)
+                if name not in results or result["p50"] < results[name]["p50"]:
+                    results[name] = result
+
+        _assert_faster(
+            self, results["deferred"]["p50"], results["eager"]["p50"],
+            "deferred p50 {:.2f} us < eager p50 {:.2f} us".format(
+                results["deferred"]["p50"] * 1e6, results["eager"]["p50"] * 1e6),
+        )
+
+
+class TestTransportBenchmark(unittest.TestCase):
+    PUSHES = 300
+
+    def test_push_overhead(self):
+        server = LokiServer().start()
+        self.addCleanup(server.stop)
+        body = _build_streams(lines=20, streams=1).serialize()
+
+        results = {}
+        for transport in ("requests", "http.client"):
+            request = LokiRequest(server.url, transport=transport)
+            request.send(body)  # Open the connection
+            start = time.perf_counter()
+            for _ in range(self.PUSHES):
+                request.send(body)
+            results[transport] = (time.perf_counter() - start) / self.PUSHES
+            request.close()
+
+        self.assertEqual(len(server.pushes), 2 * (self.PUSHES + 1))
+        _assert_faster(
+            self, results["http.client"], results["requests"],
+            "http.client {:.1f} us/push < requests {:.1f} us/push".format(
+                results["http.client"] * 1e6, results["requests"] * 1e6),
+        )
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_results_are_json_and_comparable(self):
+        results = json.loads(json.dumps(benchmark_suite.run(scale=0.01)))
+
+        self.assertEqual(list(results["results"]), list(benchmark_suite.BENCHMARKS))
+        self.assertGreater(results["results"]["throughput"]["4_threads"]["records_per_second"], 0)
+        changes = benchmark_suite.compare(results, results)
+        self.assertIn("emit_latency.eager.p99_us", changes)
+        self.assertEqual(set(changes.values()), {0.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
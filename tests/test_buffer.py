@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+import unittest
+
+try:
+    from unittest.mock import patch  # Python 3.x
+except ImportError:
+    from mock import patch  # Python 2.7
+
+from loki_logger_handler.buffer import LogBuffer, DROP_NEWEST, DROP_OLDEST, BLOCK_WITH_TIMEOUT
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler
+
+from tests.loki_server import LokiServer
+
+
+class TestLogBuffer(unittest.TestCase):
+    def test_unbounded_fifo(self):
+        buffer = LogBuffer()
+        for i in range(5):
+            self.assertTrue(buffer.put(i, 10))
+
+        self.assertEqual(buffer.qsize(), 5)
+        self.assertEqual(buffer.size_bytes, 50)
+        self.assertEqual(buffer.drain(), [0, 1, 2, 3, 4])
+        self.assertTrue(buffer.empty())
+        self.assertEqual(buffer.size_bytes, 0)
+
+    def test_drop_newest(self):
+        buffer = LogBuffer(max_records=2, overflow_policy=DROP_NEWEST)
+        results = [buffer.put(i) for i in range(4)]
+
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(buffer.dropped, 2)
+        self.assertEqual(buffer.drain(), [0, 1])
+
+    def test_drop_oldest(self):
+        buffer = LogBuffer(max_records=2, overflow_policy=DROP_OLDEST)
+        for i in range(4):
+            self.assertTrue(buffer.put(i))
+
+        self.assertEqual(buffer.dropped, 2)
+        self.assertEqual(buffer.drain(), [2, 3])
+
+    def test_byte_cap(self):
+        buffer = LogBuffer(max_bytes=100, overflow_policy=DROP_OLDEST)
+        buffer.put("a", 60)
+        buffer.put("b", 30)
+        buffer.put("c", 30)
+
+        self.assertEqual(buffer.drain(), ["b", "c"])
+        self.assertEqual(buffer.dropped, 1)
+
+    def test_oversized_record_accepted_when_empty(self):
+        buffer = LogBuffer(max_bytes=10)
+        self.assertTrue(buffer.put("big", 50))
+        self.assertFalse(buffer.put("next", 1))
+
+    def test_block_with_timeout_expires(self):
+        buffer = LogBuffer(max_records=1, overflow_policy=BLOCK_WITH_TIMEOUT, block_timeout=0.05)
+        buffer.put(1)
+
+        start = time.time()
+        self.assertFalse(buffer.put(2))
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        self.assertEqual(buffer.dropped, 1)
+
+    def test_block_with_timeout_unblocked_by_drain(self):
+        buffer = LogBuffer(max_records=1, overflow_policy=BLOCK_WITH_TIMEOUT, block_timeout=5)
+        buffer.put(1)
+
+        timer = threading.Timer(0.05, buffer.drain)
+        timer.start()
+        self.assertTrue(buffer.put(2))
+        timer.join()
+
+        self.assertEqual(buffer.drain(), [2])
+        self.assertEqual(buffer.dropped, 0)
+
+    def test_block_with_timeout_calls_on_full(self):
+        calls = []
+        buffer = LogBuffer(max_records=1, overflow_policy=BLOCK_WITH_TIMEOUT, block_timeout=5,
+                           on_full=lambda: threading.Timer(0.05, lambda: calls.append(buffer.drain())).start())
+        buffer.put(1)
+
+        self.assertTrue(buffer.put(2))
+        self.assertEqual(calls, [[1]])
+
+    def test_blocked_emit_wakes_the_flush_thread(self):
+        server = LokiServer().start()
+        self.addCleanup(server.stop)
+        handler = LokiLoggerHandler(server.url, labels={"application": "Test"}, timeout=60, buffer_max_records=2,
+                                    buffer_overflow_policy=BLOCK_WITH_TIMEOUT, buffer_block_timeout=5)
+        self.addCleanup(handler.close, 1)
+        logger = logging.getLogger("test_buffer_block")
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        start = time.monotonic()
+        for index in range(5):
+            logger.warning("record %d", index)
+
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(handler.dropped_records, 0)
+        self.assertTrue(handler.flush(5))
+        self.assertEqual(server.received, 5)
+
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_put_counts_dropped_records(self, mock_thread):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"label1": "value1"},
+            buffer_max_records=1,
+        )
+
+        handler._put({"message": "kept"}, {})
+        handler._put({"message": "dropped"}, {})
+
+        self.assertEqual(handler.dropped_records, 1)
+        self.assertEqual([log.line["message"] for log in handler.buffer.drain()], ["kept"])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            LogBuffer(overflow_policy="drop_everything")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+import logging
+import socket
+import time
+import unittest
+
+try:
+    from unittest.mock import patch, MagicMock  # Python 3.x
+except ImportError:
+    from mock import patch, MagicMock  # Python 2.7
+
+import requests
+
+from loki_logger_handler.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler
+from loki_logger_handler.loki_request import LokiRequest
+from loki_logger_handler.retry import RetryPolicy
+
+
+def _response(status_code):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = {}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(str(status_code))
+    return response
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_consecutive_failures(self):
+        changes = []
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60,
+                                 on_state_change=lambda old, new: changes.append((old, new)))
+
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow_request())
+        self.assertEqual(changes, [(CLOSED, OPEN)])
+
+    def test_state_change_callback_may_use_the_breaker(self):
+        states = []
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60,
+                                 on_state_change=lambda old, new: states.append(breaker.allow_request()))
+
+        breaker.record_failure()
+
+        self.assertEqual(states, [False])
+
+    def test_lets_a_single_probe_through_after_the_reset_timeout(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+
+        self.assertFalse(breaker.is_open())
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_failure()
+        self.assertEqual(breaker.state, OPEN)
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(
+            [(old, new) for _, old, new in breaker.transitions],
+            [(CLOSED, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)],
+        )
+
+
+@patch("loki_logger_handler.loki_request.requests.Session")
+class TestLokiRequestCircuitBreaker(unittest.TestCase):
+    def _request(self, responses, **options):
+        request = LokiRequest("http://loki", retry_policy=RetryPolicy(max_attempts=1), **options)
+        request.session.post.side_effect = responses
+        return request
+
+    def test_open_breaker_rejects_pushes_without_sending(self, mock_session):
+        request = self._request([_response(503)] * 2, circuit_breaker=CircuitBreaker(failure_threshold=2))
+
+        for _ in range(2):
+            with self.assertRaises(requests.RequestException):
+                request.post(b"body")
+        with self.assertRaises(CircuitOpenError):
+            request.post(b"body")
+
+        self.assertEqual(request.session.post.call_count, 2)
+
+    def test_client_errors_do_not_open_the_breaker(self, mock_session):
+        breaker = CircuitBreaker(failure_threshold=1)
+        request = self._request([_response(400)], circuit_breaker=breaker)
+
+        with self.assertRaises(requests.RequestException):
+            request.post(b"body")
+
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_timeouts_are_passed_to_the_session(self, mock_session):
+        request = self._request([_response(204)], connect_timeout=2, read_timeout=5)
+
+        request.post(b"body")
+
+        self.assertEqual(request.session.post.call_args[1]["timeout"], (2, 5))
+
+    def test_batch_deadline_stops_retrying(self, mock_session):
+        request = LokiRequest("http://loki", retry_policy=RetryPolicy(base_delay=1, max_delay=1),
+                              batch_deadline=0.5)
+        request.session.post.side_effect = [_response(429)] * 5
+        request.retry_policy.compute_delay = lambda attempt, retry_after=None: 0.3
+
+        with self.assertRaises(requests.RequestException):
+            request.post(b"body")
+
+        self.assertEqual(request.session.post.call_count, 2)
+        connect_timeout, read_timeout = request.session.post.call_args[1]["timeout"]
+        self.assertLess(read_timeout, 0.3)
+
+
+class TestHandlerCircuitBreaker(unittest.TestCase):
+    def _handler(self, **options):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        with patch("loki_logger_handler.loki_logger_handler.threading.Thread"):
+            handler = LokiLoggerHandler(
+                "http://test_url", labels={"application": "Test"}, circuit_breaker=breaker,
+                retry_policy=RetryPolicy(max_attempts=1), max_request_bytes=300, **options
+            )
+        for index in range(20):
+            handler._put({"message": "line {}".format(index), "timestamp": 1700000000 + index}, {})
+        return handler, breaker
+
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    def test_unsent_records_are_buffered_again_when_the_breaker_opens(self, mock_session):
+        handler, breaker = self._handler()
+        post = handler.request.session.post
+        post.return_value = _response(503)
+
+        handler._send()
+
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(post.call_count, 2)
+        failed = handler.stats()["records_failed"]
+        self.assertGreater(failed, 0)
+        self.assertEqual(handler.buffer.qsize(), 20 - failed)
+
+        # The buffered records are pushed, in order, once Loki is back
+        breaker._opened_at -= 60
+        post.reset_mock()
+        post.return_value = _response(204)
+        handler._send()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(handler.buffer.empty())
+        self.assertEqual(handler.stats()["records_sent"], 20 - failed)
+
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    def test_sender_workers_do_not_dispatch_while_the_breaker_is_open(self, mock_session):
+        handler, breaker = self._handler()
+        handler.sender_queues = [MagicMock()]
+        breaker.record_failure()
+        breaker.record_failure()
+
+        handler._send()
+
+        handler.sender_queues[0].put.assert_not_called()
+        self.assertEqual(handler.buffer.qsize(), 20)
+
+
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    def test_sender_workers_buffer_again_the_bodies_rejected_by_the_breaker(self, mock_session):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        handler = LokiLoggerHandler("http://test_url", labels={"application": "Test"}, timeout=60,
+                                    circuit_breaker=breaker, sender_workers=1)
+        self.addCleanup(handler.close, 1)
+        breaker.record_failure()
+        # A probe is in flight: the breaker is half open and rejects the other pushes
+        self.assertTrue(breaker.allow_request())
+
+        for index in range(5):
+            handler._put({"message": "line {}".format(index), "timestamp": 1700000000 + index}, {})
+        handler._send()
+        handler._wait_for_senders()
+
+        handler.request.session.post.assert_not_called()
+        self.assertEqual(handler.buffer.qsize(), 5)
+        self.assertEqual(handler.stats()["records_failed"], 0)
+
+
+class TestHungServer(unittest.TestCase):
+    def setUp(self):
+        # Accepts connections and never answers
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(5)
+        self.url = "http://127.0.0.1:{}/loki/api/v1/push".format(self.server.getsockname()[1])
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_read_timeout_bounds_a_push(self):
+        request = LokiRequest(self.url, retry_policy=RetryPolicy(max_attempts=1), read_timeout=0.2)
+
+        start = time.monotonic()
+        with self.assertRaises(requests.RequestException):
+            request.post(b"{}")
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_records_stay_buffered_while_the_breaker_is_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        handler = LokiLoggerHandler(self.url, labels={"application": "Test"}, timeout=0.05, circuit_breaker=breaker,
+                                    retry_policy=RetryPolicy(max_attempts=1), read_timeout=0.1)
+        logger = logging.getLogger("test_circuit_breaker")
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        logger.error("lost")
+        for _ in range(100):
+            if breaker.state == OPEN:
+                break
+            time.sleep(0.02)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertTrue(handler.error)
+
+        logger.error("kept")
+        time.sleep(0.2)
+        self.assertEqual(handler.buffer.qsize(), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import gzip
+import json
+import unittest
+import zlib
+
+try:
+    from unittest.mock import patch  # Python 3.x
+except ImportError:
+    from mock import patch  # Python 2.7
+
+from loki_logger_handler.compression import EncodedBody, available_codecs, compress_chunks
+from loki_logger_handler.loki_request import LokiRequest
+
+from tests.loki_server import decode_push_body
+
+PAYLOAD = '{"streams":[{"stream":{"application":"Test"},"values":[["1","' + "line é " * 200 + '"]]}]}'
+
+
+class TestCompression(unittest.TestCase):
+    def test_codecs_round_trip(self):
+        chunks = [PAYLOAD[:100], PAYLOAD[100:].encode("utf-8")]
+        for codec in available_codecs():
+            body = compress_chunks(chunks, codec)
+            self.assertEqual(body.content_encoding, codec)
+            self.assertLess(len(body), len(PAYLOAD))
+            streams = decode_push_body(body, {"content-type": "application/json", "content-encoding": codec})
+            self.assertEqual(streams[0]["values"][0][1], "line é " * 200)
+
+    def test_gzip_level(self):
+        body = compress_chunks([PAYLOAD], "gzip", level=1)
+        self.assertEqual(gzip.decompress(body).decode("utf-8"), PAYLOAD)
+
+    def test_small_bodies_are_not_compressed(self):
+        body = compress_chunks(['{"streams":', "[]}"], "gzip", min_bytes=1024)
+
+        self.assertEqual(body, b'{"streams":[]}')
+        self.assertIsNone(body.content_encoding)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            LokiRequest("http://loki", compression="brotli")
+
+
+class TestLokiRequestCompression(unittest.TestCase):
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    def test_content_encoding_follows_the_body(self, mock_session):
+        request = LokiRequest("http://loki", compression="deflate", compression_min_bytes=1024)
+
+        request.send(PAYLOAD)
+        request.send('{"streams":[]}')
+
+        (_, large), (_, small) = mock_session.return_value.post.call_args_list
+        self.assertEqual(large["headers"]["Content-Encoding"], "deflate")
+        self.assertEqual(zlib.decompress(large["data"], -zlib.MAX_WBITS).decode("utf-8"), PAYLOAD)
+        self.assertNotIn("Content-Encoding", small["headers"])
+        self.assertEqual(json.loads(small["data"]), {"streams": []})
+
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    def test_compressed_flag_is_gzip(self, mock_session):
+        request = LokiRequest("http://loki", compressed=True)
+
+        body = request.encode(iter([PAYLOAD[:10], PAYLOAD[10:]]))
+
+        self.assertIsInstance(body, EncodedBody)
+        self.assertEqual(request.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(body).decode("utf-8"), PAYLOAD)
+
+
+if __name__ == "__main__":
+    unittest.main()
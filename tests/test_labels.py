@@ -0,0 +1,138 @@
+import pickle
+import unittest
+
+try:
+    from unittest.mock import patch  # Python 3.x
+except ImportError:
+    from mock import patch  # Python 2.7
+
+from loki_logger_handler.labels import LabelRegistry, LabelSet
+from loki_logger_handler.loki_logger_handler import LogLine
+
+
+class TestLabelSet(unittest.TestCase):
+    def test_keys_do_not_collide(self):
+        self.assertNotEqual(LabelSet({"a": "x_y"}).key, LabelSet({"a": "x", "b": "y"}).key)
+        self.assertNotEqual(LabelSet({"a": 'x", b="y'}).key, LabelSet({"a": "x", "b": "y"}).key)
+
+    def test_values_are_strings(self):
+        labels = LabelSet({"port": 8080, "debug": True})
+
+        self.assertEqual(labels, {"port": "8080", "debug": "True"})
+        self.assertEqual(labels.key, '{debug="True", port="8080"}')
+
+    def test_is_immutable(self):
+        labels = LabelSet({"application": "Test"})
+
+        with self.assertRaises(TypeError):
+            labels["application"] = "Other"
+        with self.assertRaises(TypeError):
+            labels.update({"environment": "Develop"})
+        self.assertEqual(pickle.loads(pickle.dumps(labels)).key, labels.key)
+
+
+class TestLabelRegistry(unittest.TestCase):
+    def test_static_labels_are_shared(self):
+        registry = LabelRegistry({"application": "Test"})
+
+        self.assertIs(registry.resolve({"message": "a"})[0], registry.resolve({"message": "b"})[0])
+        self.assertEqual(len(registry), 0)
+
+    def test_label_keys_are_interned(self):
+        registry = LabelRegistry({"application": "Test"}, {"function"})
+
+        first, _ = registry.resolve({"function": "handler", "message": "a"})
+        second, _ = registry.resolve({"function": "handler", "message": "b"})
+        other, _ = registry.resolve({"message": "c"})
+
+        self.assertIs(first, second)
+        self.assertEqual(first, {"application": "Test", "function": "handler"})
+        self.assertEqual(other, {"application": "Test"})
+
+    def test_cache_is_bounded(self):
+        registry = LabelRegistry({"application": "Test"}, {"user"}, max_entries=2)
+
+        first, _ = registry.resolve({"user": 1})
+        registry.resolve({"user": 2})
+        self.assertIs(registry.resolve({"user": 1})[0], first)
+        registry.resolve({"user": 3})
+
+        self.assertEqual(len(registry), 2)
+        self.assertIs(registry.resolve({"user": 1})[0], first)
+
+    def test_unhashable_values(self):
+        registry = LabelRegistry({}, {"tags"})
+
+        self.assertEqual(registry.resolve({"tags": ["a", "b"]}), ({"tags": "['a', 'b']"}, None))
+
+    def test_equal_values_of_different_types_are_different_labels(self):
+        registry = LabelRegistry({}, {"flag"})
+
+        labels = [registry.resolve({"flag": value})[0] for value in (1, True, 1.0, "1")]
+
+        self.assertEqual([label["flag"] for label in labels], ["1", "True", "1.0", "1"])
+        self.assertIs(labels[3], labels[0])
+
+    def test_cardinality_limit_demotes_to_metadata(self):
+        demoted_keys = []
+        registry = LabelRegistry({"application": "Test"}, ("function", "request_id"),
+                                 max_values_per_key=2, on_demote=demoted_keys.append)
+
+        for request_id in ("1", "2"):
+            labels, demoted = registry.resolve({"function": "f", "request_id": request_id})
+            self.assertEqual(labels["request_id"], request_id)
+            self.assertIsNone(demoted)
+
+        labels, demoted = registry.resolve({"function": "f", "request_id": "3"})
+        self.assertEqual(labels, {"application": "Test", "function": "f"})
+        self.assertEqual(demoted, {"request_id": "3"})
+
+        labels, demoted = registry.resolve({"function": "f", "request_id": "1"})
+        self.assertEqual(labels, {"application": "Test", "function": "f"})
+        self.assertEqual(demoted, {"request_id": "1"})
+
+        self.assertEqual(demoted_keys, ["request_id"])
+        self.assertEqual(registry.demoted_keys, {"request_id"})
+        self.assertEqual(registry.demoted_records, 2)
+
+    def test_cardinality_limit_overflow_value(self):
+        registry = LabelRegistry({}, {"request_id"}, max_values_per_key=1, overflow_policy="overflow")
+
+        registry.resolve({"request_id": "1"})
+        first, _ = registry.resolve({"request_id": "2"})
+        second, demoted = registry.resolve({"request_id": "3"})
+
+        self.assertIs(first, second)
+        self.assertEqual(first, {"request_id": "__overflow__"})
+        self.assertIsNone(demoted)
+
+    @patch("loki_logger_handler.labels.time.monotonic")
+    def test_demoted_key_is_a_label_again_after_the_window(self, monotonic):
+        monotonic.return_value = 1000.0
+        registry = LabelRegistry({}, ("request_id",), max_values_per_key=1, values_window=60)
+
+        registry.resolve({"request_id": "1"})
+        labels, demoted = registry.resolve({"request_id": "2"})
+        self.assertEqual(labels, {})
+        self.assertEqual(registry.demoted_keys, {"request_id"})
+
+        monotonic.return_value = 1060.0
+        labels, demoted = registry.resolve({"request_id": "2"})
+        self.assertEqual(labels, {"request_id": "2"})
+        self.assertIsNone(demoted)
+        self.assertEqual(registry.demoted_keys, frozenset())
+
+        labels, _ = registry.resolve({"request_id": "3"})
+        self.assertEqual(labels, {})
+
+    def test_unknown_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            LabelRegistry({}, overflow_policy="ignore")
+
+    def test_log_line_key(self):
+        self.assertEqual(LogLine(LabelSet({"a": "x"}), {}).key, LogLine({"a": "x"}, {}).key)
+        self.assertNotEqual(LogLine({"a": "x_y"}, {}).key, LogLine({"a": "x", "b": "y"}, {}).key)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import json
+import logging
+import sys
+import threading
+import time
+import unittest
+
+from loki_logger_handler.buffer import DROP_OLDEST
+from loki_logger_handler.lanes import Lane, LaneBuffer
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler
+
+from tests.loki_server import LokiServer
+
+
+def _lanes():
+    return [
+        Lane(logging.NOTSET),
+        Lane(logging.WARNING, flush_interval=0.5),
+        Lane("error", flush_interval=0, max_records=10),
+    ]
+
+
+class TestLaneBuffer(unittest.TestCase):
+    def test_routes_records_by_level(self):
+        buffer = LaneBuffer(_lanes())
+
+        self.assertEqual(buffer.lane_for(logging.DEBUG).level, logging.NOTSET)
+        self.assertEqual(buffer.lane_for(logging.WARNING).level, logging.WARNING)
+        self.assertEqual(buffer.lane_for(logging.CRITICAL).level, logging.ERROR)
+
+        buffer.put("info", 1, logging.INFO)
+        buffer.put("error", 1, logging.ERROR)
+        buffer.put("warning", 1, logging.WARNING)
+
+        self.assertEqual(buffer.qsize(), 3)
+        self.assertEqual(buffer.size_bytes, 3)
+        self.assertEqual(buffer.drain(), ["error", "warning", "info"])
+        self.assertTrue(buffer.empty())
+
+    def test_lower_lanes_are_shed_first(self):
+        buffer = LaneBuffer(_lanes(), max_records=4)
+        for index in range(4):
+            self.assertTrue(buffer.put("info {}".format(index), 1, logging.INFO))
+
+        self.assertTrue(buffer.put("warning", 1, logging.WARNING))
+        self.assertTrue(buffer.put("error", 1, logging.ERROR))
+        # No lower lane is left to shed for an info record
+        self.assertFalse(buffer.put("info 4", 1, logging.INFO))
+
+        self.assertEqual(buffer.dropped, 3)
+        self.assertEqual(buffer.drain(), ["error", "warning", "info 2", "info 3"])
+
+    def test_drop_oldest_sheds_the_own_lane_last(self):
+        buffer = LaneBuffer(_lanes(), max_records=2, overflow_policy=DROP_OLDEST)
+        for index in range(3):
+            buffer.put("error {}".format(index), 1, logging.ERROR)
+
+        self.assertEqual(buffer.drain(), ["error 1", "error 2"])
+
+    def test_shared_budget_holds_under_concurrent_puts(self):
+        buffer = LaneBuffer(_lanes(), max_records=20)
+        # Switch threads as often as possible to interleave the puts
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+
+        sizes = []
+
+        def put():
+            for index in range(2000):
+                buffer.put(index, 1, logging.ERROR if index % 2 else logging.INFO)
+                sizes.append(buffer.qsize())
+
+        threads = [threading.Thread(target=put) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(max(sizes), 20)
+        self.assertEqual(buffer.qsize() + buffer.dropped, 16000)
+
+    def test_lane_budget(self):
+        buffer = LaneBuffer(_lanes())
+        for index in range(12):
+            buffer.put("error {}".format(index), 1, logging.ERROR)
+
+        stats = buffer.lane_stats()
+        self.assertEqual(stats[2], {"level": "ERROR", "records": 10, "bytes": 10, "dropped": 2})
+        self.assertEqual(buffer.dropped, 2)
+
+    def test_due_in(self):
+        buffer = LaneBuffer(_lanes())
+        self.assertEqual(buffer.due_in(), 0.5)
+
+        buffer.put("warning", 1, logging.WARNING)
+        self.assertAlmostEqual(buffer.due_in(time.monotonic() + 0.2), 0.3, places=2)
+        self.assertEqual(buffer.due_in(time.monotonic() + 1), 0)
+
+        buffer.put("error", 1, logging.ERROR)
+        self.assertEqual(buffer.due_in(), 0)
+
+        buffer.drain()
+        self.assertEqual(buffer.due_in(), 0.5)
+
+    def test_invalid_lanes(self):
+        with self.assertRaises(ValueError):
+            LaneBuffer([])
+        with self.assertRaises(ValueError):
+            LaneBuffer([Lane(logging.INFO), Lane("INFO")])
+        with self.assertRaises(ValueError):
+            Lane("LOUD")
+
+
+class TestPriorityLanes(unittest.TestCase):
+    def setUp(self):
+        self.server = LokiServer().start()
+        self.addCleanup(self.server.stop)
+
+    def _logger(self, **kwargs):
+        handler = LokiLoggerHandler(
+            self.server.url, labels={"application": "Test"}, timeout=60, priority_lanes=_lanes(), **kwargs
+        )
+        logger = logging.getLogger("test_lanes_{}".format(id(handler)))
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        self.addCleanup(handler.close, 1)
+        return handler, logger
+
+    def _wait_for_lines(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.server.received < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.server.received
+
+    def test_errors_are_pushed_immediately(self):
+        handler, logger = self._logger()
+        logger.info("routine")
+        time.sleep(0.2)
+        self.assertEqual(self.server.received, 0)
+
+        logger.error("alert")
+
+        self.assertEqual(self._wait_for_lines(2, timeout=1), 2)
+        messages = {json.loads(line)["message"] for line in self.server.lines}
+        self.assertEqual(messages, {"routine", "alert"})
+
+    def test_errors_are_pushed_before_the_backlog(self):
+        handler, logger = self._logger(max_request_bytes=20000)
+        for index in range(2000):
+            logger.info("routine %d", index)
+
+        logger.error("alert")
+
+        self.assertEqual(self._wait_for_lines(2001), 2001)
+        self.assertGreater(len(self.server.pushes), 1)
+        first_push = [json.loads(value[1])["message"] for stream in self.server.pushes[0] for value in stream["values"]]
+        self.assertEqual(first_push, ["alert"])
+
+    def test_warnings_are_pushed_within_their_interval(self):
+        handler, logger = self._logger(deferred_formatting=True)
+        logger.warning("slow disk")
+
+        started = time.monotonic()
+        self.assertEqual(self._wait_for_lines(1, timeout=3), 1)
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_errors_survive_a_debug_flood(self):
+        handler, logger = self._logger(buffer_max_records=100)
+        # Nothing is due before the flood is over
+        handler.buffer.lane_for(logging.ERROR).flush_interval = None
+        logger.error("before the flood")
+        for index in range(1000):
+            logger.debug("noise %d", index)
+        logger.error("after the flood")
+
+        self.assertTrue(handler.flush(5))
+        messages = [json.loads(line)["message"] for line in self.server.lines]
+        self.assertIn("before the flood", messages)
+        self.assertIn("after the flood", messages)
+        self.assertEqual(len(messages), 100)
+        self.assertEqual(handler.dropped_records, 902)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import logging
+import sys
+import unittest
+
+from loki_logger_handler.formatters.logger_formatter import LoggerFormatter
+
+
+def _record(level=logging.INFO, msg="hello %s", args=("world",), exc_info=None, **extra):
+    record = logging.LogRecord("app", level, "/src/app.py", 12, msg, args, exc_info, func="handle")
+    record.__dict__.update(extra)
+    return record
+
+
+class TestLoggerFormatter(unittest.TestCase):
+    def test_default_fields(self):
+        record = _record(request_id="abc", loki_metadata={"trace_id": "1"})
+
+        formatted, loki_metadata = LoggerFormatter().format(record)
+
+        self.assertEqual(formatted, {
+            "message": "hello world",
+            "timestamp": record.created,
+            "process": record.process,
+            "thread": record.thread,
+            "function": "handle",
+            "module": "app",
+            "name": "app",
+            "level": "INFO",
+            "request_id": "abc",
+        })
+        self.assertEqual(loki_metadata, {"trace_id": "1"})
+
+    def test_standard_attributes_of_the_running_python(self):
+        self.assertTrue(set(logging.makeLogRecord({}).__dict__) <= LoggerFormatter.LOG_RECORD_FIELDS)
+
+    def test_ignores_attributes_set_by_other_formatters(self):
+        record = _record()
+        logging.Formatter("%(asctime)s %(message)s").format(record)
+
+        formatted, _ = LoggerFormatter().format(record)
+
+        self.assertNotIn("asctime", formatted)
+        self.assertEqual(formatted["message"], "hello world")
+
+    def test_extra_of_a_record_missing_a_standard_attribute(self):
+        # As many attributes as a standard record, one of them custom
+        record = _record(request_id="abc")
+        del record.stack_info
+
+        formatted, _ = LoggerFormatter().format(record)
+
+        self.assertEqual(formatted["request_id"], "abc")
+
+    def test_error_fields(self):
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = _record(logging.ERROR, exc_info=sys.exc_info())
+
+        formatted, _ = LoggerFormatter().format(record)
+
+        self.assertEqual((formatted["file"], formatted["path"], formatted["line"]), ("app.py", "/src/app.py", 12))
+        self.assertIn("ValueError: boom", formatted["stacktrace"])
+
+    def test_field_spec(self):
+        formatter = LoggerFormatter(
+            fields={"message": "message", "level": "levelname", "request": "request_id"},
+            error_fields={"line": "lineno"},
+            rename={"level": "severity", "user": "user_id"},
+            exclude={"secret"},
+        )
+
+        formatted, _ = formatter.format(_record(request_id="abc", user="bob", secret="x"))
+        self.assertEqual(formatted, {"message": "hello world", "severity": "INFO", "request": "abc", "user_id": "bob"})
+
+        formatted, _ = formatter.format(_record(logging.ERROR))
+        self.assertEqual(formatted, {"message": "hello world", "severity": "ERROR", "request": None, "line": 12})
+
+    def test_without_extra(self):
+        formatted, loki_metadata = LoggerFormatter(include_extra=False).format(
+            _record(request_id="abc", loki_metadata={"trace_id": "1"}))
+
+        self.assertNotIn("request_id", formatted)
+        self.assertEqual(loki_metadata, {"trace_id": "1"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import os
+import unittest
+
+try:
+    from unittest.mock import patch, MagicMock  # Python 3.x
+except ImportError:
+    from mock import patch, MagicMock  # Python 2.7
+
+from loki_logger_handler import snappy
+from loki_logger_handler.logproto import format_labels
+from loki_logger_handler.loki_request import LokiRequest, PROTOBUF_FORMAT
+from loki_logger_handler.stream import Stream
+from loki_logger_handler.streams import Streams
+
+from tests.helper import decode_push_request
+
+
+class TestSnappy(unittest.TestCase):
+    def test_round_trip(self):
+        samples = [
+            b"",
+            b"abc",
+            b"a" * 1000,
+            os.urandom(5000),
+            b'{"message": "hello", "level": "INFO"}' * 5000,
+        ]
+        for sample in samples:
+            compressed = snappy.compress(sample)
+            self.assertEqual(snappy.decompress(compressed), sample)
+
+    def test_compresses_repetitive_data(self):
+        data = b'{"message": "hello world", "level": "INFO"}' * 1000
+        self.assertLess(len(snappy.compress(data)), len(data) // 10)
+
+
+class TestLogproto(unittest.TestCase):
+    def test_format_labels_sorted_and_escaped(self):
+        labels = {"b": 'say "hi"', "a": "x\\y\nz"}
+        self.assertEqual(format_labels(labels), '{a="x\\\\y\\nz", b="say \\"hi\\""}')
+
+    def test_protobuf_matches_json(self):
+        stream = Stream({"application": "Test"}, {"service": "api"})
+        stream.append_value({"message": "first", "timestamp": 1700000000.5})
+        stream.append_value({"message": "second ü", "timestamp": 1700000001.25}, {"user": 42})
+        streams = Streams([stream])
+
+        expected = json.loads(streams.serialize())["streams"][0]
+        decoded = decode_push_request(streams.serialize_protobuf())["streams"][0]
+
+        self.assertEqual(decoded["labels"], '{application="Test"}')
+        self.assertEqual(decoded["values"], expected["values"])
+
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    def test_request_sends_snappy_protobuf(self, mock_session):
+        request = LokiRequest("http://loki", compressed=True, payload_format=PROTOBUF_FORMAT)
+        request.session.post.return_value = MagicMock()
+
+        stream = Stream({"application": "Test"})
+        stream.append_value({"message": "hello", "timestamp": 1700000000.0})
+        request.send(Streams([stream]).serialize_protobuf())
+
+        _, kwargs = request.session.post.call_args
+        self.assertEqual(kwargs["headers"]["Content-Type"], "application/x-protobuf")
+        self.assertNotIn("Content-Encoding", kwargs["headers"])
+        body = decode_push_request(snappy.decompress(kwargs["data"]))
+        self.assertEqual(body["streams"][0]["values"][0][0], "1700000000000000000")
+
+    def test_unknown_payload_format(self):
+        with self.assertRaises(ValueError):
+            LokiRequest("http://loki", payload_format="xml")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,19 @@
+import gzip
+import json
 import logging
+import os
+import threading
+import time
 import unittest
 import pytest
 
 try:
-    from unittest.mock import patch, Mock, MagicMock, call  # Python 3.x
+    from unittest.mock import patch, Mock, MagicMock, call, ANY  # Python 3.x
 except ImportError:
-    from mock import patch, Mock, MagicMock, call  # Python 2.7
+    from mock import patch, Mock, MagicMock, call, ANY  # Python 2.7
 
+from loki_logger_handler.circuit_breaker import CircuitOpenError
+from loki_logger_handler.deferred import DeferredRecord
 from loki_logger_handler.loki_logger_handler import LogLine, LokiLoggerHandler
 from loki_logger_handler.stream import Stream
 from loki_logger_handler.formatters.logger_formatter import LoggerFormatter
@@ -52,7 +59,7 @@ class TestLokiLoggerHandler(unittest.TestCase):
 
         # Assert
         mock_formatter.format.assert_called_with(record)
-        mock_put.assert_called_with(*mock_formatter.format.return_value)
+        mock_put.assert_called_with(*mock_formatter.format.return_value, timestamp_ns=ANY)
 
     @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
     def test_emit_no_record(self, mock_thread):
@@ -240,12 +247,11 @@ class TestLokiLoggerHandler(unittest.TestCase):
 
         mock_queue = Mock()
         handler.buffer = mock_queue
-        handler.buffer.empty.side_effect = [False, False, True]
 
         # Arrange
         log1 = LogLine({"label1": "value1"}, record)
         log2 = LogLine({"label2": "value2"}, record)
-        handler.buffer.get.side_effect = [log1, log2]
+        handler.buffer.drain.return_value = [log1, log2]
 
         # Act
         handler._send()
@@ -262,10 +268,10 @@ class TestLokiLoggerHandler(unittest.TestCase):
 
         mock_stream.assert_has_calls(
             [
-                call(log1.labels, None, message_in_json_format),
-                call().append_value(log1.line,None),
-                call(log2.labels, None, message_in_json_format),
-                call().append_value(log2.line,None),
+                call(log1.labels, None, message_in_json_format, serializer=handler.serializer),
+                call().append_value(log1.line, None, None),
+                call(log2.labels, None, message_in_json_format, serializer=handler.serializer),
+                call().append_value(log2.line, None, None),
             ]
         )
 
@@ -298,11 +304,10 @@ class TestLokiLoggerHandler(unittest.TestCase):
 
         mock_queue = Mock()
         handler.buffer = mock_queue
-        handler.buffer.empty.side_effect = [False, False, True]
 
         log1 = LogLine({"label1": "value1"}, record)
         log2 = LogLine({"label1": "value2"}, record)
-        handler.buffer.get.side_effect = [log1, log2]
+        handler.buffer.drain.return_value = [log1, log2]
 
         handler._send()
 
@@ -314,7 +319,7 @@ class TestLokiLoggerHandler(unittest.TestCase):
         actual_streams = list(mock_streams.call_args[0][0])
         self.assertEqual(expected_streams, actual_streams)
 
-        mock_stream.assert_has_calls([call(log1.labels,None, message_in_json_format)])
+        mock_stream.assert_has_calls([call(log1.labels,None, message_in_json_format, serializer=handler.serializer)])
 
     @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
     @patch("loki_logger_handler.loki_logger_handler.Streams")
@@ -327,6 +332,7 @@ class TestLokiLoggerHandler(unittest.TestCase):
 
         mock_queue = Mock()
         handler.buffer = mock_queue
+        handler.buffer.drain.return_value = []
 
         handler._send()
 
@@ -415,7 +421,7 @@ class TestLokiLoggerHandler(unittest.TestCase):
         handler.emit(record)
 
         # Assert
-        mock_put.assert_called_with("Custom formatted: Test message", None)
+        mock_put.assert_called_with("Custom formatted: Test message", None, timestamp_ns=ANY)
 
     @patch("loki_logger_handler.loki_logger_handler.LokiLoggerHandler._put")
     def test_loki_metadata_validation(self, mock_put):
@@ -435,7 +441,300 @@ class TestLokiLoggerHandler(unittest.TestCase):
 
         # Assert
         mock_formatter.format.assert_called_with(record)
-        mock_put.assert_called_with("formatted_value", {"key": "value"})
+        mock_put.assert_called_with("formatted_value", {"key": "value"}, timestamp_ns=ANY)
+
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_put_wakes_flush_on_max_batch_lines(self, mock_thread):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"label1": "value1"},
+            max_batch_lines=3,
+        )
+
+        handler._put({"message": "one"}, {})
+        handler._put({"message": "two"}, {})
+        self.assertFalse(handler.flush_event.is_set())
+
+        handler._put({"message": "three"}, {})
+        self.assertTrue(handler.flush_event.is_set())
+
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_put_wakes_flush_on_max_batch_bytes(self, mock_thread):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"label1": "value1"},
+            max_batch_bytes=100,
+        )
+
+        handler._put({"message": "small"}, {})
+        self.assertFalse(handler.flush_event.is_set())
+
+        handler._put({"message": "x" * 200}, {})
+        self.assertTrue(handler.flush_event.is_set())
+
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_put_demotes_high_cardinality_labels(self, mock_thread):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"application": "Test"},
+            label_keys={"request_id"},
+            max_label_values=2,
+            enable_structured_loki_metadata=True,
+        )
+
+        for request_id in range(5):
+            handler._put({"message": "request", "request_id": request_id}, {})
+
+        logs = handler.buffer.drain()
+        self.assertEqual(len({log.key for log in logs}), 3)
+        self.assertEqual(logs[-1].labels, {"application": "Test"})
+        self.assertEqual(logs[-1].loki_metadata, {"request_id": 4})
+        self.assertEqual(handler.demoted_label_records, 3)
+        self.assertEqual(handler.stats()["labels_demoted"], 3)
+        self.assertEqual(handler.stats()["label_keys_demoted"], 1)
+        # A demotion is routine, it is only counted in the metrics
+        self.assertFalse(handler.error)
+
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_demoted_labels_stay_in_the_line_without_structured_metadata(self, mock_thread):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"application": "Test"},
+            label_keys={"request_id"},
+            max_label_values=2,
+        )
+
+        for request_id in range(5):
+            handler._put({"message": "request", "request_id": request_id}, {})
+
+        logs = handler.buffer.drain()
+        self.assertEqual(logs[-1].labels, {"application": "Test"})
+        self.assertIsNone(logs[-1].loki_metadata)
+        self.assertEqual(logs[-1].line["request_id"], 4)
+
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_put_formatted(self, mock_thread):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"application": "Test"},
+            label_keys={"worker"},
+            enable_structured_loki_metadata=True,
+        )
+
+        handler.put_formatted({"message": "forwarded", "worker": "2"}, {"trace_id": "1"})
+        handler.put_formatted({"message": "without metadata"})
+
+        logs = handler.buffer.drain()
+        self.assertEqual(logs[0].labels, {"application": "Test", "worker": "2"})
+        self.assertEqual(logs[0].loki_metadata, {"trace_id": "1"})
+        self.assertEqual(logs[1].line["message"], "without metadata")
+
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_deferred_formatting(self, mock_thread):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"application": "Test"},
+            label_keys={"worker"},
+            deferred_formatting=True,
+        )
+        logger = logging.getLogger("deferred_formatting_test")
+        logger.propagate = False
+        logger.addHandler(handler)
+
+        items = ["first"]
+        context = {"user": "alice"}
+        logger.warning("items %s, count %d", items, 1, extra={"worker": "1", "context": context})
+        items.append("second")
+        context["user"] = "bob"
+        values = {"user": "alice"}
+        logger.warning("user %(user)s", values)
+        values["user"] = "bob"
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("failed")
+
+        self.assertTrue(all(isinstance(item, DeferredRecord) for item, _ in handler.buffer._items))
+        with patch.object(handler.formatter.stacktraces, "format", wraps=handler.formatter.stacktraces.format) as format_stacktrace:
+            logs = handler._drain()
+
+        self.assertEqual(logs[0].line["message"], "items ['first'], count 1")
+        self.assertEqual(logs[0].line["context"], {"user": "alice"})
+        self.assertEqual(logs[0].labels, {"application": "Test", "worker": "1"})
+        self.assertEqual(logs[1].line["message"], "user alice")
+        self.assertIn("ValueError: boom", logs[2].line["stacktrace"])
+        self.assertIn("raise ValueError", logs[2].line["stacktrace"])
+        # The exception is formatted by the flush thread from its exc_info tuple
+        self.assertIsInstance(format_stacktrace.call_args[0][0], tuple)
+
+    def _send_chunked(self, **kwargs):
+        with patch("loki_logger_handler.loki_request.requests.Session"), \
+                patch("loki_logger_handler.loki_logger_handler.threading.Thread"):
+            handler = LokiLoggerHandler(
+                "http://test_url",
+                labels={"application": "Test"},
+                label_keys={"worker"},
+                max_request_bytes=2000,
+                **kwargs
+            )
+            for index in reversed(range(300)):
+                handler._put({"message": "line {}".format(index), "timestamp": 1700000000 + index,
+                              "worker": str(index % 2)}, {})
+            handler._send()
+            return handler, [c[1]["data"] for c in handler.request.session.post.call_args_list]
+
+    def test_send_splits_into_chunks(self):
+        handler, bodies = self._send_chunked()
+
+        self.assertGreater(len(bodies), 1)
+        lines = {}
+        for body in bodies:
+            self.assertLessEqual(len(body), 2000)
+            for stream in json.loads(body)["streams"]:
+                lines.setdefault(stream["stream"]["worker"], []).extend(
+                    int(value[0]) for value in stream["values"])
+
+        self.assertEqual(sum(len(timestamps) for timestamps in lines.values()), 300)
+        for timestamps in lines.values():
+            self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_send_splits_compressed_chunks(self):
+        handler, bodies = self._send_chunked(compressed=True)
+
+        total = 0
+        for body in bodies:
+            self.assertLessEqual(len(body), 2000)
+            total += sum(len(stream["values"]) for stream in json.loads(gzip.decompress(body))["streams"])
+        self.assertEqual(total, 300)
+
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    def test_sender_workers_keep_stream_order(self, mock_session):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"application": "Test"},
+            label_keys={"worker"},
+            max_request_bytes=1500,
+            sender_workers=3,
+            max_in_flight_batches=4,
+        )
+        self.addCleanup(handler.close)
+        lock = threading.Lock()
+        state = {"active": 0, "max_active": 0, "posted": 0}
+        received = {}
+
+        def post(body):
+            with lock:
+                state["active"] += 1
+                state["max_active"] = max(state["max_active"], state["active"])
+                for stream in json.loads(body)["streams"]:
+                    received.setdefault(stream["stream"]["worker"], []).extend(
+                        int(value[0]) for value in stream["values"])
+            time.sleep(0.01)
+            with lock:
+                state["active"] -= 1
+                state["posted"] += 1
+
+        handler.request.post = post
+
+        timestamp = 1700000000
+        for _ in range(2):
+            for _ in range(100):
+                timestamp += 1
+                handler._put({"message": "line", "timestamp": timestamp, "worker": str(timestamp % 6)}, {})
+            handler._send()
+
+        deadline = time.time() + 10
+        while sum(len(values) for values in received.values()) < 200 and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(sum(len(values) for values in received.values()), 200)
+        self.assertEqual(len(received), 6)
+        for timestamps in received.values():
+            self.assertEqual(timestamps, sorted(timestamps))
+        self.assertGreater(state["max_active"], 1)
+        self.assertLessEqual(state["max_active"], 3)
+
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    def test_sender_worker_requeues_its_queue_when_the_circuit_opens(self, mock_session):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"application": "Test"},
+            max_request_bytes=1500,
+            sender_workers=1,
+            max_in_flight_batches=20,
+            timeout=60,
+        )
+        self.addCleanup(handler.close)
+        posting = threading.Event()
+        release = threading.Event()
+        posts = []
+
+        def post(body):
+            posts.append(body)
+            posting.set()
+            release.wait(5)
+            raise CircuitOpenError("Circuit breaker is open, push skipped")
+
+        handler.request.post = post
+
+        for index in range(100):
+            handler._put({"message": "line {}".format(index), "timestamp": 1700000000 + index}, {})
+        handler._send()
+        posting.wait(5)
+        release.set()
+
+        deadline = time.time() + 5
+        while handler.buffer.qsize() < 100 and time.time() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(len(posts), 1)
+        self.assertEqual(
+            [log.line["message"] for log in handler.buffer.drain()], ["line {}".format(i) for i in range(100)]
+        )
+
+    def test_sender_workers_reject_spool(self):
+        with self.assertRaises(ValueError):
+            LokiLoggerHandler("http://test_url", labels={}, sender_workers=2, spool_directory="/tmp/spool")
+
+    @unittest.skipUnless(hasattr(os, "register_at_fork"), "requires os.register_at_fork")
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    def test_fork_resets_child_state(self, mock_session):
+        mock_session.side_effect = lambda: MagicMock()
+        handler = LokiLoggerHandler("http://test_url", labels={"application": "Test"}, timeout=60)
+        handler._put({"message": "owned by parent"}, {})
+        parent_session = handler.request.session
+
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                result = {
+                    "buffered": handler.buffer.qsize(),
+                    "new_session": handler.request.session is not parent_session,
+                    "parent_session_closed": parent_session.close.called,
+                    "thread_before_put": handler.flush_thread is not None,
+                }
+                handler._put({"message": "owned by child"}, {})
+                result["thread_alive"] = handler.flush_thread.is_alive()
+                result["lines"] = [log.line["message"] for log in handler.buffer.drain()]
+                os.write(write_end, json.dumps(result).encode("utf-8"))
+            finally:
+                os._exit(0)
+
+        os.close(write_end)
+        with os.fdopen(read_end) as f:
+            result = json.loads(f.read())
+        os.waitpid(pid, 0)
+
+        self.assertEqual(result, {
+            "buffered": 0,
+            "new_session": True,
+            "parent_session_closed": True,
+            "thread_before_put": False,
+            "thread_alive": True,
+            "lines": ["owned by child"],
+        })
+        self.assertEqual([log.line["message"] for log in handler.buffer.drain()], ["owned by parent"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+import logging
+import threading
+import unittest
+
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler
+from loki_logger_handler.metrics import Metrics
+from loki_logger_handler.retry import RetryPolicy
+
+from tests.loki_server import LokiServer
+
+
+class TestMetrics(unittest.TestCase):
+    def test_merges_the_thread_shards(self):
+        metrics = Metrics()
+
+        def work():
+            for _ in range(1000):
+                metrics.increment("records_enqueued")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.increment("bytes_compressed", 10)
+
+        stats = metrics.stats()
+        self.assertEqual(stats["records_enqueued"], 4000)
+        self.assertEqual(stats["bytes_compressed"], 10)
+
+    def test_shards_of_ended_threads_are_merged(self):
+        metrics = Metrics()
+
+        def work():
+            metrics.increment("records_enqueued")
+            metrics.observe("batch_records", 10)
+
+        for _ in range(50):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(len(metrics._shards), 0)
+        stats = metrics.stats()
+        self.assertEqual(stats["records_enqueued"], 50)
+        self.assertEqual(stats["batch_records"]["count"], 50)
+        self.assertEqual(stats["batch_records"]["sum"], 500)
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics = Metrics()
+        for value in (1, 7, 70, 10 ** 6):
+            metrics.observe("batch_records", value)
+
+        histogram = metrics.stats()["batch_records"]
+
+        self.assertEqual(histogram["count"], 4)
+        self.assertEqual(histogram["sum"], 1 + 7 + 70 + 10 ** 6)
+        self.assertEqual(histogram["buckets"][1], 1)
+        self.assertEqual(histogram["buckets"][10], 2)
+        self.assertEqual(histogram["buckets"][100], 3)
+        self.assertEqual(histogram["buckets"]["+Inf"], 4)
+
+    def test_collected_values(self):
+        metrics = Metrics(lambda: {"records_dropped": 3, "queue_records": 5})
+        metrics.increment("records_enqueued")
+
+        stats = metrics.stats()
+
+        self.assertEqual(stats["records_dropped"], 3)
+        self.assertEqual(stats["queue_records"], 5)
+
+    def test_render_prometheus(self):
+        metrics = Metrics()
+        metrics.increment("records_sent", 2)
+        metrics.observe("push_latency_seconds", 0.02)
+
+        text = metrics.render_prometheus(prefix="app_loki")
+
+        self.assertIn("# TYPE app_loki_records_sent_total counter\napp_loki_records_sent_total 2\n", text)
+        self.assertIn("# TYPE app_loki_queue_records gauge\n", text)
+        self.assertIn('app_loki_push_latency_seconds_bucket{le="0.01"} 0\n', text)
+        self.assertIn('app_loki_push_latency_seconds_bucket{le="0.025"} 1\n', text)
+        self.assertIn('app_loki_push_latency_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn("app_loki_push_latency_seconds_count 1\n", text)
+
+
+class TestHandlerMetrics(unittest.TestCase):
+    def setUp(self):
+        self.server = LokiServer().start()
+        self.addCleanup(self.server.stop)
+
+    def _logger(self, handler):
+        logger = logging.getLogger("test_metrics_{}".format(id(handler)))
+        logger.propagate = False
+        logger.addHandler(handler)
+        return logger
+
+    def test_counts_records_bytes_and_pushes(self):
+        handler = LokiLoggerHandler(self.server.url, labels={"application": "Test"}, timeout=60, compressed=True)
+        logger = self._logger(handler)
+        for index in range(10):
+            logger.warning("record %d", index)
+
+        handler._send()
+        stats = handler.stats()
+
+        self.assertEqual(len(self.server.lines), 10)
+        self.assertEqual(stats["records_enqueued"], 10)
+        self.assertEqual(stats["records_sent"], 10)
+        self.assertEqual(stats["pushes"], 1)
+        self.assertEqual(stats["queue_records"], 0)
+        self.assertGreater(stats["bytes_uncompressed"], stats["bytes_compressed"])
+        self.assertEqual(stats["batch_records"]["sum"], 10)
+        self.assertEqual(stats["push_latency_seconds"]["count"], 1)
+        self.assertEqual(stats["emit_to_ack_seconds"]["count"], 1)
+        self.assertLess(stats["emit_to_ack_seconds"]["sum"], 60)
+
+    def test_counts_failed_pushes(self):
+        self.server.responses = [400]
+        handler = LokiLoggerHandler(self.server.url, labels={"application": "Test"}, timeout=60,
+                                    retry_policy=RetryPolicy(max_attempts=1))
+        logger = self._logger(handler)
+        logger.warning("rejected")
+        logger.warning("rejected too")
+
+        handler._send()
+        stats = handler.stats()
+
+        self.assertEqual(stats["push_failures"], 1)
+        self.assertEqual(stats["records_failed"], 2)
+        self.assertEqual(stats["records_sent"], 0)
+        self.assertTrue(handler.error)
+
+
+if __name__ == "__main__":
+    unittest.main()
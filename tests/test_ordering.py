@@ -0,0 +1,103 @@
+import json
+import logging
+import threading
+import unittest
+
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler, LogLine
+from loki_logger_handler.stream import Stream
+
+from tests.loki_server import LokiServer
+
+
+class TestStreamTimestamps(unittest.TestCase):
+    def test_nanosecond_timestamp(self):
+        stream = Stream({"application": "Test"})
+        stream.append_value({"message": "first", "timestamp": 1700000000.123456}, timestamp_ns=1700000000123456789)
+        stream.append_value({"message": "second", "timestamp": 1700000001})
+
+        self.assertEqual([value[0] for value in stream.values], ["1700000000123456789", "1700000001000000000"])
+
+    def test_log_line_timestamp(self):
+        self.assertEqual(LogLine({"a": "b"}, {"timestamp": 1700000000}).timestamp_ns, 1700000000000000000)
+        self.assertIsNone(LogLine({"a": "b"}, "plain text").timestamp_ns)
+        self.assertEqual(LogLine({"a": "b"}, "plain text", timestamp_ns=5).timestamp_ns, 5)
+
+
+class TestOrderingUnderConcurrency(unittest.TestCase):
+    THREADS = 8
+    RECORDS = 300
+
+    def setUp(self):
+        self.server = LokiServer(ordered=True).start()
+        self.addCleanup(self.server.stop)
+
+    def _handler(self, **kwargs):
+        handler = LokiLoggerHandler(
+            self.server.url, labels={"application": "Test"}, timeout=60, max_batch_lines=50, **kwargs
+        )
+        self.addCleanup(handler.close, 1)
+        return handler
+
+    def _timestamps(self):
+        timestamps = []
+        for streams in self.server.pushes:
+            for stream in streams:
+                timestamps.extend(int(value[0]) for value in stream["values"])
+        return timestamps
+
+    def _log_concurrently(self, handler):
+        logger = logging.getLogger("test_ordering_{}".format(id(handler)))
+        logger.propagate = False
+        logger.addHandler(handler)
+
+        def work(worker):
+            for index in range(self.RECORDS):
+                logger.warning("worker %d record %d", worker, index)
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(handler.flush(10))
+
+    def test_no_entry_rejected_as_out_of_order(self):
+        for options in ({}, {"deferred_formatting": True}, {"sender_workers": 2}, {"payload_format": "protobuf"}):
+            with self.subTest(**options):
+                received = self.server.received
+                self._log_concurrently(self._handler(**options))
+
+                self.assertEqual(self.server.out_of_order, 0)
+                self.assertEqual(self.server.received - received, self.THREADS * self.RECORDS)
+
+        timestamps = self._timestamps()
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(len(set(timestamps)), len(timestamps))
+
+    def test_monotonic_timestamps(self):
+        def put_batches(handler):
+            # Two pushes of a stream, the second holding older and duplicated timestamps
+            for timestamps in ((1700000000, 1700000002, 1700000002), (1700000001, 1700000002)):
+                for timestamp in timestamps:
+                    handler._put({"message": "at {}".format(timestamp), "timestamp": timestamp}, {})
+                self.assertTrue(handler.flush(5))
+
+        put_batches(self._handler())
+        self.assertEqual(self.server.out_of_order, 1)
+
+        self.server.ordered = False
+        self.server.pushes = []
+        put_batches(self._handler(monotonic_timestamps=True))
+
+        timestamps = self._timestamps()
+        self.assertEqual(timestamps, [
+            1700000000000000000, 1700000002000000000, 1700000002000000001,
+            1700000002000000002, 1700000002000000003,
+        ])
+        messages = [json.loads(value[1])["message"] for streams in self.server.pushes
+                    for stream in streams for value in stream["values"]]
+        self.assertEqual(messages[3:], ["at 1700000001", "at 1700000002"])
+
+
+if __name__ == "__main__":
+    unittest.main()
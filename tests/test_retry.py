@@ -0,0 +1,110 @@
+import time
+import unittest
+from email.utils import formatdate
+
+try:
+    from unittest.mock import patch, Mock, MagicMock  # Python 3.x
+except ImportError:
+    from mock import patch, Mock, MagicMock  # Python 2.7
+
+import requests
+
+from loki_logger_handler.loki_request import LokiRequest
+from loki_logger_handler.retry import RetryPolicy
+
+
+def _response(status_code, headers=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(str(status_code))
+    return response
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_delay_is_bounded_by_exponential_ceiling(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        for attempt, ceiling in ((1, 1), (2, 2), (3, 4), (4, 5), (10, 5)):
+            for _ in range(50):
+                self.assertTrue(0 <= policy.compute_delay(attempt) <= ceiling)
+
+    def test_retry_after_takes_precedence(self):
+        policy = RetryPolicy(max_delay=30)
+        self.assertEqual(policy.compute_delay(1, retry_after=7), 7)
+        self.assertEqual(policy.compute_delay(1, retry_after=120), 30)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(RetryPolicy.parse_retry_after("3"), 3.0)
+        self.assertIsNone(RetryPolicy.parse_retry_after(None))
+        self.assertIsNone(RetryPolicy.parse_retry_after("soon"))
+        delay = RetryPolicy.parse_retry_after(formatdate(time.time() + 60, usegmt=True))
+        self.assertTrue(55 <= delay <= 61)
+
+    def test_should_retry(self):
+        policy = RetryPolicy(max_attempts=3)
+        self.assertTrue(policy.should_retry(1, 503))
+        self.assertTrue(policy.should_retry(1, None))
+        self.assertFalse(policy.should_retry(1, 400))
+        self.assertFalse(policy.should_retry(3, 503))
+
+
+@patch("loki_logger_handler.loki_request.requests.Session")
+class TestLokiRequestRetries(unittest.TestCase):
+    def _request(self, responses, **policy):
+        request = LokiRequest("http://loki", retry_policy=RetryPolicy(**policy))
+        request.session.post.side_effect = responses
+        request._interrupt = Mock()
+        request._interrupt.wait.return_value = False
+        return request
+
+    def test_retries_until_success(self, mock_session):
+        request = self._request([_response(503), _response(429, {"Retry-After": "2"}), _response(204)],
+                                base_delay=0.1)
+
+        request.post(b"body")
+
+        self.assertEqual(request.session.post.call_count, 3)
+        self.assertEqual(request.retries, 2)
+        self.assertEqual(request._interrupt.wait.call_args_list[1][0][0], 2)
+
+    def test_retries_connection_errors(self, mock_session):
+        request = self._request([requests.ConnectionError("refused"), _response(204)])
+
+        request.post(b"body")
+
+        self.assertEqual(request.session.post.call_count, 2)
+
+    def test_does_not_retry_client_errors(self, mock_session):
+        request = self._request([_response(400), _response(204)])
+
+        with self.assertRaises(requests.RequestException):
+            request.post(b"body")
+        self.assertEqual(request.session.post.call_count, 1)
+
+    def test_gives_up_after_max_attempts(self, mock_session):
+        request = self._request([_response(503)] * 3, max_attempts=3)
+
+        with self.assertRaises(requests.RequestException):
+            request.post(b"body")
+        self.assertEqual(request.session.post.call_count, 3)
+
+    def test_does_not_retry_without_a_policy(self, mock_session):
+        request = LokiRequest("http://loki")
+        request.session.post.side_effect = [_response(503), _response(204)]
+
+        with self.assertRaises(requests.RequestException):
+            request.post(b"body")
+        self.assertEqual(request.session.post.call_count, 1)
+
+    def test_interrupt_stops_retrying(self, mock_session):
+        request = self._request([_response(503), _response(204)])
+        request._interrupt.wait.return_value = True
+
+        with self.assertRaises(requests.RequestException):
+            request.post(b"body")
+        self.assertEqual(request.session.post.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import dataclasses
+import datetime
+import enum
+import json
+import unittest
+
+from loki_logger_handler.serializers import JSON_BACKENDS, available_backends, get_serializer
+
+
+class Color(enum.Enum):
+    RED = "r"
+
+
+@dataclasses.dataclass
+class Point(object):
+    x: int
+
+
+class TestSerializers(unittest.TestCase):
+    VALUE = {
+        "message": "café ☃ \"quoted\" /path",
+        "count": 3,
+        "ratio": float("nan"),
+        "limits": [float("inf"), 1.5],
+        "when": datetime.date(2024, 1, 2),
+        "nested": {"ok": True, "none": None},
+        "at": datetime.datetime(2024, 1, 2, 3, 4, 5),
+        "color": Color.RED,
+        "point": Point(x=1),
+        "items": [Color.RED, {"at": datetime.time(3, 4)}],
+    }
+    EXPECTED = {
+        "message": "café ☃ \"quoted\" /path",
+        "count": 3,
+        "ratio": None,
+        "limits": [None, 1.5],
+        "when": "2024-01-02",
+        "nested": {"ok": True, "none": None},
+        "at": "2024-01-02 03:04:05",
+        "color": "Color.RED",
+        "point": "Point(x=1)",
+        "items": ["Color.RED", {"at": "03:04:00"}],
+    }
+
+    def test_backends_agree(self):
+        self.assertIn("json", available_backends())
+        for backend in available_backends():
+            serializer = get_serializer(backend)
+            dumped = serializer.dumps(self.VALUE)
+            self.assertIn("café", dumped, backend)
+            self.assertEqual(json.loads(dumped), self.EXPECTED, backend)
+
+    def test_entries_agree(self):
+        expected = get_serializer("json").dumps(["1700000000000000000", "line é\n\"x\"", {"trace_id": "1"}])
+        for backend in available_backends():
+            serializer = get_serializer(backend)
+            self.assertEqual(
+                serializer.dumps_entry("1700000000000000000", "line é\n\"x\"", {"trace_id": "1"}), expected, backend)
+            self.assertEqual(json.loads(serializer.dumps_entry("1", "plain")), ["1", "plain"], backend)
+
+    def test_unknown_or_missing_backend(self):
+        with self.assertRaises(ValueError):
+            get_serializer("yaml")
+        missing = [backend for backend in JSON_BACKENDS if backend not in available_backends()]
+        for backend in missing:
+            with self.assertRaises(ValueError):
+                get_serializer(backend)
+
+
+if __name__ == "__main__":
+    unittest.main()
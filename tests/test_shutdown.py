@@ -0,0 +1,150 @@
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler
+from loki_logger_handler.retry import RetryPolicy
+
+from tests.loki_server import LokiServer
+
+
+class TestFlushAndClose(unittest.TestCase):
+    def setUp(self):
+        self.server = LokiServer().start()
+        self.addCleanup(self.server.stop)
+
+    def _handler(self, **kwargs):
+        handler = LokiLoggerHandler(self.server.url, labels={"application": "Test"}, timeout=60, **kwargs)
+        logger = logging.getLogger("test_shutdown_{}".format(id(handler)))
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(handler.close, 1)
+        return handler, logger
+
+    def test_flush_waits_for_the_acknowledgement(self):
+        handler, logger = self._handler()
+        for index in range(10):
+            logger.warning("record %d", index)
+
+        self.assertTrue(handler.flush(5))
+
+        self.assertEqual(self.server.received, 10)
+        self.assertTrue(handler.flush(5))
+
+    def test_flush_waits_for_the_sender_workers(self):
+        handler, logger = self._handler(sender_workers=2, label_keys={"worker": "worker"})
+        for index in range(20):
+            logger.warning("record %d", index, extra={"worker": str(index % 4)})
+
+        self.assertTrue(handler.flush(5))
+
+        self.assertEqual(self.server.received, 20)
+
+    def test_close_pushes_and_stops_the_threads(self):
+        handler, logger = self._handler(sender_workers=1)
+        logger.warning("last words")
+
+        self.assertTrue(handler.close(5))
+
+        self.assertEqual(self.server.received, 1)
+        self.assertFalse(handler.flush_thread.is_alive())
+        self.assertFalse(handler.sender_threads[0].is_alive())
+        self.assertTrue(handler.close(5))
+
+    def test_flush_and_close_are_bounded(self):
+        self.server.delay = 1
+        handler, logger = self._handler(retry_policy=RetryPolicy(max_attempts=1))
+        logger.warning("slow")
+
+        start = time.monotonic()
+        self.assertFalse(handler.flush(0.1))
+        self.assertFalse(handler.close(0.2))
+        self.assertLess(time.monotonic() - start, 0.8)
+
+    def test_flush_after_close_does_not_wait(self):
+        handler, logger = self._handler()
+        self.assertTrue(handler.close(5))
+
+        self.server.delay = 1
+        handler.buffer.put(handler.buffer, 0)
+        start = time.monotonic()
+        self.assertFalse(handler.flush(5))
+        self.assertLess(time.monotonic() - start, 0.5)
+        handler.buffer.drain()
+
+    def test_close_pushes_the_records_emitted_during_the_final_flush(self):
+        handler, logger = self._handler()
+        flush_and_wait = handler._flush_and_wait
+
+        def flush_then_log(timeout):
+            flushed = flush_and_wait(timeout)
+            logger.warning("late")
+            return flushed
+
+        handler._flush_and_wait = flush_then_log
+        logger.warning("early")
+
+        self.assertTrue(handler.close(5))
+        self.assertEqual(self.server.received, 2)
+
+    def test_sends_never_overlap(self):
+        handler, logger = self._handler()
+        active = []
+        overlaps = []
+        post = handler.request.post
+
+        def tracking_post(body, *args):
+            active.append(body)
+            if len(active) > 1:
+                overlaps.append(len(active))
+            time.sleep(0.01)
+            active.remove(body)
+            post(body, *args)
+
+        handler.request.post = tracking_post
+
+        def work():
+            for index in range(5):
+                logger.warning("record %d", index)
+                handler._send()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for index in range(5):
+            logger.warning("flushed %d", index)
+            handler.flush(5)
+        for thread in threads:
+            thread.join()
+        handler.flush(5)
+
+        self.assertEqual(overlaps, [])
+        self.assertEqual(self.server.received, 25)
+
+
+class TestExit(unittest.TestCase):
+    def test_buffered_records_are_pushed_when_the_interpreter_exits(self):
+        server = LokiServer().start()
+        self.addCleanup(server.stop)
+        script = (
+            "import logging\n"
+            "from loki_logger_handler.loki_logger_handler import LokiLoggerHandler\n"
+            "handler = LokiLoggerHandler({!r}, labels={{'application': 'Test'}}, timeout=60)\n"
+            "logging.getLogger('job').addHandler(handler)\n"
+            "logging.getLogger('job').warning('done')\n"
+        ).format(server.url)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+        start = time.monotonic()
+        subprocess.check_call([sys.executable, "-c", script], cwd=root, timeout=30)
+
+        self.assertEqual(server.received, 1)
+        self.assertLess(time.monotonic() - start, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
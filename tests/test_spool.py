@@ -0,0 +1,203 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+try:
+    from unittest.mock import patch, MagicMock  # Python 3.x
+except ImportError:
+    from mock import patch, MagicMock  # Python 2.7
+
+import requests
+
+from loki_logger_handler.loki_logger_handler import LokiLoggerHandler
+from loki_logger_handler.spool import Spool, SpoolLockedError
+
+
+class _Collector(object):
+    def __init__(self, fail_after=None):
+        self.bodies = []
+        self.fail_after = fail_after
+
+    def __call__(self, body, content_type, content_encoding):
+        if self.fail_after is not None and len(self.bodies) >= self.fail_after:
+            raise requests.ConnectionError("Loki is down")
+        self.bodies.append((body, content_type, content_encoding))
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def _open(self, **kwargs):
+        spool = Spool(self.directory, **kwargs)
+        self.addCleanup(spool.close)
+        return spool
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(".seg"))
+
+    def test_replay_in_order(self):
+        spool = self._open()
+        spool.append(b"first", "application/json", "gzip")
+        spool.append(b"second", "application/x-protobuf")
+
+        collector = _Collector()
+        self.assertEqual(spool.replay(collector), 2)
+
+        self.assertEqual(collector.bodies, [
+            (b"first", "application/json", "gzip"),
+            (b"second", "application/x-protobuf", None),
+        ])
+        self.assertFalse(spool.pending())
+
+    def test_failed_frame_stays_spooled(self):
+        spool = self._open(segment_max_bytes=64)
+        for index in range(5):
+            spool.append("body-{}".format(index).encode(), "application/json")
+
+        with self.assertRaises(requests.ConnectionError):
+            spool.replay(_Collector(fail_after=2))
+        self.assertTrue(spool.pending())
+
+        collector = _Collector()
+        spool.replay(collector)
+        self.assertEqual([body for body, _, _ in collector.bodies], [b"body-2", b"body-3", b"body-4"])
+        self.assertEqual(len(self._segments()), 1)
+
+    def test_restart_resumes_after_acknowledged_frames(self):
+        spool = self._open()
+        for index in range(3):
+            spool.append("body-{}".format(index).encode(), "application/json")
+        with self.assertRaises(requests.ConnectionError):
+            spool.replay(_Collector(fail_after=1))
+        spool.close()
+
+        reopened = self._open()
+        collector = _Collector()
+        reopened.replay(collector)
+        self.assertEqual([body for body, _, _ in collector.bodies], [b"body-1", b"body-2"])
+
+    def test_torn_write_is_discarded(self):
+        spool = self._open()
+        spool.append(b"complete", "application/json")
+        spool.close()
+        with open(os.path.join(self.directory, self._segments()[-1]), "ab") as f:
+            f.write(b"LKSP\x10\x00")
+
+        reopened = self._open()
+        reopened.append(b"after crash", "application/json")
+        collector = _Collector()
+        reopened.replay(collector)
+        self.assertEqual([body for body, _, _ in collector.bodies], [b"complete", b"after crash"])
+
+    def test_max_bytes_evicts_oldest_segments(self):
+        spool = self._open(segment_max_bytes=100, max_bytes=250)
+        for index in range(10):
+            spool.append(("body-{}".format(index) * 10).encode(), "application/json")
+
+        self.assertGreater(spool.dropped_bytes, 0)
+        collector = _Collector()
+        spool.replay(collector)
+        self.assertEqual(collector.bodies[-1][0], b"body-9" * 10)
+        self.assertLess(len(collector.bodies), 10)
+
+    @unittest.skipUnless(os.name == "posix", "requires fcntl")
+    def test_directory_is_locked_while_open(self):
+        spool = self._open()
+
+        with self.assertRaises(SpoolLockedError):
+            Spool(self.directory)
+
+        spool.close()
+        self._open().append(b"reopened", "application/json")
+
+
+class TestHandlerSpool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_batches_survive_outage(self, mock_thread, mock_session):
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"application": "Test"},
+            spool_directory=self.directory,
+        )
+        self.addCleanup(handler.close)
+        handler.request._interrupt.set()
+        post = handler.request.session.post
+
+        post.side_effect = requests.ConnectionError("Loki is down")
+        handler._put({"message": "during outage", "timestamp": 1700000000}, {})
+        handler._send()
+        self.assertTrue(handler.spool.pending())
+        self.assertTrue(handler.error)
+
+        post.side_effect = None
+        post.return_value = MagicMock(status_code=204)
+        handler._put({"message": "after outage", "timestamp": 1700000001}, {})
+        handler._send()
+
+        self.assertFalse(handler.spool.pending())
+        self.assertEqual(post.call_count, 3)
+        bodies = [c[1]["data"] for c in post.call_args_list[1:]]
+        self.assertIn(b"during outage", bodies[0])
+        self.assertIn(b"after outage", bodies[1])
+
+    @unittest.skipUnless(os.name == "posix", "requires POSIX process ids")
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_spools_of_exited_workers_are_replayed(self, mock_thread, mock_session):
+        exited = subprocess.Popen([sys.executable, "-c", "pass"])
+        exited.wait()
+        stale = Spool(os.path.join(self.directory, "worker-{}".format(exited.pid)))
+        stale.append(b"left by an exited worker", "application/json")
+        stale.close()
+        live = Spool(os.path.join(self.directory, "worker-{}".format(os.getppid())))
+        live.append(b"owned by a live worker", "application/json")
+        live.close()
+
+        handler = LokiLoggerHandler(
+            "http://test_url",
+            labels={"application": "Test"},
+            spool_directory=self.directory,
+        )
+        self.addCleanup(handler.close)
+        post = handler.request.session.post
+        post.return_value = MagicMock(status_code=204)
+        self.assertTrue(handler._spool_pending())
+
+        handler._send()
+
+        self.assertEqual([c[1]["data"] for c in post.call_args_list], [b"left by an exited worker"])
+        self.assertFalse(handler._spool_pending())
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.directory) if name.startswith("worker-")),
+            ["worker-{}".format(os.getppid())],
+        )
+
+    @unittest.skipUnless(os.name == "posix", "requires fcntl")
+    @patch("loki_logger_handler.loki_request.requests.Session")
+    @patch("loki_logger_handler.loki_logger_handler.threading.Thread")
+    def test_locked_directory_falls_back_to_a_worker_subdirectory(self, mock_thread, mock_session):
+        handlers = [
+            LokiLoggerHandler("http://test_url", labels={"application": "Test"}, spool_directory=self.directory)
+            for _ in range(2)
+        ]
+        for handler in handlers:
+            self.addCleanup(handler.close)
+
+        self.assertEqual(handlers[0].spool.directory, self.directory)
+        self.assertEqual(
+            handlers[1].spool.directory, os.path.join(self.directory, "worker-{}".format(os.getpid()))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
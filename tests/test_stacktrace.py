@@ -0,0 +1,83 @@
+import sys
+import traceback
+import unittest
+
+try:
+    from unittest.mock import patch  # Python 3.x
+except ImportError:
+    from mock import patch  # Python 2.7
+
+from loki_logger_handler.formatters.stacktrace import StacktraceFormatter
+
+
+def _fail(message):
+    try:
+        try:
+            {}["missing"]
+        except KeyError as e:
+            raise ValueError(message) from e
+    except ValueError:
+        return sys.exc_info()
+
+
+def _fail_during_handling():
+    try:
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            raise RuntimeError("while handling")
+    except RuntimeError:
+        return sys.exc_info()
+
+
+class TestStacktraceFormatter(unittest.TestCase):
+    def test_matches_traceback_module(self):
+        formatter = StacktraceFormatter()
+        for exc_info in (_fail("first"), _fail_during_handling()):
+            expected = "".join(traceback.format_exception(*exc_info))
+            self.assertEqual(formatter.format(exc_info), expected)
+            self.assertEqual(formatter.format(exc_info), expected)
+        self.assertIsNone(formatter.format(None))
+        self.assertIsNone(formatter.format((None, None, None)))
+
+    def test_reuses_rendered_frames(self):
+        formatter = StacktraceFormatter()
+
+        with patch("loki_logger_handler.formatters.stacktrace.traceback.extract_tb",
+                   wraps=traceback.extract_tb) as extract_tb:
+            first = formatter.format(_fail("first"))
+            second = formatter.format(_fail("second"))
+
+        self.assertEqual(extract_tb.call_count, 2)  # the two chained exceptions, once
+        self.assertIn("ValueError: first", first)
+        self.assertIn("ValueError: second", second)
+        self.assertEqual(second, "".join(traceback.format_exception(*_fail("second"))))
+
+    def test_cache_is_bounded(self):
+        formatter = StacktraceFormatter(max_entries=1)
+
+        formatter.format(_fail("first"))
+        formatter.format(_fail_during_handling())
+
+        self.assertEqual(len(formatter._cache), 1)
+
+    def test_dedup_window(self):
+        formatter = StacktraceFormatter(dedup_window=60)
+
+        first = formatter.format(_fail("first"))
+        second = formatter.format(_fail("second"))
+        third = formatter.format(_fail("third"))
+        other = formatter.format(_fail_during_handling())
+
+        fingerprint = first.rsplit("[stacktrace ", 1)[1].rstrip("]\n")
+        self.assertIn("Traceback (most recent call last):", first)
+        self.assertNotIn("Traceback", second)
+        self.assertIn("ValueError: second", second)
+        self.assertTrue(second.endswith("[stacktrace {} repeated 1 times]\n".format(fingerprint)))
+        self.assertTrue(third.endswith("[stacktrace {} repeated 2 times]\n".format(fingerprint)))
+        self.assertIn("Traceback (most recent call last):", other)
+        self.assertNotIn(fingerprint, other)
+
+
+if __name__ == "__main__":
+    unittest.main()
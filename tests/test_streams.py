@@ -0,0 +1,30 @@
+import json
+import unittest
+
+from loki_logger_handler.stream import Stream
+from loki_logger_handler.streams import Streams
+
+
+class TestStreamsSerialize(unittest.TestCase):
+    def test_only_loki_schema_fields(self):
+        stream = Stream({"application": "Test"}, loki_metadata={"service": "api"})
+        stream.append_value({"message": "first ü", "timestamp": 1700000000.5})
+        stream.append_value({"message": "second", "timestamp": 1700000001}, {"trace_id": 1})
+        other = Stream({"application": "Other"}, message_in_json_format=False)
+        other.append_value("plain", None)
+
+        payload = json.loads(Streams([stream, other]).serialize())
+
+        self.assertEqual(sorted(payload["streams"][0]), ["stream", "values"])
+        self.assertEqual(payload["streams"][0]["values"], stream.values)
+        self.assertEqual(payload["streams"][0]["values"][1][2], {"service": "api", "trace_id": "1"})
+        self.assertEqual(json.loads(payload["streams"][0]["values"][0][1])["message"], "first ü")
+        self.assertEqual(payload["streams"][1], {"stream": {"application": "Other"}, "values": other.values})
+
+    def test_empty(self):
+        self.assertEqual(json.loads(Streams().serialize()), {"streams": []})
+        self.assertEqual(json.loads(Stream({"a": "b"}).serialize()), {"stream": {"a": "b"}, "values": []})
+
+
+if __name__ == "__main__":
+    unittest.main()
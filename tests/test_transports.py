@@ -0,0 +1,115 @@
+import json
+import socket
+import threading
+import unittest
+
+import requests
+
+from loki_logger_handler.loki_request import LokiRequest
+from loki_logger_handler.retry import RetryPolicy
+from loki_logger_handler.transports import HTTPClientTransport, create_transport
+
+from tests.loki_server import LokiServer
+
+
+def _body(*lines):
+    values = [["{}".format(1700000000000000000 + index), line] for index, line in enumerate(lines)]
+    return json.dumps({"streams": [{"stream": {"application": "Test"}, "values": values}]})
+
+
+class TestHTTPClientTransport(unittest.TestCase):
+    def setUp(self):
+        self.server = LokiServer().start()
+        self.addCleanup(self.server.stop)
+
+    def test_pushes_over_one_kept_alive_connection(self):
+        request = LokiRequest(self.server.url, transport="http.client", compressed=True)
+
+        for index in range(5):
+            request.send(_body("line {}".format(index)))
+        request.close()
+
+        self.assertEqual(self.server.lines, ["line {}".format(index) for index in range(5)])
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(request.session.connections_opened, 1)
+
+    def test_error_status_raises_with_response(self):
+        self.server.responses = [400]
+        request = LokiRequest(self.server.url, transport="http.client")
+
+        with self.assertRaises(requests.RequestException) as raised:
+            request.send(_body("rejected"))
+        self.assertEqual(raised.exception.response.status_code, 400)
+
+    def test_retries_on_the_kept_alive_connection(self):
+        self.server.responses = [503]
+        request = LokiRequest(self.server.url, transport="http.client", retry_policy=RetryPolicy(base_delay=0))
+
+        request.send(_body("retried"))
+
+        self.assertEqual(self.server.lines, ["retried"])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_reconnects_when_the_connection_went_stale(self):
+        transport = HTTPClientTransport()
+        headers = {"Content-Type": "application/json"}
+        transport.post(self.server.url, _body("first").encode("utf-8"), headers=headers)
+        # Simulate the server closing the idle connection
+        transport._idle[0].sock.shutdown(socket.SHUT_RDWR)
+
+        response = transport.post(self.server.url, _body("second").encode("utf-8"), headers=headers)
+
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.server.lines, ["first", "second"])
+        self.assertEqual(transport.connections_opened, 2)
+
+    def test_does_not_resend_a_request_answered_in_part(self):
+        # Answers the first request, then closes the connection in the middle of the second answer
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+        self.addCleanup(server.close)
+        received = []
+
+        def serve():
+            connection, _ = server.accept()
+            with connection:
+                for answer in (b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n", b"HTTP/1.1 20"):
+                    received.append(connection.recv(65536))
+                    connection.sendall(answer)
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        self.addCleanup(thread.join)
+        url = "http://127.0.0.1:{}/loki/api/v1/push".format(server.getsockname()[1])
+        transport = HTTPClientTransport()
+
+        transport.post(url, b"first", timeout=1)
+        with self.assertRaises(requests.ConnectionError):
+            transport.post(url, b"second", timeout=1)
+
+        self.assertEqual(transport.connections_opened, 1)
+        self.assertEqual(len(received), 2)
+
+    def test_read_timeout(self):
+        self.server.delay = 0.5
+        transport = HTTPClientTransport()
+
+        with self.assertRaises(requests.ReadTimeout):
+            transport.post(self.server.url, b"{}", timeout=(1, 0.1))
+
+
+class TestCreateTransport(unittest.TestCase):
+    def test_requests_session_pool_size(self):
+        session = create_transport("requests", pool_maxsize=4)
+
+        self.assertIsInstance(session, requests.Session)
+        self.assertEqual(session.get_adapter("http://loki").poolmanager.connection_pool_kw["maxsize"], 4)
+
+    def test_unknown_transport(self):
+        with self.assertRaises(ValueError):
+            LokiRequest("http://loki", transport="curl")
+
+
+if __name__ == "__main__":
+    unittest.main()